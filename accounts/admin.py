@@ -1,7 +1,11 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
+from django.db.models import Count
 from django.utils.html import format_html
 from django.urls import reverse
+from reports import moderation
+from reports.models import IncidentReport
+
 from .models import CustomUser
 
 
@@ -14,6 +18,9 @@ class CustomUserAdmin(UserAdmin):
     date_hierarchy = 'date_joined'
     list_per_page = 25
     
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(report_total=Count('incidentreport'))
+    
     def full_name(self, obj):
         name = f"{obj.first_name} {obj.last_name}".strip()
         return name if name else '-'
@@ -51,12 +58,13 @@ class CustomUserAdmin(UserAdmin):
     profile_picture_preview.short_description = 'Avatar'
     
     def report_count(self, obj):
-        count = obj.incidentreport_set.count()
+        count = obj.report_total
         if count > 0:
             url = reverse('admin:reports_incidentreport_changelist') + f'?user__id__exact={obj.id}'
             return format_html('<a href="{}" class="badge badge-primary">{}</a>', url, count)
         return format_html('<span class="badge badge-secondary">0</span>')
     report_count.short_description = 'Reports'
+    report_count.admin_order_field = 'report_total'
     
     def id_document_preview(self, obj):
         if obj.id_document:
@@ -81,11 +89,14 @@ class CustomUserAdmin(UserAdmin):
     
     def verify_users(self, request, queryset):
         updated = queryset.update(is_verified=True)
+        # A verified reporter moves their pending reports up the moderation queue
+        moderation.refresh(IncidentReport.objects.filter(user__in=queryset))
         self.message_user(request, f'{updated} user(s) verified.')
     verify_users.short_description = 'Verify selected users'
     
     def unverify_users(self, request, queryset):
         updated = queryset.update(is_verified=False)
+        moderation.refresh(IncidentReport.objects.filter(user__in=queryset))
         self.message_user(request, f'{updated} user(s) unverified.')
     unverify_users.short_description = 'Unverify selected users'
 
@@ -1,10 +1,12 @@
 from django.contrib.auth.models import AbstractUser
+from django.conf import settings
 from django.db import models
 
 # Try to import Cloudinary storage, fallback to default if not available
+# (or not configured, matching DEFAULT_FILE_STORAGE in settings)
 try:
     from cloudinary_storage.storage import MediaCloudinaryStorage
-    CLOUDINARY_STORAGE_AVAILABLE = True
+    CLOUDINARY_STORAGE_AVAILABLE = bool(getattr(settings, 'CLOUDINARY_STORAGE', {}).get('CLOUD_NAME'))
 except ImportError:
     MediaCloudinaryStorage = None
     CLOUDINARY_STORAGE_AVAILABLE = False
@@ -0,0 +1,49 @@
+"""Query-count regression test for the user admin changelist"""
+from unittest import mock
+
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from reports.models import IncidentReport
+
+from .admin import CustomUserAdmin
+from .models import CustomUser
+
+# Rows shown per page; the largest is also the number of users created
+ROW_COUNTS = (5, 25, 100)
+
+
+class UserChangelistQueryCountTests(TestCase):
+    """The report count column is annotated, so page size does not change the query count"""
+    
+    @classmethod
+    def setUpTestData(cls):
+        cls.superuser = CustomUser.objects.create_superuser('admin', 'admin@example.com', 'password')
+        users = CustomUser.objects.bulk_create([CustomUser(username=f'user{i}') for i in range(max(ROW_COUNTS))])
+        IncidentReport.objects.bulk_create([
+            IncidentReport(
+                user=user, title=f'Report {i}', category='theft', description='Phone snatched',
+                severity='moderate', latitude='-1.286389', longitude='36.817223', incident_date=timezone.now(),
+            )
+            for i, user in enumerate(users) if i % 2
+        ])
+    
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.superuser)
+    
+    def test_changelist_queries_do_not_grow_with_rows(self):
+        # The first load fills cached template context (the incident stats), which is not per row
+        self.client.get(reverse('admin:accounts_customuser_changelist'))
+        counts = {}
+        for per_page in ROW_COUNTS:
+            with mock.patch.object(CustomUserAdmin, 'list_per_page', per_page):
+                with CaptureQueriesContext(connection) as queries:
+                    response = self.client.get(reverse('admin:accounts_customuser_changelist'))
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.context['cl'].result_list), per_page)
+            counts[per_page] = len(queries)
+        self.assertEqual(len(set(counts.values())), 1, f'Queries per page size: {counts}')
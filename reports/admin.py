@@ -1,23 +1,63 @@
 from django.contrib import admin
+from django.db.models import Count
 from django.utils.html import format_html
 from django.urls import reverse
+from . import dedup, jobs, moderation, perceptual, search, stats
 from .models import (
     IncidentReport, IncidentImage, IncidentVideo, 
-    IncidentAudio, SavedZone, HelpfulReport, CommunityDiscussion, DiscussionReply
+    IncidentAudio, SavedZone, HelpfulReport, CommunityDiscussion, DiscussionReply, IncidentStat, Job
 )
 
 
+def similar_images_html(images):
+    """Thumbnails of similar images (reports.perceptual), each linking to its report's admin page"""
+    if not images:
+        return format_html('<span style="color: #999;">No similar images</span>')
+    html = '<div style="display: flex; flex-wrap: wrap; gap: 10px;">'
+    for image in images:
+        html += format_html(
+            '<div style="text-align: center;"><a href="{}"><img src="{}" style="max-width: 120px; max-height: 120px; border-radius: 5px; margin-bottom: 5px;" /></a><br><small>Report #{} &middot; {} bit(s) apart</small></div>',
+            reverse('admin:reports_incidentreport_change', args=[image.report_id]),
+            image.small_url,
+            image.report_id,
+            image.distance,
+        )
+    html += '</div>'
+    return format_html(html)
+
+
+class FullTextSearchMixin:
+    """
+    Changelist search that matches text through the full-text index (reports.search).
+    
+    search_fields only lists the non-text lookups (e.g. usernames); the
+    search box matches either.
+    """
+    search_kind = None
+    
+    def get_search_results(self, request, queryset, search_term):
+        matched, may_have_duplicates = super().get_search_results(request, queryset, search_term)
+        if search.terms(search_term):
+            matched = matched | queryset.filter(pk__in=search.matching_ids(self.search_kind, search_term))
+        return matched, may_have_duplicates
+
+
 @admin.register(IncidentReport)
-class IncidentReportAdmin(admin.ModelAdmin):
+class IncidentReportAdmin(FullTextSearchMixin, admin.ModelAdmin):
     list_display = ('id', 'title', 'category_badge', 'severity_badge', 'user_link', 'location_name', 'incident_date', 'is_verified_badge', 'created_at', 'actions_column')
-    list_filter = ('category', 'severity', 'is_verified', 'created_at', 'incident_date')
-    search_fields = ('title', 'description', 'location_name', 'user__username', 'user__email')
-    readonly_fields = ('created_at', 'updated_at', 'helpful_count', 'abuse_reports', 'images_preview', 'location_map_link')
+    list_filter = ('category', 'severity', 'is_verified', 'is_rejected', 'created_at', 'incident_date')
+    search_fields = ('user__username', 'user__email')
+    search_kind = 'report'
+    search_help_text = 'Searches title, description and location, and reporter username/email.'
+    readonly_fields = ('created_at', 'updated_at', 'helpful_count', 'abuse_reports', 'images_preview', 'similar_images_preview', 'location_map_link', 'duplicates_summary')
     filter_horizontal = ()
     date_hierarchy = 'created_at'
     list_per_page = 25
     list_max_show_all = 100
     
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('user')
+    
     def category_badge(self, obj):
         colors = {
             'theft': 'warning',
@@ -74,6 +114,17 @@ class IncidentReportAdmin(admin.ModelAdmin):
         return 'No coordinates'
     location_map_link.short_description = 'Location'
     
+    def duplicates_summary(self, obj):
+        if obj.duplicate_of_id:
+            url = reverse('admin:reports_incidentreport_change', args=[obj.duplicate_of_id])
+            return format_html('Duplicate of <a href="{}">report #{}</a>', url, obj.duplicate_of_id)
+        count = obj.duplicates.count()
+        if count:
+            url = reverse('admin:reports_incidentreport_changelist') + f'?duplicate_of__id__exact={obj.pk}'
+            return format_html('Primary report, with <a href="{}">{} duplicate(s)</a>', url, count)
+        return 'No duplicates found'
+    duplicates_summary.short_description = 'Duplicates'
+    
     def actions_column(self, obj):
         return format_html(
             '<a class="button" href="{}">View</a>',
@@ -88,7 +139,7 @@ class IncidentReportAdmin(admin.ModelAdmin):
             for img in images:
                 html += format_html(
                     '<div style="text-align: center;"><img src="{}" style="max-width: 150px; max-height: 150px; border-radius: 5px; margin-bottom: 5px; box-shadow: 0 2px 4px rgba(0,0,0,0.1);" /><br><small>{}</small></div>',
-                    img.image.url,
+                    img.small_url,
                     img.get_image_type_display()
                 )
             html += '</div>'
@@ -96,6 +147,10 @@ class IncidentReportAdmin(admin.ModelAdmin):
         return format_html('<span style="color: #999;">No images</span>')
     images_preview.short_description = 'Report Images'
     
+    def similar_images_preview(self, obj):
+        return similar_images_html(perceptual.similar_to_report(obj))
+    similar_images_preview.short_description = 'Similar Images in Other Reports'
+    
     fieldsets = (
         ('Basic Information', {
             'fields': ('user', 'title', 'category', 'severity', 'description'),
@@ -106,11 +161,11 @@ class IncidentReportAdmin(admin.ModelAdmin):
             'classes': ('wide',)
         }),
         ('Status & Engagement', {
-            'fields': ('is_verified', 'helpful_count', 'abuse_reports'),
+            'fields': ('is_verified', 'is_rejected', 'duplicates_summary', 'helpful_count', 'abuse_reports'),
             'classes': ('collapse',)
         }),
         ('Media', {
-            'fields': ('images_preview',),
+            'fields': ('images_preview', 'similar_images_preview'),
             'classes': ('wide',)
         }),
         ('Timestamps', {
@@ -119,27 +174,98 @@ class IncidentReportAdmin(admin.ModelAdmin):
         }),
     )
     
-    actions = ['mark_as_verified', 'mark_as_unverified']
+    actions = ['mark_as_verified', 'mark_as_unverified', 'reject_reports', 'detach_duplicates']
+    
+    def changelist_view(self, request, extra_context=None):
+        extra_context = extra_context or {}
+        extra_context['verified_stats'] = stats.summary()
+        return super().changelist_view(request, extra_context=extra_context)
     
     def mark_as_verified(self, request, queryset):
-        updated = queryset.update(is_verified=True)
+        updated = moderation.verify(queryset.values_list('pk', flat=True))
         self.message_user(request, f'{updated} report(s) marked as verified.')
     mark_as_verified.short_description = 'Mark selected reports as verified'
     
     def mark_as_unverified(self, request, queryset):
-        updated = queryset.update(is_verified=False)
+        updated = moderation.unverify(queryset.values_list('pk', flat=True))
         self.message_user(request, f'{updated} report(s) marked as unverified.')
     mark_as_unverified.short_description = 'Mark selected reports as unverified'
+    
+    def reject_reports(self, request, queryset):
+        updated = moderation.reject(queryset.values_list('pk', flat=True))
+        self.message_user(request, f'{updated} report(s) rejected.')
+    reject_reports.short_description = 'Reject selected reports'
+    
+    def detach_duplicates(self, request, queryset):
+        detached = dedup.detach(queryset.values_list('pk', flat=True))
+        self.message_user(request, f'{detached} report(s) separated from their duplicate groups.')
+    detach_duplicates.short_description = 'Separate selected reports from their duplicates'
+
+
+@admin.register(IncidentStat)
+class IncidentStatAdmin(admin.ModelAdmin):
+    list_display = ('day', 'category', 'severity', 'count')
+    list_filter = ('category', 'severity')
+    date_hierarchy = 'day'
+    list_per_page = 50
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
+    
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'name', 'status_badge', 'attempts', 'run_at', 'locked_by', 'created_at', 'finished_at')
+    list_filter = ('status', 'name')
+    search_fields = ('name', 'idempotency_key')
+    readonly_fields = ('name', 'payload', 'idempotency_key', 'status', 'attempts', 'max_attempts', 'run_at',
+                       'locked_by', 'locked_at', 'last_error', 'created_at', 'finished_at')
+    date_hierarchy = 'created_at'
+    list_per_page = 50
+    actions = ['retry_jobs']
+    
+    def status_badge(self, obj):
+        colors = {
+            'pending': 'secondary',
+            'running': 'info',
+            'done': 'success',
+            'failed': 'danger'
+        }
+        return format_html(
+            '<span class="badge badge-{}">{}</span>',
+            colors.get(obj.status, 'secondary'),
+            obj.get_status_display()
+        )
+    status_badge.short_description = 'Status'
+    status_badge.admin_order_field = 'status'
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def retry_jobs(self, request, queryset):
+        updated = jobs.retry(queryset)
+        self.message_user(request, f'{updated} job(s) queued to run again.')
+    retry_jobs.short_description = 'Retry selected jobs'
 
 
 @admin.register(IncidentImage)
 class IncidentImageAdmin(admin.ModelAdmin):
     list_display = ('id', 'report_link', 'image_type_badge', 'is_blurred_badge', 'image_preview', 'created_at')
-    list_filter = ('image_type', 'is_blurred', 'created_at')
+    list_filter = ('image_type', 'is_blurred', 'processing_status', 'created_at')
     search_fields = ('report__title', 'description')
-    readonly_fields = ('image_preview', 'created_at')
+    readonly_fields = ('image_preview', 'similar_images_preview', 'processing_status', 'created_at')
     date_hierarchy = 'created_at'
     
+    def get_queryset(self, request):
+        # __str__ and report_link show the report's title
+        return super().get_queryset(request).select_related('report')
+    
     def report_link(self, obj):
         if obj.report:
             url = reverse('admin:reports_incidentreport_change', args=[obj.report.pk])
@@ -167,18 +293,22 @@ class IncidentImageAdmin(admin.ModelAdmin):
         if obj.image:
             return format_html(
                 '<img src="{}" style="max-width: 200px; max-height: 200px; border-radius: 5px; box-shadow: 0 2px 4px rgba(0,0,0,0.1);" />',
-                obj.image.url
+                obj.small_url
             )
         return format_html('<span style="color: #999;">No image</span>')
     image_preview.short_description = 'Preview'
     
+    def similar_images_preview(self, obj):
+        return similar_images_html(perceptual.similar_images(obj))
+    similar_images_preview.short_description = 'Similar Images in Other Reports'
+    
     fieldsets = (
         ('Image Information', {
-            'fields': ('report', 'image', 'image_preview', 'image_type', 'is_blurred', 'description'),
+            'fields': ('report', 'image', 'image_preview', 'image_type', 'is_blurred', 'description', 'similar_images_preview'),
             'classes': ('wide',)
         }),
         ('Metadata', {
-            'fields': ('created_at',),
+            'fields': ('processing_status', 'created_at'),
             'classes': ('collapse',)
         }),
     )
@@ -192,6 +322,9 @@ class IncidentVideoAdmin(admin.ModelAdmin):
     readonly_fields = ('created_at', 'video_preview')
     date_hierarchy = 'created_at'
     
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('report')
+    
     def report_link(self, obj):
         if obj.report:
             url = reverse('admin:reports_incidentreport_change', args=[obj.report.pk])
@@ -228,6 +361,9 @@ class IncidentAudioAdmin(admin.ModelAdmin):
     readonly_fields = ('created_at', 'audio_preview')
     date_hierarchy = 'created_at'
     
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('report')
+    
     def report_link(self, obj):
         if obj.report:
             url = reverse('admin:reports_incidentreport_change', args=[obj.report.pk])
@@ -265,6 +401,9 @@ class SavedZoneAdmin(admin.ModelAdmin):
     readonly_fields = ('created_at', 'location_map_link')
     date_hierarchy = 'created_at'
     
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('user')
+    
     def user_link(self, obj):
         if obj.user:
             url = reverse('admin:accounts_customuser_change', args=[obj.user.pk])
@@ -288,6 +427,9 @@ class HelpfulReportAdmin(admin.ModelAdmin):
     readonly_fields = ('created_at',)
     date_hierarchy = 'created_at'
     
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('user', 'report')
+    
     def user_link(self, obj):
         if obj.user:
             url = reverse('admin:accounts_customuser_change', args=[obj.user.pk])
@@ -304,13 +446,18 @@ class HelpfulReportAdmin(admin.ModelAdmin):
 
 
 @admin.register(CommunityDiscussion)
-class CommunityDiscussionAdmin(admin.ModelAdmin):
-    list_display = ('id', 'title', 'user_link', 'report_link', 'reply_count', 'created_at')
+class CommunityDiscussionAdmin(FullTextSearchMixin, admin.ModelAdmin):
+    list_display = ('id', 'title', 'user_link', 'replies_badge', 'created_at')
     list_filter = ('created_at',)
-    search_fields = ('title', 'content', 'user__username', 'report__title')
+    search_fields = ('user__username',)
+    search_kind = 'discussion'
+    search_help_text = 'Searches title and content, and author username.'
     readonly_fields = ('created_at', 'updated_at', 'reply_count')
     date_hierarchy = 'created_at'
     
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('user').annotate(reply_total=Count('replies'))
+    
     def user_link(self, obj):
         if obj.user:
             url = reverse('admin:accounts_customuser_change', args=[obj.user.pk])
@@ -318,28 +465,26 @@ class CommunityDiscussionAdmin(admin.ModelAdmin):
         return '-'
     user_link.short_description = 'User'
     
-    def report_link(self, obj):
-        if obj.report:
-            url = reverse('admin:reports_incidentreport_change', args=[obj.report.pk])
-            return format_html('<a href="{}">{}</a>', url, obj.report.title[:50])
-        return '-'
-    report_link.short_description = 'Report'
-    
-    def reply_count(self, obj):
-        count = obj.replies.count()
-        return format_html('<span class="badge badge-info">{}</span>', count)
-    reply_count.short_description = 'Replies'
-    reply_count.admin_order_field = 'replies__count'
+    def replies_badge(self, obj):
+        return format_html('<span class="badge badge-info">{}</span>', obj.reply_total)
+    replies_badge.short_description = 'Replies'
+    replies_badge.admin_order_field = 'reply_total'
 
 
 @admin.register(DiscussionReply)
-class DiscussionReplyAdmin(admin.ModelAdmin):
+class DiscussionReplyAdmin(FullTextSearchMixin, admin.ModelAdmin):
     list_display = ('id', 'discussion_link', 'user_link', 'preview', 'created_at')
     list_filter = ('created_at',)
-    search_fields = ('content', 'user__username', 'discussion__title')
+    search_fields = ('user__username',)
+    search_kind = 'reply'
+    search_help_text = 'Searches reply content and author username.'
     readonly_fields = ('created_at', 'updated_at')
     date_hierarchy = 'created_at'
     
+    def get_queryset(self, request):
+        # __str__ shows the discussion title and the author
+        return super().get_queryset(request).select_related('discussion', 'user')
+    
     def discussion_link(self, obj):
         if obj.discussion:
             url = reverse('admin:reports_communitydiscussion_change', args=[obj.discussion.pk])
@@ -4,4 +4,7 @@ from django.apps import AppConfig
 class ReportsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'reports'
-
+    
+    def ready(self):
+        from . import signals  # noqa: F401
+        from . import uploads  # noqa: F401  (registers its job handler)
@@ -0,0 +1,70 @@
+"""
+Namespaced caching for the reports app.
+
+Every cached value belongs to a namespace ('home', 'gallery', ...). A
+namespace has its own TTL from settings.SAFEROUTE_CACHE_TTLS and a version
+token that is part of every key in it, so invalidate() drops a whole
+namespace at once by swapping the token instead of deleting keys. Versions
+live in the shared cache, so an invalidation in one worker is seen by all.
+"""
+import hashlib
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+
+from . import perf
+
+DEFAULT_TTL = 300
+
+# Namespaces that hold data derived from the public (verified) incident set
+INCIDENT_NAMESPACES = ('incidents', 'heatmap_tile', 'clusters', 'rollups', 'home', 'gallery')
+
+
+def ttl(namespace):
+    """Return the configured TTL for a namespace"""
+    return getattr(settings, 'SAFEROUTE_CACHE_TTLS', {}).get(namespace, DEFAULT_TTL)
+
+
+def namespace_version(namespace):
+    """Return the namespace's current version token, creating one if needed"""
+    key = f'reports:ns:{namespace}'
+    version = cache.get(key)
+    if version is None:
+        # A random token (not a counter) so a cache flush can never
+        # resurrect keys or ETags that were already handed out.
+        cache.add(key, uuid.uuid4().hex, None)
+        version = cache.get(key)
+    if version is None:
+        # Caching is disabled (dummy backend); use a throwaway token
+        version = uuid.uuid4().hex
+    return version
+
+
+def invalidate(*namespaces):
+    """Drop everything cached under the given namespaces"""
+    cache.set_many({f'reports:ns:{namespace}': uuid.uuid4().hex for namespace in namespaces}, None)
+
+
+def make_key(namespace, *parts):
+    """Build a versioned cache key from arbitrary key parts"""
+    digest = hashlib.sha1(':'.join(str(part) for part in parts).encode('utf-8')).hexdigest()
+    return f'reports:{namespace}:{namespace_version(namespace)}:{digest}'
+
+
+def get(namespace, *parts):
+    """Return a cached value or None"""
+    value = cache.get(make_key(namespace, *parts))
+    perf.record_cache(value is not None)
+    return value
+
+
+def get_or_set(namespace, parts, builder, timeout=None):
+    """Return the cached value for key parts, calling builder() and storing it on a miss"""
+    key = make_key(namespace, *parts)
+    value = cache.get(key)
+    perf.record_cache(value is not None)
+    if value is None:
+        value = builder()
+        cache.set(key, value, ttl(namespace) if timeout is None else timeout)
+    return value
@@ -0,0 +1,93 @@
+"""
+Change tracking for the verified incident set.
+
+Aggregates derived from verified reports (stats, rollups, spatial indexes)
+are maintained incrementally. The set counts each incident once: it holds
+the verified reports that are not duplicates of another report (see
+reports.dedup). Whenever reports enter, leave or move within the set,
+verified_incidents_changed is sent with the rows that were removed and the
+rows that were added, so a receiver can subtract the old contribution and
+add the new one. An edit to a verified report shows up as one removed row
+(old values) plus one added row (new values).
+
+verification_changed is sent separately with the ids of reports whose
+is_verified flag flipped, whether or not they are counted.
+
+Rows are plain dicts with the TRACKED_FIELDS of a report plus its id.
+"""
+from django.dispatch import Signal
+
+# Fields that derived aggregates depend on
+TRACKED_FIELDS = (
+    'is_verified', 'category', 'severity', 'latitude', 'longitude',
+    'geohash', 'incident_date', 'created_at', 'duplicate_of_id',
+)
+
+# Sent with added=[row, ...] and removed=[row, ...]
+verified_incidents_changed = Signal()
+
+# Sent with ids=[report id, ...]
+verification_changed = Signal()
+
+
+def counted(state):
+    """Whether a tracked state belongs to the verified incident set"""
+    return bool(state['is_verified']) and state['duplicate_of_id'] is None
+
+
+def incident_state(report):
+    """Return the tracked state of a report instance"""
+    state = {field: getattr(report, field) for field in TRACKED_FIELDS}
+    # Coordinates may have been assigned as floats or strings; compare as stored
+    for field in ('latitude', 'longitude'):
+        state[field] = report._meta.get_field(field).to_python(state[field])
+    state['id'] = report.pk
+    return state
+
+
+def fetch_states(model, pks, batch_size=500):
+    """Load the tracked state of reports by primary key"""
+    pks = list(pks)
+    states = {}
+    for start in range(0, len(pks), batch_size):
+        rows = model._base_manager.filter(pk__in=pks[start:start + batch_size]).values('id', *TRACKED_FIELDS)
+        states.update((row['id'], row) for row in rows)
+    return states
+
+
+def diff_states(old_states, new_states):
+    """
+    Compare tracked states keyed by id and return (added, removed) verified rows.
+
+    Rows that are not counted on either side, or unchanged, are ignored.
+    """
+    added = []
+    removed = []
+    for pk in set(old_states) | set(new_states):
+        old = old_states.get(pk)
+        new = new_states.get(pk)
+        old = old if old and counted(old) else None
+        new = new if new and counted(new) else None
+        if old == new:
+            continue
+        if old:
+            removed.append(old)
+        if new:
+            added.append(new)
+    return added, removed
+
+
+def send_changes(sender, added, removed):
+    """Notify receivers, skipping the signal when nothing changed"""
+    if added or removed:
+        verified_incidents_changed.send(sender=sender, added=added, removed=removed)
+
+
+def send_verification_changes(sender, old_states, new_states):
+    """Send verification_changed for reports whose is_verified flag differs between the states"""
+    flipped = [
+        pk for pk, new in new_states.items()
+        if pk in old_states and bool(old_states[pk]['is_verified']) != bool(new['is_verified'])
+    ]
+    if flipped:
+        verification_changed.send(sender=sender, ids=flipped)
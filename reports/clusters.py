@@ -0,0 +1,198 @@
+"""
+Server-side marker clustering for the heatmap.
+
+Verified reports are counted in a grid pyramid: at every zoom level up to
+MAX_CLUSTER_ZOOM, each Web Mercator tile is split into CLUSTER_GRID x
+CLUSTER_GRID cells and a ClusterCell row per (zoom, cell, category) holds
+the report count, the severity mix and the coordinate sums for the
+centroid, overall and per severity. A cell's parent at zoom - 1 is (x // 2, y // 2), so clusters nest
+from one zoom level to the next.
+
+The pyramid is kept up to date incrementally from
+changes.verified_incidents_changed, so a clusters request only reads the
+few hundred cells in view. Requests the pyramid cannot answer (a time
+filter) are binned from the report table on the fly. Above
+MAX_CLUSTER_ZOOM the map draws individual points (see reports.packing).
+"""
+from collections import defaultdict
+
+from django.db import IntegrityError, transaction
+from django.db.models import F, Sum
+
+from . import tiles
+from .models import ClusterCell, IncidentReport
+
+# Cells per tile side; 4 gives clusters about 64px apart on 256px tiles
+CLUSTER_GRID = 4
+
+# Deepest pyramid level; above it the map draws individual points
+MAX_CLUSTER_ZOOM = 16
+
+SEVERITIES = ('low', 'moderate', 'high')
+
+
+def cell_of(latitude, longitude, zoom):
+    """Return the (x, y) cell containing a coordinate at a zoom level"""
+    tx, ty = tiles.lonlat_to_tile_fraction(float(longitude), float(latitude), zoom)
+    n = 2 ** zoom * CLUSTER_GRID
+    return min(n - 1, max(0, int(tx * CLUSTER_GRID))), min(n - 1, max(0, int(ty * CLUSTER_GRID)))
+
+
+def cell_bounds(zoom, x, y):
+    """Return (min_lon, min_lat, max_lon, max_lat) of a cell"""
+    return (
+        tiles.tile_to_lon(x / CLUSTER_GRID, zoom),
+        tiles.tile_to_lat((y + 1) / CLUSTER_GRID, zoom),
+        tiles.tile_to_lon((x + 1) / CLUSTER_GRID, zoom),
+        tiles.tile_to_lat(y / CLUSTER_GRID, zoom),
+    )
+
+
+def cell_ranges(zoom, min_lon, min_lat, max_lon, max_lat):
+    """
+    Return [(x_min, x_max, y_min, y_max), ...] cell ranges covering a bounding box.
+
+    A box with min_lon > max_lon is treated as crossing the antimeridian.
+    """
+    if min_lon > max_lon:
+        boxes = [(min_lon, min_lat, 180.0, max_lat), (-180.0, min_lat, max_lon, max_lat)]
+    else:
+        boxes = [(min_lon, min_lat, max_lon, max_lat)]
+    ranges = []
+    for box_min_lon, box_min_lat, box_max_lon, box_max_lat in boxes:
+        x_min, y_min = cell_of(box_max_lat, box_min_lon, zoom)
+        x_max, y_max = cell_of(box_min_lat, box_max_lon, zoom)
+        ranges.append((x_min, x_max, y_min, y_max))
+    return ranges
+
+
+def _empty():
+    totals = {'count': 0, 'lat_sum': 0.0, 'lon_sum': 0.0}
+    for severity in SEVERITIES:
+        totals.update({severity: 0, f'{severity}_lat_sum': 0.0, f'{severity}_lon_sum': 0.0})
+    return totals
+
+
+def _add_row(totals, row, sign, zooms):
+    latitude = float(row['latitude'])
+    longitude = float(row['longitude'])
+    for zoom in zooms:
+        x, y = cell_of(latitude, longitude, zoom)
+        cell = totals[(zoom, x, y, row['category'])]
+        cell['count'] += sign
+        cell['lat_sum'] += sign * latitude
+        cell['lon_sum'] += sign * longitude
+        if row['severity'] in SEVERITIES:
+            cell[row['severity']] += sign
+            cell[f"{row['severity']}_lat_sum"] += sign * latitude
+            cell[f"{row['severity']}_lon_sum"] += sign * longitude
+
+
+def cell_totals(rows, sign=1, zooms=None):
+    """Sum report rows into {(zoom, x, y, category): totals} for every pyramid level"""
+    zooms = range(MAX_CLUSTER_ZOOM + 1) if zooms is None else zooms
+    totals = defaultdict(_empty)
+    for row in rows:
+        _add_row(totals, row, sign, zooms)
+    return totals
+
+
+def apply_changes(added, removed):
+    """Add/subtract verified report rows to the pyramid"""
+    totals = cell_totals(added)
+    for key, delta in cell_totals(removed, sign=-1).items():
+        for field, value in delta.items():
+            totals[key][field] += value
+
+    with transaction.atomic():
+        for (zoom, x, y, category), delta in sorted(totals.items()):
+            if not any(abs(value) > 1e-9 for value in delta.values()):
+                continue
+            cells = ClusterCell.objects.filter(zoom=zoom, x=x, y=y, category=category)
+            increments = {field: F(field) + value for field, value in delta.items()}
+            if cells.update(**increments):
+                if delta['count'] < 0:
+                    cells.filter(count__lte=0).delete()
+                continue
+            if delta['count'] < 0:
+                continue
+            try:
+                with transaction.atomic():
+                    ClusterCell.objects.create(zoom=zoom, x=x, y=y, category=category, **delta)
+            except IntegrityError:
+                # Another worker created the cell first
+                cells.update(**increments)
+
+
+def rebuild():
+    """Recompute the whole pyramid from the report table; returns the number of cells"""
+    rows = (
+        IncidentReport.objects.counted().order_by()
+        .values('latitude', 'longitude', 'category', 'severity')
+    )
+    totals = cell_totals(rows.iterator(chunk_size=2000))
+    with transaction.atomic():
+        ClusterCell.objects.all().delete()
+        ClusterCell.objects.bulk_create(
+            [ClusterCell(zoom=zoom, x=x, y=y, category=category, **cell)
+             for (zoom, x, y, category), cell in totals.items()],
+            batch_size=1000,
+        )
+    return len(totals)
+
+
+def _serialize(zoom, x, y, cell):
+    min_lon, min_lat, max_lon, max_lat = cell_bounds(zoom, x, y)
+    return {
+        'key': f'{zoom}/{x}/{y}',
+        'count': cell['count'],
+        'severity': {severity: cell[severity] for severity in SEVERITIES},
+        'lat': round(cell['lat_sum'] / cell['count'], 6),
+        'lng': round(cell['lon_sum'] / cell['count'], 6),
+        'bounds': [round(min_lat, 6), round(min_lon, 6), round(max_lat, 6), round(max_lon, 6)],
+    }
+
+
+def _apply_severity(cell, severity):
+    """Restrict a cell's totals, centroid included, to one severity"""
+    if severity in SEVERITIES:
+        cell = dict(
+            cell, count=cell[severity], lat_sum=cell[f'{severity}_lat_sum'], lon_sum=cell[f'{severity}_lon_sum'],
+            **{other: 0 for other in SEVERITIES if other != severity},
+        )
+    return cell
+
+
+def from_pyramid(zoom, bbox, category='', severity=''):
+    """Clusters at a pyramid level inside a bounding box, read from ClusterCell"""
+    spatial = None
+    for x_min, x_max, y_min, y_max in cell_ranges(zoom, *bbox):
+        part = ClusterCell.objects.filter(zoom=zoom, x__gte=x_min, x__lte=x_max, y__gte=y_min, y__lte=y_max)
+        spatial = part if spatial is None else spatial | part
+    if category:
+        spatial = spatial.filter(category=category)
+    rows = (
+        spatial.order_by().values('x', 'y')
+        .annotate(**{f'total_{field}': Sum(field) for field in _empty()})
+    )
+    clusters = []
+    for row in rows:
+        cell = _apply_severity({field: row[f'total_{field}'] for field in _empty()}, severity)
+        if cell['count'] > 0:
+            clusters.append(_serialize(zoom, row['x'], row['y'], cell))
+    return clusters
+
+
+def from_reports(zoom, reports):
+    """Clusters at a zoom level binned on the fly from a report queryset"""
+    rows = reports.order_by().values('latitude', 'longitude', 'category', 'severity')
+    merged = defaultdict(_empty)
+    # Per-category totals at this one level, merged into one cluster per cell
+    for (_, x, y, _), cell in cell_totals(rows.iterator(chunk_size=2000), zooms=[zoom]).items():
+        for field, value in cell.items():
+            merged[(x, y)][field] += value
+    return [_serialize(zoom, x, y, cell) for (x, y), cell in merged.items()]
+
+
+def world_bbox():
+    return (-180.0, -tiles.MAX_LATITUDE, 180.0, tiles.MAX_LATITUDE)
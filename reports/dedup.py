@@ -0,0 +1,418 @@
+"""
+Near-duplicate incident detection.
+
+During major events many people report the same incident. Reports that
+describe the same thing at about the same place and time are linked into a
+group: one primary report, which the other reports point to through
+IncidentReport.duplicate_of. Only primaries are in the verified incident
+set (see reports.changes), so the heatmap, clusters, rollups and counters
+weight an incident once however often it was reported.
+
+Two reports are duplicates when they share a category, are at most
+MAX_DISTANCE_KM and MAX_TIME_APART apart, and the MinHash estimate of the
+Jaccard similarity of their text (character SHINGLE_SIZE-grams of the title
+and description) is at least SIMILARITY_THRESHOLD.
+
+Candidates are found without scanning the table: the signature is cut into
+BANDS bands, and each band is hashed with the report's geohash cell
+(CELL_PRECISION), incident time window and category into a
+FingerprintBucket key. A report is only compared with the reports sharing a
+key in its own or a neighbouring cell and window, one indexed lookup
+whatever the size of the table.
+
+A group's primary is its earliest verified report, or its earliest report
+while none is verified; it is re-elected when a member is verified,
+unverified or deleted. New and edited reports are matched by a background
+job, and dedup_incidents re-matches the whole history.
+"""
+import hashlib
+import random
+import re
+import struct
+from collections import defaultdict
+from datetime import timedelta
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from django.db import transaction
+from django.db.models import Q
+
+from . import geo, jobs
+from .models import FingerprintBucket, IncidentFingerprint, IncidentReport
+
+# Characters per shingle
+SHINGLE_SIZE = 4
+
+# MinHash values per signature, cut into BANDS bands of ROWS values
+NUM_PERM = 64
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+
+# Estimated Jaccard similarity from which texts are the same incident; the
+# banding finds pairs above (1 / BANDS) ** (1 / ROWS) = 0.5 with high probability
+SIMILARITY_THRESHOLD = 0.5
+
+# Geohash precision of the bucket cells (about 610m x 1.2km at the equator)
+CELL_PRECISION = 6
+
+# Smaller than a cell, so duplicates are always in neighbouring cells
+MAX_DISTANCE_KM = 0.4
+
+TIME_WINDOW = timedelta(hours=6)
+MAX_TIME_APART = TIME_WINDOW
+
+BATCH_SIZE = 500
+
+# Fields a report is matched on, and the ones that decide its group's primary
+MATCH_FIELDS = ('id', 'title', 'description', 'category', 'latitude', 'longitude', 'incident_date', 'is_rejected')
+GROUP_FIELDS = ('id', 'is_verified', 'is_rejected', 'duplicate_of_id')
+
+# Editing these re-matches a report
+REMATCH_FIELDS = {'title', 'description', 'category', 'latitude', 'longitude', 'incident_date'}
+
+# Multiply-shift hashes ((a * hash + b) mod 2**64) >> 32 of 32-bit shingle
+# hashes; numpy's wrapping uint64 arithmetic gives the same values as Python
+_MASK64 = (1 << 64) - 1
+# Fixed seed: stored signatures must stay comparable with new ones
+_random = random.Random(0x5AFE)
+PERMUTATIONS = [(_random.getrandbits(64) | 1, _random.getrandbits(64)) for _ in range(NUM_PERM)]
+_PACKING = struct.Struct(f'<{NUM_PERM}I')
+
+_KEY_MIX = 0x9E3779B97F4A7C15
+
+
+def _hash(value, size=8):
+    return int.from_bytes(hashlib.blake2b(value.encode('utf-8'), digest_size=size).digest(), 'little')
+
+
+def shingles(text):
+    """Character shingles of a text, ignoring case, punctuation and spacing"""
+    text = ' '.join(re.findall(r'\w+', text.lower()))
+    if len(text) <= SHINGLE_SIZE:
+        return {text} if text else set()
+    return {text[i:i + SHINGLE_SIZE] for i in range(len(text) - SHINGLE_SIZE + 1)}
+
+
+def signature(text):
+    """MinHash signature (NUM_PERM ints) of a text, or None if it has no words"""
+    hashes = [_hash(shingle, size=4) for shingle in shingles(text)]
+    if not hashes:
+        return None
+    if np is not None:
+        values = np.array(hashes, dtype=np.uint64)
+        a, b = (np.array(column, dtype=np.uint64) for column in zip(*PERMUTATIONS))
+        minimums = ((np.outer(values, a) + b) >> np.uint64(32)).min(axis=0)
+        return tuple(int(value) for value in minimums)
+    return tuple(min(((a * value + b) & _MASK64) >> 32 for value in hashes) for a, b in PERMUTATIONS)
+
+
+def similarity(first, second):
+    """Estimated Jaccard similarity of the texts behind two signatures"""
+    return sum(a == b for a, b in zip(first, second)) / NUM_PERM
+
+
+def _text(row):
+    return f"{row['title']} {row['description']}"
+
+
+def _window(incident_date):
+    return int(incident_date.timestamp() // TIME_WINDOW.total_seconds())
+
+
+def _cells(latitude, longitude, neighbours=False):
+    latitude, longitude = float(latitude), float(longitude)
+    if not neighbours:
+        return {geo.encode(latitude, longitude, CELL_PRECISION)}
+    lat_step, lon_step = geo.cell_size(CELL_PRECISION)
+    return {
+        geo.encode(
+            max(-90.0, min(90.0, latitude + i * lat_step)),
+            (longitude + j * lon_step + 180.0) % 360.0 - 180.0,
+            CELL_PRECISION,
+        )
+        for i in (-1, 0, 1)
+        for j in (-1, 0, 1)
+    }
+
+
+def _band_keys(sig, cells, windows, category):
+    # Bands and places are hashed once each, then mixed into signed 64-bit keys
+    bands = [_hash(f'{band}:' + ','.join(map(str, sig[band * ROWS:(band + 1) * ROWS]))) for band in range(BANDS)]
+    places = [_hash(f'{cell}:{window}:{category}') for cell in cells for window in windows]
+    keys = set()
+    for place in places:
+        for band in bands:
+            key = (place ^ (band * _KEY_MIX)) & _MASK64
+            keys.add(key - (1 << 64) if key >= 1 << 63 else key)
+    return keys
+
+
+def bucket_keys(row, sig):
+    """The keys a report is stored under: its own cell and window"""
+    return _band_keys(sig, _cells(row['latitude'], row['longitude']), [_window(row['incident_date'])], row['category'])
+
+
+def lookup_keys(row, sig, windows=(-1, 0, 1)):
+    """The keys of reports that may duplicate a report: neighbouring cells and windows"""
+    window = _window(row['incident_date'])
+    return _band_keys(
+        sig, _cells(row['latitude'], row['longitude'], neighbours=True),
+        [window + offset for offset in windows], row['category'],
+    )
+
+
+def is_duplicate(row, sig, other, other_sig):
+    """Whether two reports (MATCH_FIELDS rows) describe the same incident"""
+    return (
+        row['category'] == other['category']
+        and abs(row['incident_date'] - other['incident_date']) <= MAX_TIME_APART
+        and geo.haversine_km(
+            float(row['latitude']), float(row['longitude']), float(other['latitude']), float(other['longitude'])
+        ) <= MAX_DISTANCE_KM
+        and similarity(sig, other_sig) >= SIMILARITY_THRESHOLD
+    )
+
+
+def fingerprint(row):
+    """Store the signature and bucket keys of a report; returns the signature (None if it has no text)"""
+    sig = signature(_text(row))
+    with transaction.atomic():
+        FingerprintBucket.objects.filter(report_id=row['id']).delete()
+        if sig is None:
+            IncidentFingerprint.objects.filter(report_id=row['id']).delete()
+            return None
+        IncidentFingerprint.objects.update_or_create(report_id=row['id'], defaults={'signature': _PACKING.pack(*sig)})
+        FingerprintBucket.objects.bulk_create(
+            [FingerprintBucket(key=key, report_id=row['id']) for key in bucket_keys(row, sig)]
+        )
+    return sig
+
+
+def find_duplicates(row, sig):
+    """Ids of the reports that duplicate a report, from the stored fingerprints"""
+    candidates = set(
+        FingerprintBucket.objects.filter(key__in=lookup_keys(row, sig))
+        .exclude(report_id=row['id']).values_list('report_id', flat=True)
+    )
+    if not candidates:
+        return []
+    others = {
+        other['id']: other
+        for other in IncidentReport.objects.filter(pk__in=candidates, is_rejected=False).values(*MATCH_FIELDS)
+    }
+    signatures = IncidentFingerprint.objects.filter(report_id__in=list(others)).values_list('report_id', 'signature')
+    return [
+        pk for pk, packed in signatures
+        if is_duplicate(row, sig, others[pk], _PACKING.unpack(bytes(packed)))
+    ]
+
+
+def needs_rematch(report, update_fields=None):
+    """Whether saving a report changes what it is matched on (always true for new reports)"""
+    if report._state.adding or report.pk is None:
+        return True
+    fields = REMATCH_FIELDS if update_fields is None else REMATCH_FIELDS.intersection(update_fields)
+    if not fields:
+        return False
+    stored = IncidentReport._base_manager.filter(pk=report.pk).values(*fields).first()
+    if stored is None:
+        return True
+    # Values may have been assigned as floats or strings; compare as stored
+    return any(
+        stored[field] != report._meta.get_field(field).to_python(getattr(report, field)) for field in fields
+    )
+
+
+def schedule(report_id):
+    """Enqueue duplicate matching for a new or edited report"""
+    jobs.enqueue('dedup_report', {'report_id': report_id})
+
+
+@jobs.handler('dedup_report')
+def dedup_report(report_id):
+    """Fingerprint a report and link it with the reports it duplicates"""
+    row = IncidentReport.objects.filter(pk=report_id).values(*MATCH_FIELDS).first()
+    if row is None:
+        return
+    sig = fingerprint(row)
+    if sig is None or row['is_rejected']:
+        return
+    duplicates = find_duplicates(row, sig)
+    if duplicates:
+        link([report_id] + duplicates)
+
+
+def primary_of(members):
+    """Id of the primary of a group of GROUP_FIELDS rows: the earliest verified, else earliest unrejected, report"""
+    return min(members, key=lambda member: (not member['is_verified'], member['is_rejected'], member['id']))['id']
+
+
+def _groups(report_ids, exclude=()):
+    """Return {current primary id: [GROUP_FIELDS rows]} for the groups containing the reports"""
+    roots = {
+        row['duplicate_of_id'] or row['id']
+        for row in IncidentReport.objects.filter(pk__in=list(report_ids)).values('id', 'duplicate_of_id')
+    }
+    groups = defaultdict(list)
+    if roots:
+        members = (
+            IncidentReport.objects.filter(Q(pk__in=roots) | Q(duplicate_of__in=roots))
+            .exclude(pk__in=list(exclude)).values(*GROUP_FIELDS)
+        )
+        for member in members:
+            groups[member['duplicate_of_id'] or member['id']].append(member)
+    return groups
+
+
+def _point(members):
+    """Point every member of a group at its elected primary"""
+    primary = primary_of(members)
+    repoint = [member['id'] for member in members if member['id'] != primary and member['duplicate_of_id'] != primary]
+    with transaction.atomic():
+        if any(member['id'] == primary and member['duplicate_of_id'] for member in members):
+            IncidentReport.objects.filter(pk=primary).update(duplicate_of_id=None)
+        for start in range(0, len(repoint), BATCH_SIZE):
+            IncidentReport.objects.filter(pk__in=repoint[start:start + BATCH_SIZE]).update(duplicate_of_id=primary)
+
+
+def link(report_ids):
+    """Merge the groups of reports into one"""
+    members = [member for group in _groups(report_ids).values() for member in group]
+    if len(members) > 1:
+        _point(members)
+
+
+def regroup(report_ids, exclude=()):
+    """Re-elect the primaries of the groups containing the reports, leaving out `exclude`"""
+    for members in _groups(report_ids, exclude).values():
+        if members:
+            _point(members)
+
+
+def detach(report_ids):
+    """Take reports out of their groups as separate incidents; returns the number detached"""
+    report_ids = set(report_ids)
+    detached = 0
+    with transaction.atomic():
+        for members in _groups(report_ids).values():
+            if len(members) < 2:
+                continue
+            leaving = [member for member in members if member['id'] in report_ids]
+            staying = [member for member in members if member['id'] not in report_ids]
+            IncidentReport.objects.filter(
+                pk__in=[member['id'] for member in leaving if member['duplicate_of_id']]
+            ).update(duplicate_of_id=None)
+            if staying:
+                _point(staying)
+            detached += len(leaving)
+    return detached
+
+
+def report_deleting(report):
+    """Hand a deleted primary's group to another member before the report goes"""
+    if report.duplicate_of_id is None:
+        regroup([report.pk], exclude=[report.pk])
+
+
+def _find(parent, pk):
+    while parent[pk] != pk:
+        parent[pk] = parent[parent[pk]]
+        pk = parent[pk]
+    return pk
+
+
+def rebuild(track_changes=True):
+    """
+    Re-fingerprint every report and relink all groups; returns (reports fingerprinted, groups).
+
+    Reports are streamed in incident_date order and matched in memory against
+    the buckets of the previous and current time windows only, so candidate
+    rows and signatures are held for the busiest pair of windows at most.
+    The group bookkeeping (union-find parent and link state) still keeps a
+    few small values for every report. Links that no longer match (including
+    reports detached by hand) are replaced.
+    
+    With track_changes=False the relinking skips change notifications, for
+    bulk loads that rebuild the derived data afterwards.
+    """
+    parent = {}
+    states = {}
+    # window -> ({bucket key: [report id, ...]}, {report id: (row, signature)})
+    windows = {}
+    fingerprints = []
+    buckets = []
+    fingerprinted = 0
+
+    def flush():
+        IncidentFingerprint.objects.bulk_create(fingerprints, batch_size=BATCH_SIZE)
+        FingerprintBucket.objects.bulk_create(buckets, batch_size=BATCH_SIZE * BANDS)
+        fingerprints.clear()
+        buckets.clear()
+
+    with transaction.atomic():
+        FingerprintBucket.objects.all().delete()
+        IncidentFingerprint.objects.all().delete()
+        rows = (
+            IncidentReport.objects.order_by('incident_date', 'id')
+            .values(*dict.fromkeys(MATCH_FIELDS + GROUP_FIELDS)).iterator(chunk_size=2000)
+        )
+        for row in rows:
+            states[row['id']] = {field: row[field] for field in GROUP_FIELDS}
+            sig = signature(_text(row))
+            if sig is None:
+                continue
+            fingerprinted += 1
+            own_keys = bucket_keys(row, sig)
+            fingerprints.append(IncidentFingerprint(report_id=row['id'], signature=_PACKING.pack(*sig)))
+            buckets.extend(FingerprintBucket(key=key, report_id=row['id']) for key in own_keys)
+            if len(fingerprints) >= BATCH_SIZE:
+                flush()
+            if row['is_rejected']:
+                continue
+            
+            window = _window(row['incident_date'])
+            for old in [old for old in windows if old < window - 1]:
+                del windows[old]
+            # Rows arrive in time order, so only this and the previous window hold candidates
+            candidates = {}
+            keys = lookup_keys(row, sig, windows=(-1, 0))
+            for window_keys, window_rows in (windows[w] for w in (window - 1, window) if w in windows):
+                for key in keys:
+                    for pk in window_keys.get(key, ()):
+                        candidates[pk] = window_rows[pk]
+            parent[row['id']] = row['id']
+            for pk, (other, other_sig) in candidates.items():
+                if is_duplicate(row, sig, other, other_sig):
+                    parent[_find(parent, pk)] = _find(parent, row['id'])
+            window_keys, window_rows = windows.setdefault(window, (defaultdict(list), {}))
+            window_rows[row['id']] = (row, sig)
+            for key in own_keys:
+                window_keys[key].append(row['id'])
+        flush()
+
+    groups = defaultdict(list)
+    for pk in parent:
+        groups[_find(parent, pk)].append(states[pk])
+    targets = {}
+    for members in groups.values():
+        if len(members) > 1:
+            primary = primary_of(members)
+            targets.update((member['id'], None if member['id'] == primary else primary) for member in members)
+    # Reports linked before but no longer matching anything become separate incidents again
+    changed = defaultdict(list)
+    for pk, state in states.items():
+        target = targets.get(pk)
+        if state['duplicate_of_id'] != target:
+            changed[target].append(pk)
+    reports = IncidentReport.objects.all() if track_changes else IncidentReport.objects.untracked()
+    # Primaries first, so a group is never left without a counted report
+    for target in sorted(changed, key=lambda value: value is not None):
+        pks = changed[target]
+        for start in range(0, len(pks), BATCH_SIZE):
+            with transaction.atomic():
+                reports.filter(pk__in=pks[start:start + BATCH_SIZE]).update(duplicate_of_id=target)
+    return fingerprinted, sum(1 for members in groups.values() if len(members) > 1)
+
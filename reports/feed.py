@@ -0,0 +1,93 @@
+"""
+The dashboard's "incidents in my area" feed.
+
+The feed is the user's ZoneAlert rows (see reports.zones), newest report
+first, paged by keyset on (reported_at, report_id) so a page costs the same
+however far back it is. Each page is a single query: the report, its
+author and the matching zone are joined in, and the helpful-vote count is
+annotated from HelpfulReport rather than read from the (possibly
+buffered) counter. Images are prefetched in one more query.
+
+First pages are cached per user under the 'feed:<user id>' namespace,
+which is invalidated whenever that user's alerts change.
+"""
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.db.models import Count, IntegerField, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+
+from . import cache as reports_cache
+from .models import HelpfulReport, ZoneAlert
+
+FEED_PAGE_SIZE = 10
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+
+def namespace(user_id):
+    return f'feed:{user_id}'
+
+
+def invalidate(user_ids):
+    """Drop the cached feed pages of these users"""
+    namespaces = [namespace(user_id) for user_id in set(user_ids)]
+    if namespaces:
+        reports_cache.invalidate(*namespaces)
+
+
+def encode_cursor(alert):
+    """Opaque cursor pointing just past an alert"""
+    delta = alert.reported_at - _EPOCH
+    microseconds = (delta.days * 86400 + delta.seconds) * 10 ** 6 + delta.microseconds
+    return f'{microseconds}-{alert.report_id}'
+
+
+def decode_cursor(value):
+    """Return (reported_at, report_id) from a cursor; raises ValueError if malformed"""
+    microseconds, report_id = value.split('-', 1)
+    return _EPOCH + timedelta(microseconds=int(microseconds)), int(report_id)
+
+
+def page(user, cursor=None, size=FEED_PAGE_SIZE):
+    """
+    Return (incidents, next_cursor) for a page of a user's feed.
+
+    Incidents are IncidentReport instances carrying zone_name, distance_km
+    and helpful_total. next_cursor is None on the last page.
+    """
+    helpful_total = Subquery(
+        HelpfulReport.objects.filter(report=OuterRef('report_id'))
+        .order_by().values('report').annotate(count=Count('pk')).values('count'),
+        output_field=IntegerField(),
+    )
+    alerts = (
+        ZoneAlert.objects.filter(user=user)
+        .select_related('zone', 'report__user')
+        .prefetch_related('report__images')
+        .annotate(helpful_total=Coalesce(helpful_total, 0))
+        .order_by('-reported_at', '-report_id')
+    )
+    if cursor:
+        reported_at, report_id = decode_cursor(cursor)
+        alerts = alerts.filter(
+            Q(reported_at__lt=reported_at) | Q(reported_at=reported_at, report_id__lt=report_id)
+        )
+    # One extra row tells whether there is a next page
+    alerts = list(alerts[:size + 1])
+    next_cursor = encode_cursor(alerts[size - 1]) if len(alerts) > size else None
+
+    incidents = []
+    for alert in alerts[:size]:
+        incident = alert.report
+        incident.zone_name = alert.zone.name
+        incident.distance_km = alert.distance_km
+        incident.helpful_total = alert.helpful_total
+        incidents.append(incident)
+    return incidents, next_cursor
+
+
+def first_page(user):
+    """The cached first page of a user's feed"""
+    return reports_cache.get_or_set(
+        namespace(user.pk), ['first'], lambda: page(user), timeout=reports_cache.ttl('feed'),
+    )
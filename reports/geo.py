@@ -0,0 +1,194 @@
+"""
+Geohash helpers for the IncidentReport spatial key.
+
+Each report stores the geohash of its coordinates. A geohash prefix is a
+rectangular cell and all points inside a cell share that prefix, so a
+bounding box can be answered with a handful of indexed string range scans
+instead of a full table scan over latitude/longitude.
+"""
+import math
+
+GEOHASH_ALPHABET = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+# Precision stored on IncidentReport (about 4.8m x 4.8m cells)
+GEOHASH_PRECISION = 9
+
+# Upper bound on the number of cells used to cover a bounding box
+MAX_COVER_CELLS = 32
+
+# Mean Earth radius used for great-circle distances
+EARTH_RADIUS_KM = 6371.0088
+
+
+def encode(latitude, longitude, precision=GEOHASH_PRECISION):
+    """Encode a coordinate as a geohash string"""
+    lat_lo, lat_hi = -90.0, 90.0
+    lon_lo, lon_hi = -180.0, 180.0
+    latitude = float(latitude)
+    longitude = float(longitude)
+    chars = []
+    bits = 0
+    bit_count = 0
+    even = True
+    while len(chars) < precision:
+        if even:
+            mid = (lon_lo + lon_hi) / 2
+            if longitude >= mid:
+                bits = (bits << 1) | 1
+                lon_lo = mid
+            else:
+                bits <<= 1
+                lon_hi = mid
+        else:
+            mid = (lat_lo + lat_hi) / 2
+            if latitude >= mid:
+                bits = (bits << 1) | 1
+                lat_lo = mid
+            else:
+                bits <<= 1
+                lat_hi = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(GEOHASH_ALPHABET[bits])
+            bits = 0
+            bit_count = 0
+    return ''.join(chars)
+
+
+def cell_size(precision):
+    """Return (lat_degrees, lon_degrees) covered by a cell at this precision"""
+    total_bits = precision * 5
+    lon_bits = (total_bits + 1) // 2
+    lat_bits = total_bits // 2
+    return 180.0 / (2 ** lat_bits), 360.0 / (2 ** lon_bits)
+
+
+def prefix_successor(prefix):
+    """
+    Return the smallest geohash string greater than every string starting with prefix.
+
+    Returns None when no such string exists (prefix is all 'z').
+    """
+    chars = list(prefix)
+    while chars:
+        index = GEOHASH_ALPHABET.index(chars[-1])
+        if index + 1 < len(GEOHASH_ALPHABET):
+            chars[-1] = GEOHASH_ALPHABET[index + 1]
+            return ''.join(chars)
+        chars.pop()
+    return None
+
+
+def cover_bbox(min_lon, min_lat, max_lon, max_lat, max_cells=MAX_COVER_CELLS, max_precision=GEOHASH_PRECISION):
+    """
+    Return geohash prefixes whose cells together cover the bounding box.
+
+    Uses the finest precision (up to max_precision) that needs no more than
+    max_cells cells.
+    """
+    min_lat = max(-90.0, min_lat)
+    max_lat = min(90.0, max_lat)
+    min_lon = max(-180.0, min_lon)
+    max_lon = min(180.0, max_lon)
+
+    precision = 1
+    for candidate in range(max_precision, 0, -1):
+        lat_step, lon_step = cell_size(candidate)
+        rows = math.floor(max_lat / lat_step) - math.floor(min_lat / lat_step) + 1
+        cols = math.floor(max_lon / lon_step) - math.floor(min_lon / lon_step) + 1
+        if rows * cols <= max_cells:
+            precision = candidate
+            break
+
+    lat_step, lon_step = cell_size(precision)
+    prefixes = set()
+    row_start = math.floor(min_lat / lat_step)
+    row_end = math.floor(max_lat / lat_step)
+    col_start = math.floor(min_lon / lon_step)
+    col_end = math.floor(max_lon / lon_step)
+    for row in range(row_start, row_end + 1):
+        lat = min(89.999999, (row + 0.5) * lat_step)
+        for col in range(col_start, col_end + 1):
+            lon = min(179.999999, (col + 0.5) * lon_step)
+            prefixes.add(encode(lat, lon, precision))
+    return sorted(prefixes, key=_sort_key)
+
+
+def prefix_ranges(prefixes):
+    """
+    Collapse geohash prefixes into [start, end) string ranges.
+
+    Adjacent prefixes in geohash order are merged. An end of None means unbounded.
+    """
+    ranges = []
+    for prefix in sorted(prefixes, key=_sort_key):
+        end = prefix_successor(prefix)
+        if ranges and _follows(ranges[-1][1], prefix):
+            ranges[-1][1] = end
+        else:
+            ranges.append([prefix, end])
+    return [tuple(r) for r in ranges]
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Great-circle distance in km between two coordinates"""
+    lat1, lon1, lat2, lon2 = (math.radians(float(value)) for value in (lat1, lon1, lat2, lon2))
+    a = (math.sin((lat2 - lat1) / 2) ** 2
+         + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def circle_bbox(latitude, longitude, radius_km):
+    """
+    Return (min_lon, min_lat, max_lon, max_lat) enclosing a circle.
+
+    A circle crossing the antimeridian gives min_lon > max_lon; one reaching
+    a pole spans every longitude.
+    """
+    latitude = float(latitude)
+    longitude = float(longitude)
+    lat_delta = math.degrees(float(radius_km) / EARTH_RADIUS_KM)
+    min_lat = latitude - lat_delta
+    max_lat = latitude + lat_delta
+    if min_lat <= -90 or max_lat >= 90:
+        return -180.0, max(-90.0, min_lat), 180.0, min(90.0, max_lat)
+    # Widest longitude span is at the latitude nearest the pole
+    lon_delta = lat_delta / math.cos(math.radians(max(abs(min_lat), abs(max_lat))))
+    if lon_delta >= 180:
+        return -180.0, min_lat, 180.0, max_lat
+    min_lon = longitude - lon_delta
+    max_lon = longitude + lon_delta
+    if min_lon < -180:
+        min_lon += 360
+    if max_lon > 180:
+        max_lon -= 360
+    return min_lon, min_lat, max_lon, max_lat
+
+
+def parse_bbox(value):
+    """
+    Parse a 'minLon,minLat,maxLon,maxLat' string.
+
+    Raises ValueError for malformed or out-of-range boxes.
+    """
+    parts = [float(part) for part in value.split(',')]
+    if len(parts) != 4:
+        raise ValueError('bbox must have four comma-separated numbers')
+    min_lon, min_lat, max_lon, max_lat = parts
+    if not (-90 <= min_lat <= max_lat <= 90):
+        raise ValueError('bbox latitudes must satisfy -90 <= minLat <= maxLat <= 90')
+    if not (-180 <= min_lon <= 180 and -180 <= max_lon <= 180):
+        raise ValueError('bbox longitudes must be within -180..180')
+    return min_lon, min_lat, max_lon, max_lat
+
+
+def _follows(end, prefix):
+    """True when nothing can sort between a range end and the next prefix"""
+    if end is None or not prefix.startswith(end):
+        return False
+    return set(prefix[len(end):]) <= {GEOHASH_ALPHABET[0]}
+
+
+def _sort_key(value):
+    return [GEOHASH_ALPHABET.index(char) for char in value]
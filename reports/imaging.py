@@ -0,0 +1,164 @@
+"""
+Background handling of incident image uploads.
+
+During the request, submitted files are only written to a local staging
+directory and an 'attach_image' job is enqueued for each (see
+reports.jobs). The job creates the IncidentImage, which uploads the
+original to media storage (Cloudinary in production). Creating the image
+enqueues a 'process_image' job, which uses Pillow to generate WebP
+thumbnails at THUMBNAIL_SIZES plus a server-side blurred variant shown
+instead of the original while is_blurred is set, and stores the image's
+perceptual hash (see reports.perceptual). The generated files are
+recorded on the image's thumbnail_* and blurred_image fields. Derivatives
+are re-encoded, so they carry no EXIF data (including GPS tags) from the
+original.
+
+The staging directory (SAFEROUTE_UPLOAD_STAGING_DIR) must be on a disk the
+workers share with the web process. Bulk-created images never get a job;
+`manage.py process_images` catches them up.
+"""
+import io
+import logging
+import os
+import uuid
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+
+from . import cache as reports_cache
+from . import jobs, perceptual
+
+logger = logging.getLogger(__name__)
+
+# Longest edge (px) of each thumbnail; images are never upscaled
+THUMBNAIL_SIZES = {
+    'small': 320,
+    'medium': 800,
+    'large': 1600,
+}
+# The blurred variant is made from the medium thumbnail
+BLUR_RADIUS = 24
+WEBP_QUALITY = 80
+
+
+def staging_storage():
+    return FileSystemStorage(location=settings.SAFEROUTE_UPLOAD_STAGING_DIR)
+
+
+def stage_upload(upload):
+    """Write an uploaded file to the staging directory and return its staged name"""
+    extension = os.path.splitext(upload.name)[1].lower()[:10]
+    return staging_storage().save(f'{uuid.uuid4().hex}{extension}', upload)
+
+
+def enqueue_upload(report_id, upload, image_type):
+    """Stage an upload and enqueue the job that attaches it to a report"""
+    staged = stage_upload(upload)
+    return jobs.enqueue('attach_image', {
+        'report_id': report_id,
+        'staged_name': staged,
+        'original_name': os.path.basename(upload.name),
+        'image_type': image_type,
+    }, key=f'attach_image:{staged}')
+
+
+@jobs.handler('attach_image')
+def attach_image(report_id, staged_name, original_name, image_type):
+    """Store a staged upload as an IncidentImage of a report"""
+    from .models import IncidentImage, IncidentReport
+
+    storage = staging_storage()
+    if not storage.exists(staged_name):
+        return  # Already attached by an earlier run of this job
+    if IncidentReport.objects.filter(pk=report_id).exists():
+        with storage.open(staged_name, 'rb') as staged:
+            IncidentImage.objects.create(
+                report_id=report_id,
+                image=File(staged, name=original_name),
+                image_type=image_type,
+                is_blurred=True,
+            )
+    storage.delete(staged_name)
+
+
+def schedule(image_id):
+    """Enqueue derivative generation for an image"""
+    jobs.enqueue('process_image', {'image_id': image_id}, key=f'process_image:{image_id}')
+
+
+def _encode(image):
+    buffer = io.BytesIO()
+    image.save(buffer, 'WEBP', quality=WEBP_QUALITY, method=4)
+    return ContentFile(buffer.getvalue())
+
+
+def render_derivatives(source):
+    """Return {'small': ..., 'medium': ..., 'large': ..., 'blurred': ...} WebP files for a PIL image"""
+    from PIL import ImageFilter, ImageOps
+
+    source = ImageOps.exif_transpose(source)
+    if source.mode not in ('RGB', 'RGBA'):
+        source = source.convert('RGBA' if 'A' in source.getbands() else 'RGB')
+    files = {}
+    thumbnails = {}
+    for name, edge in THUMBNAIL_SIZES.items():
+        thumbnail = source.copy()
+        thumbnail.thumbnail((edge, edge))
+        thumbnails[name] = thumbnail
+        files[name] = _encode(thumbnail)
+    files['blurred'] = _encode(thumbnails['medium'].filter(ImageFilter.GaussianBlur(BLUR_RADIUS)))
+    return files
+
+
+@jobs.handler('process_image')
+def process_image(image_id):
+    """Job handler: generate derivatives, raising so the job is retried on failure"""
+    if process(image_id) is False:
+        raise RuntimeError(f'Could not generate derivatives for image {image_id}')
+
+
+def process(image_id):
+    """
+    Generate and record the derivatives of one IncidentImage.
+
+    Returns True on success, False on failure and None if the image is gone.
+    """
+    from PIL import Image
+
+    from .models import IncidentImage
+
+    image = IncidentImage.objects.filter(pk=image_id).first()
+    if image is None or not image.image:
+        return None
+    stem = f'{os.path.splitext(os.path.basename(image.image.name))[0]}_{image.pk}'
+    try:
+        with image.image.open('rb') as original:
+            with Image.open(original) as source:
+                files = render_derivatives(source)
+                image_hash = perceptual.dhash(source)
+        fields = {
+            'thumbnail_small': files['small'],
+            'thumbnail_medium': files['medium'],
+            'thumbnail_large': files['large'],
+            'blurred_image': files['blurred'],
+        }
+        for field, content in fields.items():
+            derivative = getattr(image, field)
+            if derivative:
+                derivative.delete(save=False)
+            derivative.save(f'{stem}_{field}.webp', content, save=False)
+    except Exception:
+        logger.exception('Could not generate derivatives for image %s', image_id)
+        IncidentImage.objects.filter(pk=image_id).update(processing_status='failed')
+        return False
+
+    # update() rather than save(): no signals, and only these columns
+    IncidentImage.objects.filter(pk=image_id).update(
+        processing_status='ready',
+        **{field: getattr(image, field).name for field in fields},
+    )
+    perceptual.store(image_id, image_hash)
+    reports_cache.invalidate('home', 'gallery')
+    return True
@@ -0,0 +1,180 @@
+"""
+Database-backed background job queue.
+
+Work that should not hold up a request (storing uploads, generating image
+derivatives, notifications) is enqueued as a Job row and executed by
+`manage.py run_workers`, so no external broker is needed. Because the row
+is written in the request's transaction, a job exists if and only if the
+data it refers to was committed.
+
+Handlers are plain functions registered by name:
+
+    @jobs.handler('process_image')
+    def process_image(image_id):
+        ...
+
+    jobs.enqueue('process_image', {'image_id': image.pk}, key=f'process_image:{image.pk}')
+
+Payloads must be JSON-serialisable. A job whose handler raises is retried
+with exponential backoff until max_attempts, then marked failed. Handlers
+must be idempotent, since a job can run more than once: after a crash
+mid-job, or when a worker dies and its job is reclaimed.
+
+Workers claim jobs with a conditional UPDATE (pending -> running), which
+works the same on SQLite and PostgreSQL. With SAFEROUTE_JOBS_EAGER, jobs
+run in-process right after the enqueueing transaction commits instead.
+"""
+import logging
+import os
+import random
+import socket
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+# Retry delay: BACKOFF_BASE * 2^(attempt - 1) seconds, capped, with jitter
+BACKOFF_BASE = 10
+BACKOFF_MAX = 60 * 60
+DEFAULT_MAX_ATTEMPTS = 5
+
+# Running jobs whose worker has not finished them in this long are retried
+STALE_AFTER = timedelta(minutes=15)
+
+HANDLERS = {}
+
+
+def handler(name):
+    """Register a function as the handler for jobs with this name"""
+    def register(func):
+        HANDLERS[name] = func
+        return func
+    return register
+
+
+def enqueue(name, payload=None, key=None, delay=0, max_attempts=DEFAULT_MAX_ATTEMPTS):
+    """
+    Add a job to the queue and return it.
+
+    If key is given and a job with that idempotency key exists, that job is
+    returned instead and nothing is added.
+    """
+    if key:
+        existing = Job.objects.filter(idempotency_key=key).first()
+        if existing:
+            return existing
+    job = Job(
+        name=name,
+        payload=payload or {},
+        idempotency_key=key or None,
+        max_attempts=max_attempts,
+        run_at=timezone.now() + timedelta(seconds=delay),
+    )
+    try:
+        with transaction.atomic():
+            job.save()
+    except IntegrityError:
+        # Enqueued concurrently with the same key
+        return Job.objects.get(idempotency_key=key)
+
+    if getattr(settings, 'SAFEROUTE_JOBS_EAGER', False):
+        transaction.on_commit(lambda: run_pending(job.pk))
+    return job
+
+
+def backoff(attempts):
+    """Seconds to wait before retrying a job that has failed `attempts` times"""
+    delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** max(0, attempts - 1))
+    return delay * random.uniform(0.75, 1.25)
+
+
+def worker_name(suffix=''):
+    return f'{socket.gethostname()}:{os.getpid()}{suffix}'
+
+
+def claim(worker, limit=1):
+    """Atomically mark up to `limit` due jobs as running for this worker and return them"""
+    now = timezone.now()
+    candidates = list(
+        Job.objects.filter(status='pending', run_at__lte=now)
+        .order_by('run_at', 'pk').values_list('pk', flat=True)[:limit * 4]
+    )
+    claimed = []
+    for pk in candidates:
+        # Another worker may have claimed it since the SELECT; only one UPDATE can win
+        won = Job.objects.filter(pk=pk, status='pending').update(
+            status='running', locked_by=worker, locked_at=now, attempts=F('attempts') + 1,
+        )
+        if won:
+            claimed.append(pk)
+            if len(claimed) >= limit:
+                break
+    return list(Job.objects.filter(pk__in=claimed).order_by('run_at', 'pk'))
+
+
+def execute(job):
+    """Run a claimed job and record the outcome; returns True on success"""
+    func = HANDLERS.get(job.name)
+    try:
+        if func is None:
+            raise LookupError(f'No handler registered for job {job.name!r}')
+        func(**job.payload)
+    except Exception:
+        error = traceback.format_exc()
+        retry = func is not None and job.attempts < job.max_attempts
+        logger.warning('Job %s (%s) failed on attempt %s%s', job.pk, job.name, job.attempts,
+                       '; retrying' if retry else '; giving up', exc_info=True)
+        if retry:
+            Job.objects.filter(pk=job.pk).update(
+                status='pending', locked_by='', locked_at=None, last_error=error,
+                run_at=timezone.now() + timedelta(seconds=backoff(job.attempts)),
+            )
+        else:
+            Job.objects.filter(pk=job.pk).update(
+                status='failed', locked_by='', locked_at=None, last_error=error, finished_at=timezone.now(),
+            )
+        return False
+
+    Job.objects.filter(pk=job.pk).update(
+        status='done', locked_by='', locked_at=None, last_error='', finished_at=timezone.now(),
+    )
+    return True
+
+
+def run_pending(pk):
+    """Claim and run one specific job if it is still pending (used by eager mode)"""
+    if Job.objects.filter(pk=pk, status='pending').update(
+        status='running', locked_by=worker_name(':eager'), locked_at=timezone.now(), attempts=F('attempts') + 1,
+    ):
+        execute(Job.objects.get(pk=pk))
+
+
+def requeue_stale(stale_after=STALE_AFTER):
+    """Return jobs left running by a dead worker to the queue; returns how many"""
+    stale = Job.objects.filter(status='running', locked_at__lt=timezone.now() - stale_after)
+    # A job that keeps killing its worker must not be retried forever
+    stale.filter(attempts__gte=F('max_attempts')).update(
+        status='failed', locked_by='', locked_at=None, finished_at=timezone.now(),
+        last_error='Worker stopped while running the job',
+    )
+    return stale.update(status='pending', locked_by='', locked_at=None, run_at=timezone.now())
+
+
+def retry(queryset):
+    """Put failed (or any) jobs back in the queue to run now with fresh attempts"""
+    return queryset.exclude(status='running').update(
+        status='pending', attempts=0, run_at=timezone.now(), finished_at=None,
+    )
+
+
+def purge(older_than):
+    """Delete finished jobs older than a timedelta (their idempotency keys are freed); returns how many"""
+    deleted, _ = Job.objects.filter(status='done', finished_at__lt=timezone.now() - older_than).delete()
+    return deleted
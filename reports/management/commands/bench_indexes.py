@@ -0,0 +1,172 @@
+"""
+Management command to benchmark the hot query shapes with and without the
+reports indexes.
+
+Runs every query shape used by reports/views.py, printing its query plan
+and median latency with the indexes declared in the models' Meta.indexes,
+then drops those indexes and measures again. Everything happens inside a
+transaction that is rolled back, so the database is left untouched
+(PostgreSQL and SQLite both support transactional DDL).
+
+With --rows, synthetic data is generated inside the same transaction first.
+
+Usage:
+    python manage.py bench_indexes --rows 1000000
+    python manage.py bench_indexes --repeat 20 --no-plans
+"""
+import random
+import statistics
+import time
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection, reset_queries, transaction
+from django.utils import timezone
+
+from reports.models import CommunityDiscussion, DiscussionReply, IncidentImage, IncidentReport
+
+User = get_user_model()
+
+INDEXED_MODELS = (IncidentReport, IncidentImage, CommunityDiscussion, DiscussionReply)
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks hot query shapes with and without the reports indexes (changes are rolled back)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=0,
+                            help='Generate this many synthetic reports first (rolled back afterwards)')
+        parser.add_argument('--repeat', type=int, default=10, help='Timed runs per query shape')
+        parser.add_argument('--no-plans', action='store_true', help='Skip printing EXPLAIN output')
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                if options['rows']:
+                    self.seed(options['rows'])
+                shapes = self.query_shapes()
+
+                self.stdout.write(self.style.MIGRATE_HEADING('With indexes'))
+                after = self.measure(shapes, options)
+
+                with connection.cursor() as cursor:
+                    for model in INDEXED_MODELS:
+                        for index in model._meta.indexes:
+                            cursor.execute(f'DROP INDEX {connection.ops.quote_name(index.name)}')
+                    cursor.execute('ANALYZE')
+
+                self.stdout.write(self.style.MIGRATE_HEADING('Without indexes'))
+                before = self.measure(shapes, options)
+                raise Rollback
+        except Rollback:
+            pass
+
+        self.stdout.write(self.style.MIGRATE_HEADING('Median latency (ms)'))
+        self.stdout.write(f'{"query":<28}{"no index":>12}{"indexed":>12}{"speedup":>10}')
+        for name in before:
+            speedup = before[name] / after[name] if after[name] else float('inf')
+            self.stdout.write(f'{name:<28}{before[name]:>12.2f}{after[name]:>12.2f}{speedup:>9.1f}x')
+
+    def query_shapes(self):
+        """The query shapes issued by reports/views.py"""
+        month_ago = timezone.now() - timedelta(days=30)
+        user = User.objects.order_by('?').first()
+        report = IncidentReport.objects.filter(is_verified=True).order_by('?').first()
+        verified = IncidentReport.objects.filter(is_verified=True)
+        return {
+            'home_recent': lambda: list(verified.order_by('-created_at')[:6]),
+            'heatmap_filters': lambda: list(verified.filter(
+                category='theft', severity='high', incident_date__gte=month_ago
+            ).values_list('latitude', 'longitude')),
+            'heatmap_bbox': lambda: list(verified.in_bbox(36.80, -1.30, 36.83, -1.27).order_by().values_list('id')),
+            'dashboard_user_reports': lambda: list(IncidentReport.objects.filter(user=user).order_by('-created_at')[:5]),
+            'gallery_page': lambda: list(IncidentImage.objects.filter(
+                report__is_verified=True, image_type='suspect'
+            ).order_by('-created_at')[:12]),
+            'report_images': lambda: list(IncidentImage.objects.filter(report=report, image_type='suspect')),
+            'community_page': lambda: list(CommunityDiscussion.objects.filter(
+                category='areas_to_avoid'
+            ).order_by('-created_at')[:10]),
+        }
+
+    def measure(self, shapes, options):
+        results = {}
+        for name, run in shapes.items():
+            if not options['no_plans']:
+                self.stdout.write(self.style.SQL_KEYWORD(name))
+                self.stdout.write(self.explain(run))
+            timings = []
+            for _ in range(options['repeat']):
+                start = time.perf_counter()
+                run()
+                timings.append((time.perf_counter() - start) * 1000)
+            results[name] = statistics.median(timings)
+        return results
+
+    def explain(self, run):
+        """Capture the SQL of a query shape and return the database's plan for it"""
+        from django.test.utils import CaptureQueriesContext
+        reset_queries()
+        with CaptureQueriesContext(connection) as captured:
+            run()
+        sql = captured.captured_queries[-1]['sql']
+        prefix = 'EXPLAIN QUERY PLAN ' if connection.vendor == 'sqlite' else 'EXPLAIN '
+        with connection.cursor() as cursor:
+            cursor.execute(prefix + sql)
+            return '\n'.join('  ' + ' '.join(str(col) for col in row) for row in cursor.fetchall())
+
+    def seed(self, rows):
+        """Bulk-generate users, reports, images, discussions and replies around a few hotspots"""
+        self.stdout.write(f'Generating {rows} synthetic reports...')
+        rng = random.Random(42)
+        now = timezone.now()
+        users = User.objects.bulk_create(
+            [User(username=f'bench_{i}_{rng.random():.8f}') for i in range(max(1, rows // 100))]
+        )
+        hotspots = [(-1.2921, 36.8219), (-1.3000, 36.7800), (-1.2600, 36.8000), (-1.3200, 36.8900)]
+        categories = [value for value, _ in IncidentReport.CATEGORY_CHOICES]
+        severities = [value for value, _ in IncidentReport.SEVERITY_CHOICES]
+        batch_size = 5000
+        for start in range(0, rows, batch_size):
+            batch = []
+            for _ in range(min(batch_size, rows - start)):
+                lat, lon = rng.choice(hotspots)
+                batch.append(IncidentReport(
+                    user=rng.choice(users),
+                    title='Benchmark incident',
+                    category=rng.choice(categories),
+                    description='',
+                    severity=rng.choice(severities),
+                    latitude=round(lat + rng.gauss(0, 0.03), 6),
+                    longitude=round(lon + rng.gauss(0, 0.03), 6),
+                    incident_date=now - timedelta(minutes=rng.randrange(60 * 24 * 365)),
+                    is_verified=rng.random() < 0.8,
+                ))
+            reset_queries()  # DEBUG query logging would otherwise hold every INSERT
+            created = IncidentReport.objects.untracked().bulk_create(batch)
+            IncidentImage.objects.bulk_create([
+                IncidentImage(report=report, image='incident_images/bench.png',
+                              image_type=rng.choice(['suspect', 'location', 'evidence']))
+                for report in created[::5]
+            ])
+        # created_at is auto_now_add, so spread it out after the fact
+        with connection.cursor() as cursor:
+            table = IncidentReport._meta.db_table
+            cursor.execute(f'UPDATE {table} SET created_at = incident_date')
+        discussions = CommunityDiscussion.objects.bulk_create([
+            CommunityDiscussion(user=rng.choice(users), title='Benchmark discussion', content='',
+                                category=rng.choice(['areas_to_avoid', 'suspicious_activities', 'lost_found', 'general']))
+            for _ in range(max(1, rows // 20))
+        ], batch_size=batch_size)
+        DiscussionReply.objects.bulk_create([
+            DiscussionReply(discussion=rng.choice(discussions), user=rng.choice(users), content='')
+            for _ in range(max(1, rows // 10))
+        ], batch_size=batch_size)
+        # Give the planner fresh statistics, as autovacuum would in production
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
@@ -0,0 +1,183 @@
+"""
+Management command to load-benchmark every view in reports/urls.py.
+
+Each URL is requested repeatedly through the Django test client, as an
+anonymous visitor or as a logged-in user for @login_required views, and
+the p50/p95/p99 latency and the number of SQL queries per request are
+reported. URL arguments are filled in from existing data, so seed the
+database first (see seed_saferoute). Writes made by views that mutate on
+GET (e.g. marking a report helpful) are rolled back at the end.
+
+Usage:
+    python manage.py bench_saferoute
+    python manage.py bench_saferoute --requests 200 --cold
+    python manage.py bench_saferoute --only heatmap incidents_json
+"""
+import math
+import statistics
+import time
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, reset_queries, transaction
+from django.http import QueryDict
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.shortcuts import resolve_url
+from django.urls import reverse
+
+from reports import paging, tiles, views
+from reports.models import CommunityDiscussion, IncidentReport
+from reports.urls import app_name, urlpatterns
+
+User = get_user_model()
+
+# Encoded polyline of a cross-town Nairobi route (Kibera - CBD - Westlands - Eastleigh)
+ROUTE_POLYLINE = 'bo_Goap_FseAolA{|@_jAsb@o_@gm@vLgfAfY~M_wBnZggC'
+
+# Extra query strings benchmarked alongside the plain URL
+VARIANTS = {
+    'heatmap': ['?category=theft&time=month'],
+    'gallery': ['?type=suspect'],
+    'gallery_items': ['?type=suspect'],
+    'community': ['?category=areas_to_avoid'],
+    'community_items': ['?category=areas_to_avoid'],
+    'incidents_json': ['?limit=500', '?bbox=36.80,-1.30,36.84,-1.26', '?stream=1'],
+    'route_score': [
+        '?' + urlencode({'polyline': ROUTE_POLYLINE}),
+        '?' + urlencode({'polyline': ROUTE_POLYLINE, 'categories': 'theft,assault'}),
+    ],
+    'search': ['?q=phone+snatched', '?q=robbery&type=report&category=violence', '?q=stage&limit=50&offset=50'],
+}
+
+# Keyset listings are also benchmarked this many pages deep (?cursor=)
+DEEP_PAGE = 5
+
+# Endpoints that only accept writes; the benchmark issues GETs
+POST_ONLY = {'upload_create', 'upload_complete'}
+
+# Zoom level of the sample heatmap tile
+TILE_ZOOM = 12
+
+
+class Rollback(Exception):
+    pass
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers"""
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(pct / 100 * len(ordered)) - 1)]
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks every reports URL through the test client (latency percentiles and query counts)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=50, help='Timed requests per URL (default 50)')
+        parser.add_argument('--warmup', type=int, default=2, help='Untimed requests per URL first (default 2)')
+        parser.add_argument('--cold', action='store_true', help='Clear the cache before every request')
+        parser.add_argument('--only', nargs='+', metavar='NAME', help='Only benchmark these URL names')
+
+    def handle(self, *args, **options):
+        report = IncidentReport.objects.filter(is_verified=True).order_by('-created_at').first()
+        discussion = CommunityDiscussion.objects.order_by('-reply_count').first()
+        user = User.objects.filter(is_superuser=False).order_by('pk').first()
+        if not (report and discussion and user):
+            raise CommandError('Not enough data to benchmark; run seed_saferoute first.')
+
+        host = next((host for host in settings.ALLOWED_HOSTS if host != '*' and not host.startswith('.')), 'localhost')
+        # Broken views show up as status 500 in the report instead of aborting the run
+        anonymous = Client(raise_request_exception=False, HTTP_HOST=host)
+        logged_in = Client(raise_request_exception=False, HTTP_HOST=host)
+        logged_in.force_login(user)
+
+        login_url = resolve_url(settings.LOGIN_URL)
+        results = []
+        try:
+            with transaction.atomic():
+                for url in self.build_urls(report, discussion, options['only']):
+                    # @login_required views redirect anonymous visitors to the login page
+                    probe = anonymous.get(url)
+                    needs_login = probe.status_code == 302 and probe['Location'].startswith(login_url)
+                    results.append((url, self.run(logged_in if needs_login else anonymous, url, options)))
+                raise Rollback
+        except Rollback:
+            pass
+
+        self.stdout.write(
+            f'{"url":<48}{"status":>7}{"p50 ms":>9}{"p95 ms":>9}{"p99 ms":>9}{"queries":>9}'
+        )
+        for url, result in results:
+            self.stdout.write(
+                f'{url[:47]:<48}{result["status"]:>7}{result["p50"]:>9.2f}{result["p95"]:>9.2f}'
+                f'{result["p99"]:>9.2f}{result["queries"]:>9}'
+            )
+
+    def build_urls(self, report, discussion, only):
+        """Return the URL of every GET-able reports URL pattern with sample arguments, plus its variants"""
+        lat, lon = float(report.latitude), float(report.longitude)
+        x, y = tiles.lonlat_to_tile_fraction(lon, lat, TILE_ZOOM)
+        arguments = {
+            'report_id': report.pk,
+            'discussion_id': discussion.pk,
+            'z': TILE_ZOOM,
+            'x': int(x),
+            'y': int(y),
+        }
+        variants = self.cursor_variants()
+        urls = []
+        for pattern in urlpatterns:
+            name = pattern.name
+            if (only and name not in only) or name in POST_ONLY:
+                continue
+            missing = set(pattern.pattern.converters) - set(arguments)
+            if missing:
+                self.stdout.write(f'Skipping {name}: no sample value for {", ".join(sorted(missing))}')
+                continue
+            kwargs = {key: arguments[key] for key in pattern.pattern.converters}
+            url = reverse(f'{app_name}:{name}', kwargs=kwargs)
+            urls.extend(url + suffix for suffix in [''] + VARIANTS.get(name, []) + variants.get(name, []))
+        return urls
+
+    def cursor_variants(self):
+        """Return {URL name: [query string]} with cursors DEEP_PAGE pages into the gallery and community listings"""
+        listings = [
+            (('gallery', 'gallery_items'), views.gallery_listing(QueryDict())[0], views.GALLERY_PAGE_SIZE),
+            (('community', 'community_items'), views.community_listing(QueryDict())[0], views.COMMUNITY_PAGE_SIZE),
+        ]
+        variants = {}
+        for names, listing, size in listings:
+            rows = list(listing.order_by('-created_at', '-id')[DEEP_PAGE * size - 1:DEEP_PAGE * size])
+            if rows:
+                for name in names:
+                    variants[name] = [f'?cursor={paging.encode_cursor(rows[0])}']
+        return variants
+
+    def run(self, client, url, options):
+        """Request a URL repeatedly and summarise latency and query counts"""
+        for _ in range(options['warmup']):
+            client.get(url)
+        timings = []
+        queries = []
+        for _ in range(options['requests']):
+            if options['cold']:
+                cache.clear()
+            reset_queries()
+            with CaptureQueriesContext(connection) as captured:
+                start = time.perf_counter()
+                response = client.get(url)
+                if response.streaming:
+                    b''.join(response.streaming_content)
+                timings.append((time.perf_counter() - start) * 1000)
+            queries.append(len(captured))
+        return {
+            'status': response.status_code,
+            'p50': percentile(timings, 50),
+            'p95': percentile(timings, 95),
+            'p99': percentile(timings, 99),
+            'queries': round(statistics.mean(queries), 1),
+        }
@@ -0,0 +1,25 @@
+"""
+Management command to find duplicate incident reports over the full history.
+
+New and edited reports are matched incrementally by a background job; run
+this once to link the existing reports, after bulk imports that bypass the
+ORM, or after changing the reports.dedup parameters. Groups are relinked
+from scratch, so reports separated by hand are linked again if they still
+match.
+
+Usage:
+    python manage.py dedup_incidents
+"""
+from django.core.management.base import BaseCommand
+
+from reports import dedup
+
+
+class Command(BaseCommand):
+    help = 'Fingerprints every IncidentReport and links near-duplicate reports into incident groups'
+
+    def handle(self, *args, **options):
+        fingerprinted, groups = dedup.rebuild()
+        self.stdout.write(self.style.SUCCESS(
+            f'Fingerprinted {fingerprinted} report(s); {groups} group(s) of duplicate reports.'
+        ))
@@ -0,0 +1,40 @@
+"""
+Management command to compute missing perceptual image hashes.
+
+Hashes are normally stored by the background job that generates an image's
+thumbnails (see reports.imaging). This catches up images that were
+bulk-created, uploaded before hashing existed or whose job failed.
+
+Usage:
+    python manage.py hash_images
+    python manage.py hash_images --all
+"""
+from django.core.management.base import BaseCommand
+
+from reports import perceptual
+from reports.models import IncidentImage
+
+
+class Command(BaseCommand):
+    help = 'Computes perceptual hashes (ImageHash) for incident images that have none'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='Rehash every image')
+        parser.add_argument('--limit', type=int, help='Hash at most this many images')
+
+    def handle(self, *args, **options):
+        images = IncidentImage.objects.exclude(image='').order_by('pk')
+        if not options['all']:
+            images = images.filter(perceptual_hash__isnull=True)
+        image_ids = list(images.values_list('pk', flat=True)[:options['limit']])
+
+        done = failed = 0
+        for count, image_id in enumerate(image_ids, 1):
+            result = perceptual.hash_image(image_id)
+            if result:
+                done += 1
+            elif result is False:
+                failed += 1
+            if count % 500 == 0:
+                self.stdout.write(f'Hashed {count}/{len(image_ids)} image(s)...')
+        self.stdout.write(self.style.SUCCESS(f'Hashed {done} image(s); {failed} failed.'))
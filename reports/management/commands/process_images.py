@@ -0,0 +1,41 @@
+"""
+Management command to generate missing image derivatives.
+
+Thumbnails and blurred variants are normally generated by a background
+job right after upload (see reports.imaging). This catches up images that were
+bulk-created, uploaded before the pipeline existed, interrupted by a
+restart or that failed.
+
+Usage:
+    python manage.py process_images
+    python manage.py process_images --all
+"""
+from django.core.management.base import BaseCommand
+
+from reports import imaging
+from reports.models import IncidentImage
+
+
+class Command(BaseCommand):
+    help = 'Generates WebP thumbnails and blurred variants for unprocessed incident images'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='Regenerate derivatives of every image')
+        parser.add_argument('--limit', type=int, help='Process at most this many images')
+
+    def handle(self, *args, **options):
+        images = IncidentImage.objects.exclude(image='').order_by('pk')
+        if not options['all']:
+            images = images.exclude(processing_status='ready')
+        image_ids = list(images.values_list('pk', flat=True)[:options['limit']])
+
+        done = failed = 0
+        for count, image_id in enumerate(image_ids, 1):
+            result = imaging.process(image_id)
+            if result:
+                done += 1
+            elif result is False:
+                failed += 1
+            if count % 100 == 0:
+                self.stdout.write(f'Processed {count}/{len(image_ids)} image(s)...')
+        self.stdout.write(self.style.SUCCESS(f'Generated derivatives for {done} image(s); {failed} failed.'))
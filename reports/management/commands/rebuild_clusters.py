@@ -0,0 +1,21 @@
+"""
+Management command to recompute the map clustering pyramid from scratch.
+
+The pyramid is maintained incrementally; run this after bulk imports that
+bypass the ORM, after changing CLUSTER_GRID or MAX_CLUSTER_ZOOM, or if the
+clusters are ever suspected to have drifted.
+
+Usage:
+    python manage.py rebuild_clusters
+"""
+from django.core.management.base import BaseCommand
+
+from reports import clusters
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the map clustering pyramid (ClusterCell) from IncidentReport'
+
+    def handle(self, *args, **options):
+        count = clusters.rebuild()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt cluster pyramid: {count} cell(s).'))
@@ -0,0 +1,22 @@
+"""
+Management command to recompute the verified incident counters from scratch.
+
+The counters are maintained incrementally; run this after bulk imports that
+bypass the ORM or if the counters are ever suspected to have drifted.
+
+Usage:
+    python manage.py rebuild_incident_stats
+"""
+from django.core.management.base import BaseCommand
+
+from reports import stats
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the verified incident counters (IncidentStat) from IncidentReport'
+
+    def handle(self, *args, **options):
+        stats.rebuild()
+        self.stdout.write(
+            self.style.SUCCESS(f'Rebuilt incident stats: {stats.total_verified()} verified report(s).')
+        )
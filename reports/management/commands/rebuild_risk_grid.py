@@ -0,0 +1,25 @@
+"""
+Management command to rebuild the route risk grid.
+
+Reports are added to and removed from the grid as they are verified, but
+the grid only covers the area the reports covered when it was built, and
+a rebuild resets the time-decay reference. Run it once after deploying,
+and then periodically (e.g. nightly).
+
+Usage:
+    python manage.py rebuild_risk_grid
+"""
+from django.core.management.base import BaseCommand
+
+from reports import risk
+
+
+class Command(BaseCommand):
+    help = 'Rasterizes verified reports into the risk grid used for route scoring'
+
+    def handle(self, *args, **options):
+        grid = risk.rebuild()
+        self.stdout.write(self.style.SUCCESS(
+            f'Built risk grid: {len(grid.keys)} block(s) of {risk.BLOCK_SIZE}x{risk.BLOCK_SIZE} '
+            f'{risk.CELL_METERS}m cells, {len(grid.categories)} categories, at {risk.grid_path()}.'
+        ))
@@ -0,0 +1,20 @@
+"""
+Management command to recreate the full-text search documents from scratch.
+
+The documents are maintained on save/delete; run this after bulk imports
+that bypass the ORM or if search results are ever suspected to be stale.
+
+Usage:
+    python manage.py rebuild_search_index
+"""
+from django.core.management.base import BaseCommand
+
+from reports import search
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the full-text search documents (SearchDocument) from reports, discussions and replies'
+
+    def handle(self, *args, **options):
+        count = search.rebuild()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt search index ({search.backend()}): {count} document(s).'))
@@ -0,0 +1,25 @@
+"""
+Management command to rebuild the saved-zone index and alerts.
+
+Zone cells and alerts are maintained as zones are saved and reports are
+verified. Run this after bulk imports that bypass the ORM, or after
+changing ZONE_CELL_PRECISION / MAX_ZONE_CELLS. Alerts are rematched for the
+last zones.BACKFILL_WINDOW of verified reports; older alerts are kept.
+
+Usage:
+    python manage.py rebuild_zone_alerts
+"""
+from django.core.management.base import BaseCommand
+
+from reports import zones
+from reports.models import ZoneAlert
+
+
+class Command(BaseCommand):
+    help = 'Re-indexes saved zones and rematches them against recent verified reports'
+
+    def handle(self, *args, **options):
+        count = zones.rebuild()
+        self.stdout.write(
+            self.style.SUCCESS(f'Rebuilt {count} zone(s): {ZoneAlert.objects.count()} alert(s).')
+        )
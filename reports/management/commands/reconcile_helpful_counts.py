@@ -0,0 +1,57 @@
+"""
+Management command to rebuild IncidentReport.helpful_count from HelpfulReport.
+
+HelpfulReport rows are the source of truth for helpful votes. Run this
+after a crash may have lost buffered votes (SAFEROUTE_HELPFUL_BUFFER), or
+whenever the counters are suspected to have drifted. Only reports whose
+counter differs are written. With buffering on, votes that other workers
+have not flushed yet are counted here and again when they flush, so run it
+when the workers are idle or stopped (the overcount is bounded by one flush
+interval's worth of votes and goes away on the next run).
+
+Usage:
+    python manage.py reconcile_helpful_counts
+    python manage.py reconcile_helpful_counts --dry-run
+"""
+from django.core.management.base import BaseCommand
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from reports import votes
+from reports.models import HelpfulReport, IncidentReport
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds helpful-vote counters from HelpfulReport rows'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only report the drifted counters')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Reports updated per query')
+
+    def handle(self, *args, **options):
+        # Votes buffered in this process are already in HelpfulReport
+        votes.flush()
+
+        actual = Coalesce(Subquery(
+            HelpfulReport.objects.filter(report=OuterRef('pk'))
+            .order_by().values('report').annotate(count=Count('pk')).values('count')
+        ), 0)
+        drifted = list(
+            IncidentReport.objects.annotate(actual=actual)
+            .exclude(helpful_count=F('actual'))
+            .values_list('pk', 'helpful_count', 'actual')
+        )
+        for pk, stored, count in drifted[:20]:
+            self.stdout.write(f'Report {pk}: {stored} -> {count}')
+        if len(drifted) > 20:
+            self.stdout.write(f'... and {len(drifted) - 20} more')
+
+        if options['dry_run']:
+            self.stdout.write(f'{len(drifted)} counter(s) would be fixed.')
+            return
+
+        batch_size = options['batch_size']
+        pks = [pk for pk, _, _ in drifted]
+        for start in range(0, len(pks), batch_size):
+            IncidentReport.objects.untracked().filter(pk__in=pks[start:start + batch_size]).update(helpful_count=actual)
+        self.stdout.write(self.style.SUCCESS(f'Fixed {len(drifted)} helpful counter(s).'))
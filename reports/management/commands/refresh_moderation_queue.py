@@ -0,0 +1,22 @@
+"""
+Management command to recompute the moderation priority of every pending report.
+
+Priorities are set when a report is submitted or its reporter is
+(un)verified; helpful votes and nearby verifications change them
+afterwards. Run this periodically (e.g. hourly) to keep the queue order
+current.
+
+Usage:
+    python manage.py refresh_moderation_queue
+"""
+from django.core.management.base import BaseCommand
+
+from reports import moderation
+
+
+class Command(BaseCommand):
+    help = 'Recomputes IncidentReport.moderation_priority for every pending report'
+
+    def handle(self, *args, **options):
+        count = moderation.refresh()
+        self.stdout.write(self.style.SUCCESS(f'Refreshed moderation priority of {count} pending report(s).'))
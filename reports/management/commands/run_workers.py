@@ -0,0 +1,121 @@
+"""
+Management command to run background jobs from the database queue.
+
+Starts a pool of worker threads (and optionally several processes) that
+claim due jobs, run their handlers and record the result, retrying
+failures with backoff (see reports.jobs). Jobs left running by a worker
+that died are put back in the queue, abandoned resumable uploads are
+cleaned up and a missing route risk grid is scheduled for building on
+start. Stop with Ctrl-C or SIGTERM; running jobs are allowed to finish.
+
+Usage:
+    python manage.py run_workers
+    python manage.py run_workers --threads 4 --processes 2
+    python manage.py run_workers --once
+"""
+import signal
+import subprocess
+import sys
+import threading
+import time
+from datetime import timedelta
+
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections, connections
+
+from reports import jobs, risk, uploads
+
+# Seconds between requeue_stale() runs in each worker thread, busy or idle
+HOUSEKEEPING_INTERVAL = 300
+
+
+class Command(BaseCommand):
+    help = 'Runs background jobs from the database queue'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=2, help='Worker threads per process (default 2)')
+        parser.add_argument('--processes', type=int, default=1, help='Worker processes (default 1)')
+        parser.add_argument('--poll-interval', type=float, default=1.0, help='Seconds to wait when the queue is empty')
+        parser.add_argument('--once', action='store_true', help='Exit once no due jobs are left')
+        parser.add_argument('--purge-days', type=int, default=7, help='Delete finished jobs older than this')
+
+    def handle(self, *args, **options):
+        if isinstance(caches['default'], LocMemCache):
+            # Jobs invalidate cached incident data (reports.cache); a per-process cache would hide that from the web
+            raise CommandError('run_workers needs a cache shared with the web processes; set CACHE_URL to a file:// or redis:// URL.')
+        if options['processes'] > 1:
+            return self.run_processes(options)
+
+        self.stop = threading.Event()
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGTERM, lambda *args: self.stop.set())
+
+        requeued = jobs.requeue_stale()
+        purged = jobs.purge(timedelta(days=options['purge_days']))
+        expired = uploads.purge_expired()
+        risk.ensure_built()
+        self.stdout.write(
+            f'Starting {options["threads"]} worker thread(s); requeued {requeued} stale job(s), '
+            f'purged {purged} finished job(s) and {expired} abandoned upload(s).'
+        )
+        threads = [
+            threading.Thread(target=self.work, args=(jobs.worker_name(f':{i}'), options), daemon=True)
+            for i in range(options['threads'])
+        ]
+        for thread in threads:
+            thread.start()
+        try:
+            while any(thread.is_alive() for thread in threads):
+                for thread in threads:
+                    thread.join(timeout=0.5)
+        except KeyboardInterrupt:
+            self.stop.set()
+            self.stdout.write('Stopping; waiting for running jobs to finish...')
+            for thread in threads:
+                thread.join()
+        self.stdout.write(self.style.SUCCESS('Workers stopped.'))
+
+    def work(self, worker, options):
+        """Claim and run jobs until stopped (or, with --once, until the queue is drained)"""
+        last_housekeeping = time.monotonic()
+        try:
+            while not self.stop.is_set():
+                close_old_connections()
+                if time.monotonic() - last_housekeeping > HOUSEKEEPING_INTERVAL:
+                    # Reclaim jobs of crashed workers even while this one has nothing to do
+                    jobs.requeue_stale()
+                    last_housekeeping = time.monotonic()
+                claimed = jobs.claim(worker)
+                if not claimed:
+                    if options['once']:
+                        return
+                    self.stop.wait(options['poll_interval'])
+                    continue
+                for job in claimed:
+                    ok = jobs.execute(job)
+                    self.stdout.write(f'[{worker}] {job.name} #{job.pk}: {"done" if ok else "failed"}')
+        finally:
+            connections.close_all()
+
+    def run_processes(self, options):
+        """Run this command in several child processes and wait for them"""
+        command = [
+            sys.executable, sys.argv[0], 'run_workers',
+            '--threads', str(options['threads']),
+            '--poll-interval', str(options['poll_interval']),
+            '--purge-days', str(options['purge_days']),
+        ]
+        if options['once']:
+            command.append('--once')
+        children = [subprocess.Popen(command) for _ in range(options['processes'])]
+        signal.signal(signal.SIGTERM, lambda *args: [child.terminate() for child in children])
+        try:
+            for child in children:
+                child.wait()
+        except KeyboardInterrupt:
+            for child in children:
+                child.terminate()
+            for child in children:
+                child.wait()
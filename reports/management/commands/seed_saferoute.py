@@ -0,0 +1,257 @@
+"""
+Management command to fill the database with realistic synthetic data.
+
+Creates users, incident reports clustered around city hotspots, images
+(placeholder files saved to local media storage), helpful votes and
+community discussions with replies. Everything is written with bulk_create
+in batches, so it scales from a quick 10k-report dataset to several million
+rows. At the end near-duplicate reports are linked, derived data (the
+verified incident counters, the map cluster pyramid, the route risk grid,
+the trend rollups, the search index, the moderation priorities of
+pending reports and the perceptual image hashes) is rebuilt and every
+incident cache is invalidated.
+
+Usage:
+    python manage.py seed_saferoute
+    python manage.py seed_saferoute --reports 1000000 --batch-size 10000
+"""
+import io
+import random
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.core.management.base import BaseCommand, CommandError
+from django.db import reset_queries, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from reports import clusters, dedup, moderation, perceptual, risk, rollups, search, stats
+from reports.models import (
+    CommunityDiscussion, DiscussionReply, HelpfulReport, ImageHash, IncidentImage, IncidentReport,
+)
+from reports.snapshot import bump_dataset_version
+
+User = get_user_model()
+
+# (name, latitude, longitude, spread in degrees, relative weight)
+HOTSPOTS = [
+    ('Nairobi CBD', -1.2864, 36.8172, 0.010, 10),
+    ('Westlands', -1.2676, 36.8108, 0.012, 6),
+    ('Eastleigh', -1.2744, 36.8518, 0.012, 6),
+    ('Kibera', -1.3133, 36.7876, 0.010, 5),
+    ('Githurai', -1.2012, 36.9120, 0.015, 3),
+    ('Mombasa Old Town', -4.0626, 39.6772, 0.010, 4),
+    ('Kisumu', -0.0917, 34.7680, 0.015, 3),
+    ('Nakuru', -0.3031, 36.0800, 0.015, 2),
+]
+# Reports that fall outside every hotspot, anywhere in Kenya
+BACKGROUND_BOX = (-4.6, 34.0, 4.6, 41.9)
+BACKGROUND_SHARE = 0.05
+
+TITLES = {
+    'theft': ['Phone snatched', 'Pickpocketing at the stage', 'Bag stolen from car'],
+    'harassment': ['Harassment on a matatu', 'Verbal harassment', 'Followed home'],
+    'assault': ['Assault near the market', 'Attack on a pedestrian', 'Fight outside a bar'],
+    'road_danger': ['Open manhole', 'Reckless boda boda riders', 'Broken traffic lights'],
+    'fraud': ['Fake M-Pesa agent', 'Rental scam', 'Counterfeit tickets sold'],
+    'violence': ['Armed robbery at a shop', 'Mugging at night', 'Gang clash'],
+    'other': ['Unsafe unlit path', 'Road blocked by crowd', 'Fire in a dumpsite'],
+}
+DISCUSSION_CATEGORIES = [value for value, _ in CommunityDiscussion.CATEGORY_CHOICES]
+IMAGE_TYPES = [value for value, _ in IncidentImage.IMAGE_TYPE_CHOICES]
+
+SEED_PASSWORD = 'saferoute'
+
+
+class Command(BaseCommand):
+    help = 'Bulk-creates synthetic users, reports, images, votes and discussions for local load testing'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reports', type=int, default=10000, help='Number of incident reports (default 10000)')
+        parser.add_argument('--users', type=int, help='Number of users (default: one per 50 reports)')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Rows per bulk_create (default 5000)')
+        parser.add_argument('--days', type=int, default=365, help='Spread reports over this many past days')
+        parser.add_argument('--verified-share', type=float, default=0.8, help='Share of verified reports')
+        parser.add_argument('--image-share', type=float, default=0.3, help='Share of reports with images')
+        parser.add_argument('--no-images', action='store_true', help='Do not create images')
+        parser.add_argument('--seed', type=int, default=42, help='Random seed, for reproducible datasets')
+
+    def handle(self, *args, **options):
+        if options['reports'] < 1 or options['batch_size'] < 1:
+            raise CommandError('--reports and --batch-size must be positive.')
+        self.rng = random.Random(options['seed'])
+        self.now = timezone.now()
+        self.batch_size = options['batch_size']
+        reports = options['reports']
+
+        user_ids = self.create_users(options['users'] or max(10, reports // 50))
+        placeholders = {} if options['no_images'] else self.save_placeholders()
+        self.create_reports(reports, user_ids, placeholders, options)
+        self.create_discussions(max(1, reports // 20), user_ids)
+
+        self.stdout.write('Rebuilding derived data...')
+        # Duplicates leave the counted set, so they are linked before the rebuilds below
+        dedup.rebuild(track_changes=False)
+        stats.rebuild()
+        clusters.rebuild()
+        try:
+            risk.rebuild()
+        except risk.GridUnavailable as e:
+            self.stdout.write(f'Skipped the route risk grid: {e}')
+        rollups.rebuild()
+        search.rebuild()
+        # Priorities read the cluster pyramid, so they come after it
+        moderation.refresh()
+        if placeholders:
+            self.hash_placeholder_images(placeholders)
+        bump_dataset_version()
+        self.stdout.write(self.style.SUCCESS(
+            f'Seeded {reports} report(s); {stats.total_verified()} verified.'
+        ))
+        self.stdout.write(f'Seeded users can log in with the password "{SEED_PASSWORD}".')
+
+    def create_users(self, count):
+        """Create seed users and return their ids"""
+        # Continue numbering after an earlier run so usernames stay unique
+        offset = User.objects.filter(username__startswith='seed_user_').count()
+        password = make_password(SEED_PASSWORD)  # hashing is slow, so hash once
+        for start in range(0, count, self.batch_size):
+            User.objects.bulk_create([
+                User(
+                    username=f'seed_user_{offset + i}',
+                    email=f'seed_user_{offset + i}@example.com',
+                    password=password,
+                    is_verified=self.rng.random() < 0.3,
+                )
+                for i in range(start, min(start + self.batch_size, count))
+            ])
+        self.stdout.write(f'Created {count} user(s).')
+        return list(
+            User.objects.filter(username__startswith='seed_user_').order_by('-pk').values_list('pk', flat=True)[:count]
+        )
+
+    def save_placeholders(self):
+        """Save one small placeholder image per image type to local media storage"""
+        from PIL import Image
+
+        storage = FileSystemStorage(location=settings.MEDIA_ROOT)
+        colours = {'suspect': (120, 30, 30), 'location': (30, 90, 120), 'evidence': (90, 90, 90)}
+        names = {}
+        for image_type in IMAGE_TYPES:
+            name = f'incident_images/seed_{image_type}.png'
+            if not storage.exists(name):
+                buffer = io.BytesIO()
+                Image.new('RGB', (320, 240), colours.get(image_type, (0, 0, 0))).save(buffer, 'PNG')
+                name = storage.save(name, ContentFile(buffer.getvalue()))
+            names[image_type] = name
+        return names
+
+    def hash_placeholder_images(self, placeholders):
+        """Store the perceptual hash of every seeded image; the copies of a placeholder share its hash"""
+        from PIL import Image
+
+        storage = FileSystemStorage(location=settings.MEDIA_ROOT)
+        for name in set(placeholders.values()):
+            with storage.open(name, 'rb') as data, Image.open(data) as source:
+                value = perceptual.dhash(source)
+            fields = {f'chunk_{index}': part for index, part in enumerate(perceptual.chunks(value))}
+            image_ids = list(
+                IncidentImage.objects.filter(image=name, perceptual_hash__isnull=True).values_list('pk', flat=True)
+            )
+            for start in range(0, len(image_ids), self.batch_size):
+                ImageHash.objects.bulk_create([
+                    ImageHash(image_id=image_id, value=perceptual.to_signed(value), **fields)
+                    for image_id in image_ids[start:start + self.batch_size]
+                ])
+
+    def random_location(self):
+        if self.rng.random() < BACKGROUND_SHARE:
+            min_lat, min_lon, max_lat, max_lon = BACKGROUND_BOX
+            return self.rng.uniform(min_lat, max_lat), self.rng.uniform(min_lon, max_lon), ''
+        name, lat, lon, spread, _ = self.rng.choices(HOTSPOTS, weights=[spot[4] for spot in HOTSPOTS])[0]
+        return self.rng.gauss(lat, spread), self.rng.gauss(lon, spread), name
+
+    def create_reports(self, count, user_ids, placeholders, options):
+        """Create reports in batches, with their images and helpful votes"""
+        categories = list(TITLES)
+        severities = [value for value, _ in IncidentReport.SEVERITY_CHOICES]
+        minutes = options['days'] * 24 * 60
+        created_count = 0
+        for start in range(0, count, self.batch_size):
+            batch = []
+            voters = []
+            for _ in range(min(self.batch_size, count - start)):
+                lat, lon, location_name = self.random_location()
+                category = self.rng.choice(categories)
+                # Votes follow a long tail: most reports get none, a few get many
+                votes = self.rng.sample(user_ids, min(len(user_ids), 50, int(self.rng.paretovariate(1.5)) - 1))
+                voters.append(votes)
+                batch.append(IncidentReport(
+                    user_id=self.rng.choice(user_ids),
+                    title=self.rng.choice(TITLES[category]),
+                    category=category,
+                    description=f'Synthetic {category} report generated by seed_saferoute.',
+                    severity=self.rng.choices(severities, weights=[5, 3, 2])[0],
+                    latitude=round(lat, 6),
+                    longitude=round(lon, 6),
+                    location_name=location_name,
+                    incident_date=self.now - timedelta(minutes=self.rng.randrange(minutes)),
+                    is_verified=self.rng.random() < options['verified_share'],
+                    helpful_count=len(votes),
+                ))
+            with transaction.atomic():
+                # Derived data (stats, caches) is rebuilt once at the end
+                created = IncidentReport.objects.untracked().bulk_create(batch)
+                # created_at is auto_now_add; backdate it to the incident date
+                IncidentReport.objects.untracked().filter(
+                    pk__gte=created[0].pk, pk__lte=created[-1].pk
+                ).update(created_at=F('incident_date'))
+                HelpfulReport.objects.bulk_create([
+                    HelpfulReport(user_id=user_id, report_id=report.pk)
+                    for report, votes in zip(created, voters)
+                    for user_id in votes
+                ], batch_size=self.batch_size)
+                if placeholders:
+                    IncidentImage.objects.bulk_create([
+                        IncidentImage(
+                            report_id=report.pk,
+                            image=placeholders[image_type],
+                            image_type=image_type,
+                            description='Placeholder image',
+                        )
+                        for report in created
+                        if self.rng.random() < options['image_share']
+                        for image_type in self.rng.sample(IMAGE_TYPES, self.rng.randint(1, len(IMAGE_TYPES)))
+                    ], batch_size=self.batch_size)
+            created_count += len(created)
+            reset_queries()  # keep DEBUG query logging from holding every INSERT
+            self.stdout.write(f'Created {created_count}/{count} report(s)...')
+
+    def create_discussions(self, count, user_ids):
+        """Create discussions with a long-tailed number of replies each"""
+        for start in range(0, count, self.batch_size):
+            batch = []
+            reply_counts = []
+            for _ in range(min(self.batch_size, count - start)):
+                replies = min(200, int(self.rng.paretovariate(1.2)) - 1)
+                reply_counts.append(replies)
+                batch.append(CommunityDiscussion(
+                    user_id=self.rng.choice(user_ids),
+                    title=f'Staying safe around {self.rng.choice(HOTSPOTS)[0]}',
+                    content='Synthetic discussion generated by seed_saferoute.',
+                    category=self.rng.choice(DISCUSSION_CATEGORIES),
+                    reply_count=replies,
+                ))
+            with transaction.atomic():
+                created = CommunityDiscussion.objects.bulk_create(batch)
+                DiscussionReply.objects.bulk_create([
+                    DiscussionReply(discussion_id=discussion.pk, user_id=self.rng.choice(user_ids),
+                                    content='Synthetic reply.')
+                    for discussion, replies in zip(created, reply_counts)
+                    for _ in range(replies)
+                ], batch_size=self.batch_size)
+        self.stdout.write(f'Created {count} discussion(s).')
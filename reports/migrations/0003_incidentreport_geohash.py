@@ -0,0 +1,42 @@
+# Generated by Django 4.2.7 on 2026-10-18 19:26
+
+from django.db import migrations, models
+
+
+def populate_geohash(apps, schema_editor):
+    from reports.geo import encode
+
+    IncidentReport = apps.get_model('reports', 'IncidentReport')
+    batch = []
+    for report in IncidentReport.objects.only('id', 'latitude', 'longitude').iterator(chunk_size=1000):
+        report.geohash = encode(report.latitude, report.longitude)
+        batch.append(report)
+        if len(batch) >= 1000:
+            IncidentReport.objects.bulk_update(batch, ['geohash'])
+            batch = []
+    if batch:
+        IncidentReport.objects.bulk_update(batch, ['geohash'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reports', '0002_communitydiscussion_discussionreply'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='incidentreport',
+            name='geohash',
+            field=models.CharField(blank=True, editable=False, max_length=12),
+        ),
+        migrations.RunPython(populate_geohash, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='incidentreport',
+            index=models.Index(fields=['is_verified', 'geohash'], name='report_verified_geohash_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='incidentreport',
+            index=models.Index(fields=['is_verified', 'category', 'geohash'], name='report_verified_cat_geo_idx'),
+        ),
+    ]
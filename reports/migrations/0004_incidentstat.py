@@ -0,0 +1,43 @@
+# Generated by Django 4.2.7 on 2026-10-18 19:58
+
+from django.db import migrations, models
+from django.db.models import Count
+from django.db.models.functions import TruncDate
+
+
+def populate_stats(apps, schema_editor):
+    IncidentReport = apps.get_model('reports', 'IncidentReport')
+    IncidentStat = apps.get_model('reports', 'IncidentStat')
+    rows = (
+        IncidentReport.objects.filter(is_verified=True)
+        .order_by()
+        .annotate(day=TruncDate('incident_date'))
+        .values('day', 'category', 'severity')
+        .annotate(count=Count('id'))
+    )
+    IncidentStat.objects.bulk_create([IncidentStat(**row) for row in rows], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reports', '0003_incidentreport_geohash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IncidentStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('category', models.CharField(choices=[('theft', 'Theft'), ('harassment', 'Harassment'), ('assault', 'Assault'), ('road_danger', 'Road Danger'), ('fraud', 'Fraud/Scam'), ('violence', 'Violence'), ('other', 'Other')], max_length=20)),
+                ('severity', models.CharField(choices=[('low', 'Low'), ('moderate', 'Moderate'), ('high', 'High')], max_length=10)),
+                ('count', models.IntegerField(default=0)),
+            ],
+            options={
+                'ordering': ['-day', 'category', 'severity'],
+                'unique_together': {('day', 'category', 'severity')},
+            },
+        ),
+        migrations.RunPython(populate_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 4.2.7 on 2026-10-18 20:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reports', '0004_incidentstat'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='communitydiscussion',
+            index=models.Index(fields=['category', '-created_at'], name='discussion_cat_recent_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='discussionreply',
+            index=models.Index(fields=['discussion', 'created_at'], name='reply_discussion_recent_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='incidentimage',
+            index=models.Index(fields=['report', 'image_type'], name='image_report_type_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='incidentimage',
+            index=models.Index(fields=['image_type', '-created_at'], name='image_type_recent_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='incidentreport',
+            index=models.Index(condition=models.Q(('is_verified', True)), fields=['-created_at'], name='report_verified_recent_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='incidentreport',
+            index=models.Index(fields=['is_verified', 'category', 'severity', 'created_at'], name='report_verified_cat_sev_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='incidentreport',
+            index=models.Index(fields=['user', '-created_at'], name='report_user_recent_idx'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reports', '0005_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='incidentimage',
+            name='thumbnail_small',
+            field=models.ImageField(blank=True, editable=False, upload_to='incident_images/derivatives/'),
+        ),
+        migrations.AddField(
+            model_name='incidentimage',
+            name='thumbnail_medium',
+            field=models.ImageField(blank=True, editable=False, upload_to='incident_images/derivatives/'),
+        ),
+        migrations.AddField(
+            model_name='incidentimage',
+            name='thumbnail_large',
+            field=models.ImageField(blank=True, editable=False, upload_to='incident_images/derivatives/'),
+        ),
+        migrations.AddField(
+            model_name='incidentimage',
+            name='blurred_image',
+            field=models.ImageField(blank=True, editable=False, upload_to='incident_images/derivatives/'),
+        ),
+        migrations.AddField(
+            model_name='incidentimage',
+            name='processing_status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('ready', 'Ready'), ('failed', 'Failed')], default='pending', editable=False, max_length=10),
+        ),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 4.2.7 on 2026-10-18 19:58
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def index_zones(apps, schema_editor):
+    from reports.zones import zone_cells
+
+    SavedZone = apps.get_model('reports', 'SavedZone')
+    ZoneCell = apps.get_model('reports', 'ZoneCell')
+    for zone in SavedZone.objects.iterator():
+        ZoneCell.objects.bulk_create([
+            ZoneCell(zone=zone, cell=cell) for cell in zone_cells(zone.latitude, zone.longitude, zone.radius)
+        ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('reports', '0008_uploadsession'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ZoneCell',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('cell', models.CharField(db_index=True, max_length=12)),
+                ('zone', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='cells', to='reports.savedzone')),
+            ],
+            options={
+                'unique_together': {('zone', 'cell')},
+            },
+        ),
+        migrations.CreateModel(
+            name='ZoneAlert',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('distance_km', models.FloatField()),
+                ('reported_at', models.DateTimeField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('report', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='zone_alerts', to='reports.incidentreport')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='zone_alerts', to=settings.AUTH_USER_MODEL)),
+                ('zone', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='alerts', to='reports.savedzone')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', '-reported_at'], name='zonealert_user_recent_idx')],
+                'unique_together': {('user', 'report')},
+            },
+        ),
+        migrations.RunPython(index_zones, migrations.RunPython.noop),
+    ]
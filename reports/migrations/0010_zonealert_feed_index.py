@@ -0,0 +1,21 @@
+# Generated by Django 4.2.7 on 2026-10-18 20:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reports', '0009_zone_alerts'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='zonealert',
+            name='zonealert_user_recent_idx',
+        ),
+        migrations.AddIndex(
+            model_name='zonealert',
+            index=models.Index(fields=['user', '-reported_at', '-report'], name='zonealert_user_feed_idx'),
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 4.2.7 on 2026-10-18 20:02
+
+from django.db import migrations, models
+
+
+def populate_clusters(apps, schema_editor):
+    from reports.clusters import cell_totals
+
+    IncidentReport = apps.get_model('reports', 'IncidentReport')
+    ClusterCell = apps.get_model('reports', 'ClusterCell')
+    rows = (
+        IncidentReport.objects.filter(is_verified=True).order_by()
+        .values('latitude', 'longitude', 'category', 'severity')
+    )
+    ClusterCell.objects.bulk_create(
+        [ClusterCell(zoom=zoom, x=x, y=y, category=category, **cell)
+         for (zoom, x, y, category), cell in cell_totals(rows.iterator(chunk_size=2000)).items()],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reports', '0010_zonealert_feed_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ClusterCell',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('zoom', models.PositiveSmallIntegerField()),
+                ('x', models.IntegerField()),
+                ('y', models.IntegerField()),
+                ('category', models.CharField(choices=[('theft', 'Theft'), ('harassment', 'Harassment'), ('assault', 'Assault'), ('road_danger', 'Road Danger'), ('fraud', 'Fraud/Scam'), ('violence', 'Violence'), ('other', 'Other')], max_length=20)),
+                ('count', models.IntegerField(default=0)),
+                ('low', models.IntegerField(default=0)),
+                ('moderate', models.IntegerField(default=0)),
+                ('high', models.IntegerField(default=0)),
+                ('lat_sum', models.FloatField(default=0)),
+                ('lon_sum', models.FloatField(default=0)),
+            ],
+            options={
+                'unique_together': {('zoom', 'x', 'y', 'category')},
+            },
+        ),
+        migrations.RunPython(populate_clusters, migrations.RunPython.noop),
+    ]
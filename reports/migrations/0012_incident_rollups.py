@@ -0,0 +1,58 @@
+# Generated by Django 4.2.7 on 2026-10-18 20:15
+
+from django.db import migrations, models
+
+
+def populate_rollups(apps, schema_editor):
+    from reports.rollups import rollup_totals
+
+    IncidentReport = apps.get_model('reports', 'IncidentReport')
+    IncidentRollup = apps.get_model('reports', 'IncidentRollup')
+    rows = (
+        IncidentReport.objects.filter(is_verified=True).order_by()
+        .values('latitude', 'longitude', 'geohash', 'category', 'severity', 'incident_date')
+    )
+    IncidentRollup.objects.bulk_create(
+        [IncidentRollup(period=period, bucket=bucket, cell=cell, category=category, severity=severity, count=count)
+         for (period, bucket, cell, category, severity), count in rollup_totals(rows.iterator(chunk_size=2000)).items()],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reports', '0011_clustercell'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IncidentRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('hour', 'Hour'), ('day', 'Day')], max_length=4)),
+                ('bucket', models.DateTimeField()),
+                ('cell', models.CharField(max_length=12)),
+                ('category', models.CharField(choices=[('theft', 'Theft'), ('harassment', 'Harassment'), ('assault', 'Assault'), ('road_danger', 'Road Danger'), ('fraud', 'Fraud/Scam'), ('violence', 'Violence'), ('other', 'Other')], max_length=20)),
+                ('severity', models.CharField(choices=[('low', 'Low'), ('moderate', 'Moderate'), ('high', 'High')], max_length=10)),
+                ('count', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.RemoveIndex(
+            model_name='incidentreport',
+            name='report_verified_cat_sev_idx',
+        ),
+        migrations.AddIndex(
+            model_name='incidentreport',
+            index=models.Index(fields=['is_verified', 'category', 'severity', 'incident_date'], name='report_verified_incident_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='incidentrollup',
+            index=models.Index(fields=['period', 'bucket'], name='rollup_period_bucket_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='incidentrollup',
+            unique_together={('period', 'cell', 'bucket', 'category', 'severity')},
+        ),
+        migrations.RunPython(populate_rollups, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 4.2.7 on 2026-10-18 20:18
+
+from django.db import migrations, models
+
+
+def install_search_index(apps, schema_editor):
+    from reports.search import install_index
+
+    install_index(schema_editor)
+
+
+def uninstall_search_index(apps, schema_editor):
+    from reports.search import uninstall_index
+
+    uninstall_index(schema_editor)
+
+
+def populate_documents(apps, schema_editor):
+    from reports.search import discussion_document, reply_document, report_document
+
+    SearchDocument = apps.get_model('reports', 'SearchDocument')
+    for model_name, build in (
+        ('IncidentReport', report_document),
+        ('CommunityDiscussion', discussion_document),
+        ('DiscussionReply', reply_document),
+    ):
+        instances = apps.get_model('reports', model_name).objects.order_by().iterator(chunk_size=500)
+        SearchDocument.objects.bulk_create((SearchDocument(**build(instance)) for instance in instances), batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reports', '0012_incident_rollups'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchDocument',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('report', 'Incident Report'), ('discussion', 'Discussion'), ('reply', 'Discussion Reply')], max_length=10)),
+                ('object_id', models.PositiveIntegerField()),
+                ('parent_id', models.PositiveIntegerField(blank=True, null=True)),
+                ('title', models.CharField(blank=True, max_length=200)),
+                ('body', models.TextField(blank=True)),
+                ('category', models.CharField(blank=True, max_length=30)),
+                ('is_public', models.BooleanField(default=True)),
+                ('created_at', models.DateTimeField()),
+            ],
+            options={
+                'unique_together': {('kind', 'object_id')},
+            },
+        ),
+        migrations.RunPython(install_search_index, uninstall_search_index),
+        migrations.RunPython(populate_documents, migrations.RunPython.noop),
+    ]
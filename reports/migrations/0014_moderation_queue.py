@@ -0,0 +1,44 @@
+# Generated by Django 4.2.7 on 2026-10-18 20:23
+
+from django.db import migrations, models
+
+
+def populate_priorities(apps, schema_editor):
+    from reports.moderation import PRIORITY_FIELDS, priorities
+
+    IncidentReport = apps.get_model('reports', 'IncidentReport')
+    ClusterCell = apps.get_model('reports', 'ClusterCell')
+    rows = list(
+        IncidentReport.objects.filter(is_verified=False).order_by().values(*PRIORITY_FIELDS)
+    )
+    for start in range(0, len(rows), 500):
+        scores = priorities(rows[start:start + 500], cluster_model=ClusterCell)
+        IncidentReport.objects.bulk_update(
+            [IncidentReport(pk=pk, moderation_priority=score) for pk, score in scores.items()],
+            ['moderation_priority'],
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reports', '0013_search_documents'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='incidentreport',
+            name='is_rejected',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='incidentreport',
+            name='moderation_priority',
+            field=models.FloatField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='incidentreport',
+            index=models.Index(condition=models.Q(('is_rejected', False), ('is_verified', False)), fields=['-moderation_priority', '-id'], name='report_moderation_queue_idx'),
+        ),
+        migrations.RunPython(populate_priorities, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 4.2.7 on 2026-10-18 20:30
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reports', '0014_moderation_queue'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IncidentFingerprint',
+            fields=[
+                ('report', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='fingerprint', serialize=False, to='reports.incidentreport')),
+                ('signature', models.BinaryField()),
+            ],
+        ),
+        migrations.AddField(
+            model_name='incidentreport',
+            name='duplicate_of',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='duplicates', to='reports.incidentreport'),
+        ),
+        migrations.CreateModel(
+            name='FingerprintBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.BigIntegerField()),
+                ('report', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='fingerprint_buckets', to='reports.incidentreport')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['key', 'report'], name='fingerprint_bucket_key_idx')],
+            },
+        ),
+    ]
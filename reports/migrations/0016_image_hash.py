@@ -0,0 +1,28 @@
+# Generated by Django 4.2.7 on 2026-10-18 20:42
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reports', '0015_incident_dedup'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImageHash',
+            fields=[
+                ('image', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='perceptual_hash', serialize=False, to='reports.incidentimage')),
+                ('value', models.BigIntegerField()),
+                ('chunk_0', models.IntegerField()),
+                ('chunk_1', models.IntegerField()),
+                ('chunk_2', models.IntegerField()),
+                ('chunk_3', models.IntegerField()),
+            ],
+            options={
+                'indexes': [models.Index(fields=['chunk_0', 'value', 'image'], name='image_hash_chunk_0_idx'), models.Index(fields=['chunk_1', 'value', 'image'], name='image_hash_chunk_1_idx'), models.Index(fields=['chunk_2', 'value', 'image'], name='image_hash_chunk_2_idx'), models.Index(fields=['chunk_3', 'value', 'image'], name='image_hash_chunk_3_idx')],
+            },
+        ),
+    ]
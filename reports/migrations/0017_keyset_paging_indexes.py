@@ -0,0 +1,37 @@
+# Generated by Django 4.2.7 on 2026-10-18 20:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reports', '0016_image_hash'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='communitydiscussion',
+            name='discussion_cat_recent_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='incidentimage',
+            name='image_type_recent_idx',
+        ),
+        migrations.AddIndex(
+            model_name='communitydiscussion',
+            index=models.Index(fields=['-created_at', '-id'], name='discussion_recent_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='communitydiscussion',
+            index=models.Index(fields=['category', '-created_at', '-id'], name='discussion_cat_recent_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='incidentimage',
+            index=models.Index(fields=['-created_at', '-id'], name='image_recent_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='incidentimage',
+            index=models.Index(fields=['image_type', '-created_at', '-id'], name='image_type_recent_idx'),
+        ),
+    ]
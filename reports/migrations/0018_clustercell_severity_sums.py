@@ -0,0 +1,61 @@
+# Generated by Django 4.2.7 on 2026-10-18 21:10
+
+from django.db import migrations, models
+
+
+def repopulate_clusters(apps, schema_editor):
+    from reports.clusters import cell_totals
+
+    IncidentReport = apps.get_model('reports', 'IncidentReport')
+    ClusterCell = apps.get_model('reports', 'ClusterCell')
+    rows = (
+        IncidentReport.objects.filter(is_verified=True, duplicate_of__isnull=True).order_by()
+        .values('latitude', 'longitude', 'category', 'severity')
+    )
+    ClusterCell.objects.all().delete()
+    ClusterCell.objects.bulk_create(
+        [ClusterCell(zoom=zoom, x=x, y=y, category=category, **cell)
+         for (zoom, x, y, category), cell in cell_totals(rows.iterator(chunk_size=2000)).items()],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reports', '0017_keyset_paging_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='clustercell',
+            name='high_lat_sum',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='clustercell',
+            name='high_lon_sum',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='clustercell',
+            name='low_lat_sum',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='clustercell',
+            name='low_lon_sum',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='clustercell',
+            name='moderate_lat_sum',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='clustercell',
+            name='moderate_lon_sum',
+            field=models.FloatField(default=0),
+        ),
+        migrations.RunPython(repopulate_clusters, migrations.RunPython.noop),
+    ]
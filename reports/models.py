@@ -1,11 +1,16 @@
+import uuid
+
+from django.conf import settings
 from django.db import models
 from django.contrib.auth import get_user_model
 from django.core.validators import MinValueValidator, MaxValueValidator
+from . import changes, geo, snapshot
 
 # Try to import Cloudinary storage, fallback to default if not available
+# (or not configured, matching DEFAULT_FILE_STORAGE in settings)
 try:
     from cloudinary_storage.storage import MediaCloudinaryStorage
-    CLOUDINARY_STORAGE_AVAILABLE = True
+    CLOUDINARY_STORAGE_AVAILABLE = bool(getattr(settings, 'CLOUDINARY_STORAGE', {}).get('CLOUD_NAME'))
 except ImportError:
     MediaCloudinaryStorage = None
     CLOUDINARY_STORAGE_AVAILABLE = False
@@ -13,6 +18,122 @@ except ImportError:
 User = get_user_model()
 
 
+class IncidentReportQuerySet(models.QuerySet):
+    """
+    Queryset that keeps derived data in sync on bulk writes.
+    
+    Bulk paths recompute the geohash spatial key, bump the snapshot version
+    and send changes.verified_incidents_changed, just like save()/delete().
+    """
+    
+    _track_changes = True
+    
+    def _clone(self):
+        clone = super()._clone()
+        clone._track_changes = self._track_changes
+        return clone
+    
+    def counted(self):
+        """Verified reports, each incident counted once: duplicates of another report are left out (see reports.dedup)"""
+        return self.filter(is_verified=True, duplicate_of__isnull=True)
+    
+    def untracked(self):
+        """
+        Clone whose writes skip snapshot and change notifications.
+        
+        For internal bookkeeping and bulk loads that rebuild derived data afterwards.
+        """
+        clone = self._chain()
+        clone._track_changes = False
+        return clone
+    
+    def bulk_create(self, objs, *args, **kwargs):
+        for obj in objs:
+            obj.geohash = geo.encode(obj.latitude, obj.longitude)
+        created = super().bulk_create(objs, *args, **kwargs)
+        if self._track_changes:
+            snapshot.bump_dataset_version()
+            changes.send_changes(
+                self.model, [state for state in map(changes.incident_state, created) if changes.counted(state)], []
+            )
+        return created
+    
+    def bulk_update(self, objs, fields, *args, **kwargs):
+        # Django runs bulk_update through update(), which handles derived data
+        fields = list(fields)
+        if 'latitude' in fields or 'longitude' in fields:
+            for obj in objs:
+                obj.geohash = geo.encode(obj.latitude, obj.longitude)
+            if 'geohash' not in fields:
+                fields.append('geohash')
+        return super().bulk_update(objs, fields, *args, **kwargs)
+    
+    def update(self, **kwargs):
+        if not self._track_changes:
+            return super().update(**kwargs)
+        moves = 'latitude' in kwargs or 'longitude' in kwargs
+        tracked = moves or set(changes.TRACKED_FIELDS).intersection(kwargs)
+        if tracked:
+            # Remember the affected rows before the update can move them out of the filter
+            old_states = {row['id']: row for row in self.order_by().values('id', *changes.TRACKED_FIELDS)}
+        updated = super().update(**kwargs)
+        if moves:
+            self.model.objects.filter(pk__in=list(old_states)).sync_geohash()
+        if updated and snapshot.SNAPSHOT_FIELDS.intersection(kwargs):
+            snapshot.bump_dataset_version()
+        if updated and tracked:
+            new_states = changes.fetch_states(self.model, list(old_states))
+            changes.send_changes(self.model, *changes.diff_states(old_states, new_states))
+            changes.send_verification_changes(self.model, old_states, new_states)
+        return updated
+    
+    update.alters_data = True
+    
+    def sync_geohash(self, batch_size=1000):
+        """Recompute the stored geohash for every report in this queryset"""
+        batch = []
+        for report in self.only('id', 'latitude', 'longitude', 'geohash').iterator(chunk_size=batch_size):
+            geohash = geo.encode(report.latitude, report.longitude)
+            if report.geohash != geohash:
+                report.geohash = geohash
+                batch.append(report)
+            if len(batch) >= batch_size:
+                self.untracked().bulk_update(batch, ['geohash'])
+                batch = []
+        if batch:
+            self.untracked().bulk_update(batch, ['geohash'])
+    
+    sync_geohash.alters_data = True
+    
+    def in_bbox(self, min_lon, min_lat, max_lon, max_lat):
+        """
+        Restrict to reports inside a bounding box using the geohash index.
+        
+        A box with min_lon > max_lon is treated as crossing the antimeridian.
+        """
+        if min_lon > max_lon:
+            boxes = [(min_lon, min_lat, 180.0, max_lat), (-180.0, min_lat, max_lon, max_lat)]
+        else:
+            boxes = [(min_lon, min_lat, max_lon, max_lat)]
+        
+        spatial = models.Q()
+        for box in boxes:
+            for start, end in geo.prefix_ranges(geo.cover_bbox(*box)):
+                cell = models.Q(geohash__gte=start)
+                if end is not None:
+                    cell &= models.Q(geohash__lt=end)
+                spatial |= cell
+            
+        # The geohash cells cover the box; refine to the exact edges
+        exact = models.Q()
+        for box_min_lon, box_min_lat, box_max_lon, box_max_lat in boxes:
+            exact |= models.Q(
+                latitude__gte=box_min_lat, latitude__lte=box_max_lat,
+                longitude__gte=box_min_lon, longitude__lte=box_max_lon,
+            )
+        return self.filter(spatial).filter(exact)
+
+
 class IncidentReport(models.Model):
     """Main incident report model"""
     SEVERITY_CHOICES = [
@@ -43,14 +164,150 @@ class IncidentReport(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     is_verified = models.BooleanField(default=False)
+    # Turned down by a moderator; rejected reports leave the moderation queue
+    is_rejected = models.BooleanField(default=False)
     helpful_count = models.IntegerField(default=0)
     abuse_reports = models.IntegerField(default=0)
+    geohash = models.CharField(max_length=12, blank=True, editable=False)
+    # Moderation queue order, highest first (see reports.moderation)
+    moderation_priority = models.FloatField(default=0, editable=False)
+    # Primary report of the incident this one also describes (see reports.dedup)
+    duplicate_of = models.ForeignKey(
+        'self', on_delete=models.SET_NULL, null=True, blank=True, editable=False, related_name='duplicates',
+    )
+    
+    objects = IncidentReportQuerySet.as_manager()
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['is_verified', 'geohash'], name='report_verified_geohash_idx'),
+            models.Index(fields=['is_verified', 'category', 'geohash'], name='report_verified_cat_geo_idx'),
+            # Public listings: verified reports, newest first
+            models.Index(fields=['-created_at'], condition=models.Q(is_verified=True), name='report_verified_recent_idx'),
+            # Heatmap filters: category, severity and an incident_date window
+            models.Index(fields=['is_verified', 'category', 'severity', 'incident_date'], name='report_verified_incident_idx'),
+            # Dashboard/profile: a user's own reports, newest first
+            models.Index(fields=['user', '-created_at'], name='report_user_recent_idx'),
+            # Moderation queue: pending reports, highest priority first
+            models.Index(
+                fields=['-moderation_priority', '-id'],
+                condition=models.Q(is_verified=False, is_rejected=False),
+                name='report_moderation_queue_idx',
+            ),
+        ]
     
     def __str__(self):
         return f"{self.title} - {self.get_category_display()}"
+    
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember what was loaded so signals can diff the verified set on save
+        if set(changes.TRACKED_FIELDS).issubset(field_names):
+            instance._tracked_state = changes.incident_state(instance)
+        return instance
+    
+    def save(self, *args, **kwargs):
+        self.geohash = geo.encode(self.latitude, self.longitude)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and ('latitude' in update_fields or 'longitude' in update_fields):
+            kwargs['update_fields'] = set(update_fields) | {'geohash'}
+        super().save(*args, **kwargs)
+
+
+class IncidentFingerprint(models.Model):
+    """MinHash signature of a report's title and description (see reports.dedup)"""
+    report = models.OneToOneField(IncidentReport, on_delete=models.CASCADE, primary_key=True, related_name='fingerprint')
+    signature = models.BinaryField()
+    
+    def __str__(self):
+        return f"Fingerprint of report {self.report_id}"
+
+
+class FingerprintBucket(models.Model):
+    """One locality-sensitive hash band of a fingerprint, keyed with its grid cell, time window and category"""
+    key = models.BigIntegerField()
+    report = models.ForeignKey(IncidentReport, on_delete=models.CASCADE, related_name='fingerprint_buckets')
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['key', 'report'], name='fingerprint_bucket_key_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.key}: report {self.report_id}"
+
+
+class IncidentStat(models.Model):
+    """Verified report counts per incident day, category and severity (see reports.stats)"""
+    day = models.DateField()
+    category = models.CharField(max_length=20, choices=IncidentReport.CATEGORY_CHOICES)
+    severity = models.CharField(max_length=10, choices=IncidentReport.SEVERITY_CHOICES)
+    count = models.IntegerField(default=0)
+    
+    class Meta:
+        unique_together = ['day', 'category', 'severity']
+        ordering = ['-day', 'category', 'severity']
+    
+    def __str__(self):
+        return f"{self.day} {self.get_category_display()} / {self.get_severity_display()}: {self.count}"
+
+
+class ClusterCell(models.Model):
+    """Verified reports in one cell of the map clustering pyramid, per category (see reports.clusters)"""
+    zoom = models.PositiveSmallIntegerField()
+    x = models.IntegerField()
+    y = models.IntegerField()
+    category = models.CharField(max_length=20, choices=IncidentReport.CATEGORY_CHOICES)
+    count = models.IntegerField(default=0)
+    low = models.IntegerField(default=0)
+    moderate = models.IntegerField(default=0)
+    high = models.IntegerField(default=0)
+    # Coordinate sums; the cluster's centroid is sum / count
+    lat_sum = models.FloatField(default=0)
+    lon_sum = models.FloatField(default=0)
+    # The same sums per severity, for the centroids of severity-filtered clusters
+    low_lat_sum = models.FloatField(default=0)
+    low_lon_sum = models.FloatField(default=0)
+    moderate_lat_sum = models.FloatField(default=0)
+    moderate_lon_sum = models.FloatField(default=0)
+    high_lat_sum = models.FloatField(default=0)
+    high_lon_sum = models.FloatField(default=0)
+    
+    class Meta:
+        # Also the index for viewport range scans on (zoom, x, y)
+        unique_together = ['zoom', 'x', 'y', 'category']
+    
+    def __str__(self):
+        return f"{self.zoom}/{self.x}/{self.y} {self.category}: {self.count}"
+
+
+class IncidentRollup(models.Model):
+    """Verified reports per incident hour or day, geohash cell, category and severity (see reports.rollups)"""
+    PERIOD_CHOICES = [
+        ('hour', 'Hour'),
+        ('day', 'Day'),
+    ]
+    
+    period = models.CharField(max_length=4, choices=PERIOD_CHOICES)
+    # Start of the hour (or local day) the incidents happened in
+    bucket = models.DateTimeField()
+    cell = models.CharField(max_length=12)
+    category = models.CharField(max_length=20, choices=IncidentReport.CATEGORY_CHOICES)
+    severity = models.CharField(max_length=10, choices=IncidentReport.SEVERITY_CHOICES)
+    count = models.IntegerField(default=0)
+    
+    class Meta:
+        # Also the index for area queries: cell ranges, then the time range
+        unique_together = ['period', 'cell', 'bucket', 'category', 'severity']
+        indexes = [
+            # Queries without an area: the time range alone
+            models.Index(fields=['period', 'bucket'], name='rollup_period_bucket_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.period} {self.bucket:%Y-%m-%d %H:%M} {self.cell} {self.category}/{self.severity}: {self.count}"
 
 
 class IncidentImage(models.Model):
@@ -71,8 +328,88 @@ class IncidentImage(models.Model):
     description = models.TextField(blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     
+    # WebP derivatives generated in the background by reports.imaging
+    PROCESSING_CHOICES = [
+        ('pending', 'Pending'),
+        ('ready', 'Ready'),
+        ('failed', 'Failed'),
+    ]
+    thumbnail_small = models.ImageField(
+        upload_to='incident_images/derivatives/', blank=True, editable=False,
+        storage=MediaCloudinaryStorage() if CLOUDINARY_STORAGE_AVAILABLE else None
+    )
+    thumbnail_medium = models.ImageField(
+        upload_to='incident_images/derivatives/', blank=True, editable=False,
+        storage=MediaCloudinaryStorage() if CLOUDINARY_STORAGE_AVAILABLE else None
+    )
+    thumbnail_large = models.ImageField(
+        upload_to='incident_images/derivatives/', blank=True, editable=False,
+        storage=MediaCloudinaryStorage() if CLOUDINARY_STORAGE_AVAILABLE else None
+    )
+    blurred_image = models.ImageField(
+        upload_to='incident_images/derivatives/', blank=True, editable=False,
+        storage=MediaCloudinaryStorage() if CLOUDINARY_STORAGE_AVAILABLE else None
+    )
+    processing_status = models.CharField(max_length=10, choices=PROCESSING_CHOICES, default='pending', editable=False)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['report', 'image_type'], name='image_report_type_idx'),
+            # Gallery keyset pages: newest first, all images or one type
+            models.Index(fields=['-created_at', '-id'], name='image_recent_idx'),
+            models.Index(fields=['image_type', '-created_at', '-id'], name='image_type_recent_idx'),
+        ]
+    
     def __str__(self):
         return f"{self.get_image_type_display()} - {self.report.title}"
+    
+    def url_for(self, size):
+        """URL of the smallest derivative at least `size` ('small', 'medium', 'large'), or the original"""
+        sizes = ['small', 'medium', 'large']
+        for name in sizes[sizes.index(size):]:
+            derivative = getattr(self, f'thumbnail_{name}')
+            if derivative:
+                return derivative.url
+        return self.image.url if self.image else ''
+    
+    @property
+    def small_url(self):
+        return self.url_for('small')
+    
+    @property
+    def medium_url(self):
+        return self.url_for('medium')
+    
+    @property
+    def large_url(self):
+        return self.url_for('large')
+    
+    @property
+    def blurred_url(self):
+        """Server-side blurred variant, or '' until it has been generated"""
+        return self.blurred_image.url if self.blurred_image else ''
+
+
+class ImageHash(models.Model):
+    """64-bit perceptual hash of an IncidentImage, split into 16-bit chunks for Hamming lookups (see reports.perceptual)"""
+    image = models.OneToOneField(IncidentImage, on_delete=models.CASCADE, primary_key=True, related_name='perceptual_hash')
+    value = models.BigIntegerField()
+    chunk_0 = models.IntegerField()
+    chunk_1 = models.IntegerField()
+    chunk_2 = models.IntegerField()
+    chunk_3 = models.IntegerField()
+    
+    class Meta:
+        # Each chunk index also holds the full hash and image, so candidates are checked from the index alone
+        indexes = [
+            models.Index(fields=['chunk_0', 'value', 'image'], name='image_hash_chunk_0_idx'),
+            models.Index(fields=['chunk_1', 'value', 'image'], name='image_hash_chunk_1_idx'),
+            models.Index(fields=['chunk_2', 'value', 'image'], name='image_hash_chunk_2_idx'),
+            models.Index(fields=['chunk_3', 'value', 'image'], name='image_hash_chunk_3_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.value & 0xffffffffffffffff:016x} (image {self.image_id})"
 
 
 class IncidentVideo(models.Model):
@@ -97,6 +434,45 @@ class IncidentAudio(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
 
 
+class UploadSession(models.Model):
+    """A resumable, chunked upload of a video or audio file (see reports.uploads)"""
+    KIND_CHOICES = [
+        ('video', 'Video'),
+        ('audio', 'Audio'),
+    ]
+    STATUS_CHOICES = [
+        ('uploading', 'Uploading'),
+        ('assembling', 'Assembling'),
+        ('complete', 'Complete'),
+        ('failed', 'Failed'),
+    ]
+    
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    filename = models.CharField(max_length=255)
+    content_type = models.CharField(max_length=100, blank=True)
+    total_size = models.BigIntegerField()
+    chunk_size = models.PositiveIntegerField()
+    received_bytes = models.BigIntegerField(default=0)
+    checksum = models.CharField(max_length=64, blank=True, help_text='Optional SHA-256 of the whole file')
+    status = models.CharField(max_length=12, choices=STATUS_CHOICES, default='uploading')
+    report = models.ForeignKey(IncidentReport, null=True, blank=True, on_delete=models.CASCADE)
+    description = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        ordering = ['-created_at']
+    
+    def __str__(self):
+        return f"{self.get_kind_display()} upload {self.filename} ({self.received_bytes}/{self.total_size})"
+    
+    @property
+    def is_received(self):
+        return self.received_bytes >= self.total_size
+
+
 class SavedZone(models.Model):
     """User-saved risk zones"""
     user = models.ForeignKey(User, on_delete=models.CASCADE)
@@ -113,6 +489,40 @@ class SavedZone(models.Model):
         return f"{self.name} - {self.user.username}"
 
 
+class ZoneCell(models.Model):
+    """Geohash cell overlapped by a saved zone; the spatial index used to match reports to zones"""
+    zone = models.ForeignKey(SavedZone, on_delete=models.CASCADE, related_name='cells')
+    cell = models.CharField(max_length=12, db_index=True)
+    
+    class Meta:
+        unique_together = ['zone', 'cell']
+    
+    def __str__(self):
+        return f"{self.cell} -> {self.zone_id}"
+
+
+class ZoneAlert(models.Model):
+    """A verified report that falls inside one of a user's saved zones"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='zone_alerts')
+    zone = models.ForeignKey(SavedZone, on_delete=models.CASCADE, related_name='alerts')
+    report = models.ForeignKey(IncidentReport, on_delete=models.CASCADE, related_name='zone_alerts')
+    distance_km = models.FloatField()
+    # Copy of report.created_at, so a user's feed is one index range scan
+    reported_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        # One alert per user and report, for the nearest matching zone
+        unique_together = ['user', 'report']
+        indexes = [
+            # Dashboard feed: keyset pages on (reported_at, report) per user
+            models.Index(fields=['user', '-reported_at', '-report'], name='zonealert_user_feed_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.report_id} in {self.zone_id} for {self.user_id}"
+
+
 class HelpfulReport(models.Model):
     """Users marking reports as helpful"""
     user = models.ForeignKey(User, on_delete=models.CASCADE)
@@ -145,6 +555,11 @@ class CommunityDiscussion(models.Model):
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Community keyset pages: newest first, all discussions or one category
+            models.Index(fields=['-created_at', '-id'], name='discussion_recent_idx'),
+            models.Index(fields=['category', '-created_at', '-id'], name='discussion_cat_recent_idx'),
+        ]
     
     def __str__(self):
         return self.title
@@ -160,7 +575,69 @@ class DiscussionReply(models.Model):
     
     class Meta:
         ordering = ['created_at']
+        indexes = [
+            models.Index(fields=['discussion', 'created_at'], name='reply_discussion_recent_idx'),
+        ]
     
     def __str__(self):
         return f"Reply to {self.discussion.title} by {self.user.username}"
 
+
+class SearchDocument(models.Model):
+    """Searchable text of a report, discussion or reply (see reports.search)"""
+    KIND_CHOICES = [
+        ('report', 'Incident Report'),
+        ('discussion', 'Discussion'),
+        ('reply', 'Discussion Reply'),
+    ]
+    
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    object_id = models.PositiveIntegerField()
+    # The discussion a reply belongs to
+    parent_id = models.PositiveIntegerField(null=True, blank=True)
+    title = models.CharField(max_length=200, blank=True)
+    body = models.TextField(blank=True)
+    category = models.CharField(max_length=30, blank=True)
+    # Unverified reports are only searchable from the admin
+    is_public = models.BooleanField(default=True)
+    created_at = models.DateTimeField()
+    
+    class Meta:
+        unique_together = ['kind', 'object_id']
+    
+    def __str__(self):
+        return f"{self.get_kind_display()} #{self.object_id}"
+
+
+class Job(models.Model):
+    """A unit of background work in the database-backed queue (see reports.jobs)"""
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+    
+    name = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict, blank=True)
+    # Enqueueing a job with a key that already exists returns the existing job
+    idempotency_key = models.CharField(max_length=200, unique=True, null=True, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    run_at = models.DateTimeField()
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            # Workers poll for due pending jobs, oldest first
+            models.Index(fields=['status', 'run_at'], name='job_status_run_at_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.name} #{self.pk} ({self.status})"
@@ -0,0 +1,156 @@
+"""
+The moderation queue for submitted reports.
+
+Pending reports (neither verified nor rejected) are reviewed in order of
+IncidentReport.moderation_priority, highest first. The priority adds up:
+
+- the report's severity (SEVERITY_POINTS)
+- VERIFIED_REPORTER_POINTS if the reporter's identity is verified
+- log(1 + helpful votes)
+- log(1 + verified reports in the surrounding cluster cell at
+  DENSITY_ZOOM), so reports from areas with corroborating incidents
+  come first
+
+It is computed when a report is submitted, when its reporter is
+(un)verified and when a verified report is sent back to the queue. Votes and nearby verifications keep changing it afterwards,
+so refresh_moderation_queue recomputes every pending report.
+
+The queue is paged by keyset on (priority, id) through a partial index
+over pending reports. Decisions are applied in batches of BATCH_SIZE,
+each in its own transaction and as a single tracked UPDATE. Each batch
+therefore refreshes the derived data (stats, rollups, clusters, heatmap
+tiles, zone alerts, search visibility and the incident caches) in one
+pass.
+"""
+import math
+
+from django.db import transaction
+from django.db.models import Q, Sum
+
+from . import clusters
+from .models import ClusterCell, IncidentReport
+
+SEVERITY_POINTS = {'low': 1.0, 'moderate': 2.0, 'high': 3.0}
+
+VERIFIED_REPORTER_POINTS = 1.5
+
+# Pyramid level whose cells measure nearby density (cells of about 600m)
+DENSITY_ZOOM = 14
+
+QUEUE_PAGE_SIZE = 50
+QUEUE_PAGE_SIZE_MAX = 500
+
+# Reports decided per transaction
+BATCH_SIZE = 200
+
+PRIORITY_FIELDS = ('id', 'severity', 'helpful_count', 'latitude', 'longitude', 'user__is_verified')
+
+
+def pending():
+    """Reports awaiting a decision"""
+    return IncidentReport.objects.filter(is_verified=False, is_rejected=False)
+
+
+def priorities(rows, cluster_model=ClusterCell):
+    """Return {report id: priority} for rows with the PRIORITY_FIELDS"""
+    rows = list(rows)
+    cells = {row['id']: clusters.cell_of(row['latitude'], row['longitude'], DENSITY_ZOOM) for row in rows}
+    densities = {}
+    if cells:
+        xs = {x for x, _ in cells.values()}
+        ys = {y for _, y in cells.values()}
+        # x__in/y__in is a superset of the wanted cells; only those are looked up below
+        for row in (cluster_model.objects.filter(zoom=DENSITY_ZOOM, x__in=xs, y__in=ys)
+                    .order_by().values('x', 'y').annotate(total=Sum('count'))):
+            densities[(row['x'], row['y'])] = row['total']
+    return {
+        row['id']: round(
+            SEVERITY_POINTS.get(row['severity'], 0.0)
+            + (VERIFIED_REPORTER_POINTS if row['user__is_verified'] else 0.0)
+            + math.log1p(max(row['helpful_count'], 0))
+            + math.log1p(densities.get(cells[row['id']], 0)),
+            4,
+        )
+        for row in rows
+    }
+
+
+def refresh(reports=None):
+    """Recompute the priority of pending reports (all of them by default); returns the number updated"""
+    reports = pending() if reports is None else reports.filter(is_verified=False, is_rejected=False)
+    updated = 0
+    batch = []
+    for row in reports.order_by().values(*PRIORITY_FIELDS).iterator(chunk_size=BATCH_SIZE):
+        batch.append(row)
+        if len(batch) >= BATCH_SIZE:
+            updated += _store(batch)
+            batch = []
+    if batch:
+        updated += _store(batch)
+    return updated
+
+
+def _store(rows):
+    scores = priorities(rows)
+    IncidentReport.objects.untracked().bulk_update(
+        [IncidentReport(pk=pk, moderation_priority=score) for pk, score in scores.items()],
+        ['moderation_priority'],
+    )
+    return len(scores)
+
+
+def encode_cursor(report):
+    return f'{report.moderation_priority!r}_{report.pk}'
+
+
+def decode_cursor(value):
+    """Return (priority, report id) from a cursor; raises ValueError if malformed"""
+    priority, report_id = value.rsplit('_', 1)
+    return float(priority), int(report_id)
+
+
+def page(cursor=None, size=QUEUE_PAGE_SIZE, category='', severity=''):
+    """Return (reports, next_cursor) for a page of the queue; next_cursor is None on the last page"""
+    reports = pending().select_related('user').order_by('-moderation_priority', '-id')
+    if category:
+        reports = reports.filter(category=category)
+    if severity:
+        reports = reports.filter(severity=severity)
+    if cursor:
+        priority, report_id = decode_cursor(cursor)
+        reports = reports.filter(
+            Q(moderation_priority__lt=priority) | Q(moderation_priority=priority, id__lt=report_id)
+        )
+    # One extra row tells whether there is a next page
+    reports = list(reports[:size + 1])
+    next_cursor = encode_cursor(reports[size - 1]) if len(reports) > size else None
+    return reports[:size], next_cursor
+
+
+def _decide(report_ids, reports, **fields):
+    report_ids = sorted(set(report_ids))
+    decided = 0
+    for start in range(0, len(report_ids), BATCH_SIZE):
+        with transaction.atomic():
+            decided += reports.filter(pk__in=report_ids[start:start + BATCH_SIZE]).update(**fields)
+    return decided
+
+
+def verify(report_ids):
+    """Verify reports in batches (overruling earlier rejections); returns the number changed"""
+    return _decide(report_ids, IncidentReport.objects.filter(is_verified=False), is_verified=True, is_rejected=False)
+
+
+def unverify(report_ids):
+    """Send verified reports back to the queue in batches, with fresh priorities; returns the number changed"""
+    report_ids = sorted(set(report_ids))
+    unverified = _decide(report_ids, IncidentReport.objects.filter(is_verified=True), is_verified=False)
+    # Their priorities date from submission; votes and nearby verifications have moved them since
+    for start in range(0, len(report_ids), BATCH_SIZE):
+        refresh(IncidentReport.objects.filter(pk__in=report_ids[start:start + BATCH_SIZE]))
+    return unverified
+
+
+def reject(report_ids):
+    """Reject reports in batches, taking verified ones off the public map; returns the number changed"""
+    return _decide(report_ids, IncidentReport.objects.filter(is_rejected=False), is_verified=False, is_rejected=True)
@@ -0,0 +1,108 @@
+"""
+Compact binary encoding of incident points for the map.
+
+Drawing points only needs a position and a severity/category, so instead
+of one JSON object per incident the points endpoint sends columns of
+typed arrays that the browser reads with a DataView:
+
+    offset  type              content
+    0       4 bytes           magic b'SRP1'
+    4       uint32            point count n
+    8       uint32            coordinate scale (units per degree)
+    12      uint32            legend length L (padded to 4 bytes)
+    16      L bytes           JSON legend {"categories": [...], "severities": [...]}
+    16+L    int32[n]          report id deltas
+            int32[n]          latitude deltas, in 1/scale degree units
+            int32[n]          longitude deltas, in 1/scale degree units
+            uint8[n]          code: severity index | category index << 2
+
+All integers are little-endian. Each delta column holds the difference to
+the previous point (the first point against 0). Points are sent in
+geohash order, so neighbours are close and the deltas are small numbers
+with repetitive high bytes, which gzip and brotli compress well.
+Everything else about an incident is fetched per id when it is clicked.
+"""
+import json
+import struct
+
+from array import array
+
+from .models import IncidentReport
+
+MAGIC = b'SRP1'
+
+# 1e-5 degrees is about 1.1m
+COORDINATE_SCALE = 100000
+
+CATEGORIES = [category for category, _ in IncidentReport.CATEGORY_CHOICES]
+SEVERITIES = [severity for severity, _ in IncidentReport.SEVERITY_CHOICES]
+
+# Fields a queryset must provide, in order
+POINT_FIELDS = ('id', 'latitude', 'longitude', 'severity', 'category')
+
+
+def _deltas(values):
+    column = array('i')
+    previous = 0
+    for value in values:
+        column.append(value - previous)
+        previous = value
+    return column
+
+
+def _little_endian(column):
+    if struct.pack('=i', 1) != struct.pack('<i', 1):
+        column.byteswap()
+    return column.tobytes()
+
+
+def encode(rows):
+    """Encode (id, latitude, longitude, severity, category) rows, already in send order"""
+    ids, lats, lons, codes = [], [], [], bytearray()
+    for report_id, latitude, longitude, severity, category in rows:
+        ids.append(report_id)
+        lats.append(int(round(float(latitude) * COORDINATE_SCALE)))
+        lons.append(int(round(float(longitude) * COORDINATE_SCALE)))
+        severity_code = SEVERITIES.index(severity) if severity in SEVERITIES else 0
+        category_code = CATEGORIES.index(category) if category in CATEGORIES else len(CATEGORIES)
+        codes.append(severity_code | category_code << 2)
+
+    legend = json.dumps({'categories': CATEGORIES, 'severities': SEVERITIES}).encode('utf-8')
+    legend += b' ' * (-len(legend) % 4)
+    return b''.join([
+        MAGIC,
+        struct.pack('<III', len(ids), COORDINATE_SCALE, len(legend)),
+        legend,
+        _little_endian(_deltas(ids)),
+        _little_endian(_deltas(lats)),
+        _little_endian(_deltas(lons)),
+        bytes(codes),
+    ])
+
+
+def decode(payload):
+    """Decode a payload back into (id, latitude, longitude, severity, category) tuples"""
+    if payload[:4] != MAGIC:
+        raise ValueError('Not an incident points payload')
+    count, scale, legend_length = struct.unpack_from('<III', payload, 4)
+    legend = json.loads(payload[16:16 + legend_length])
+    offset = 16 + legend_length
+    columns = []
+    for _ in range(3):
+        column = array('i', payload[offset:offset + 4 * count])
+        if struct.pack('=i', 1) != struct.pack('<i', 1):
+            column.byteswap()
+        total = 0
+        values = []
+        for delta in column:
+            total += delta
+            values.append(total)
+        columns.append(values)
+        offset += 4 * count
+    codes = payload[offset:offset + count]
+    categories = legend['categories']
+    return [
+        (report_id, lat / scale, lon / scale, legend['severities'][code & 3],
+         categories[code >> 2] if code >> 2 < len(categories) else None)
+        for report_id, lat, lon, code in zip(*columns, codes)
+    ]
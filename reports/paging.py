@@ -0,0 +1,83 @@
+"""
+Keyset pagination for newest-first listings (gallery, community).
+
+Paginator counts the whole listing on every request and reads page n with
+OFFSET, so both get slower as the table grows and as the reader goes
+deeper. A keyset page is instead the next rows after a cursor in
+(created_at, id) order:
+
+    WHERE created_at <= :created_at AND NOT (created_at = :created_at AND id >= :id)
+    ORDER BY created_at DESC, id DESC LIMIT size + 1
+
+which is one range scan of a (-created_at, -id) index however deep the
+page is. The extra row tells whether there is a next page. Cursors are
+opaque '<microseconds since the epoch>-<id>' tokens of the last row, like
+the dashboard feed's.
+
+There are no page numbers. Listings show estimated_total() instead, a
+count cached in the 'page_totals' namespace. That namespace is not
+invalidated on changes, so the total may lag by up to its TTL.
+"""
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from . import cache as reports_cache
+
+PAGE_SIZE = 12
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+
+class KeysetPage:
+    """One page of a listing; next_cursor is None on the last page"""
+
+    def __init__(self, object_list, next_cursor=None, cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.cursor = cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def is_first(self):
+        return not self.cursor
+
+
+def encode_cursor(obj):
+    """Opaque cursor pointing just past obj"""
+    delta = obj.created_at - _EPOCH
+    microseconds = (delta.days * 86400 + delta.seconds) * 10 ** 6 + delta.microseconds
+    return f'{microseconds}-{obj.pk}'
+
+
+def decode_cursor(value):
+    """Return (created_at, id) from a cursor; raises ValueError if malformed"""
+    microseconds, pk = value.split('-', 1)
+    try:
+        return _EPOCH + timedelta(microseconds=int(microseconds)), int(pk)
+    except OverflowError:
+        raise ValueError(f'{value!r} is out of range')
+
+
+def page(queryset, cursor=None, size=PAGE_SIZE):
+    """Return the KeysetPage of queryset after cursor (the first page if cursor is empty)"""
+    queryset = queryset.order_by('-created_at', '-id')
+    if cursor:
+        created_at, pk = decode_cursor(cursor)
+        queryset = queryset.filter(created_at__lte=created_at).exclude(created_at=created_at, id__gte=pk)
+    # One extra row tells whether there is a next page
+    rows = list(queryset[:size + 1])
+    next_cursor = encode_cursor(rows[size - 1]) if len(rows) > size else None
+    return KeysetPage(rows[:size], next_cursor, cursor)
+
+
+def estimated_total(queryset, *parts):
+    """Number of rows in a listing, counted at most once per 'page_totals' TTL for the given key parts"""
+    return reports_cache.get_or_set('page_totals', parts, queryset.count)
@@ -0,0 +1,180 @@
+"""
+Perceptual hashes for finding the same photo across reports.
+
+Each IncidentImage gets a 64-bit difference hash (dHash): the image is
+shrunk to 9x8 grey pixels and every bit records whether a pixel is brighter
+than its right-hand neighbour. Resizing, re-encoding, small crops and
+brightness changes flip only a few bits, so copies of a photo are within a
+small Hamming distance of each other (at most SIMILAR_DISTANCE counts as
+similar).
+
+Hashes are stored in ImageHash split into CHUNKS chunks of 16 bits, each
+with its own index (multi-index hashing). Two hashes at most
+SIMILAR_DISTANCE apart differ by at most SIMILAR_DISTANCE // CHUNKS bits in
+at least one chunk, so a lookup enumerates the chunk values within that
+radius (137 per chunk), reads the matching index entries and checks the full
+distance of those few candidates only. With a million uniformly spread
+hashes that is about 15 rows per chunk value.
+
+Hashes are computed by the process_image job alongside the thumbnails;
+`manage.py hash_images` catches up older images.
+"""
+import logging
+from itertools import combinations
+
+from django.db.models import Q
+
+logger = logging.getLogger(__name__)
+
+HASH_BITS = 64
+CHUNKS = 4
+CHUNK_BITS = HASH_BITS // CHUNKS
+
+# Largest Hamming distance between two hashes of the same photo
+SIMILAR_DISTANCE = 10
+
+# Bits a candidate may differ by in its closest chunk
+CHUNK_RADIUS = SIMILAR_DISTANCE // CHUNKS
+
+SIMILAR_LIMIT = 12
+
+_CHUNK_MASK = (1 << CHUNK_BITS) - 1
+# Masks of every flip of up to CHUNK_RADIUS bits within a chunk
+_FLIPS = [
+    sum(1 << bit for bit in bits)
+    for radius in range(CHUNK_RADIUS + 1)
+    for bits in combinations(range(CHUNK_BITS), radius)
+]
+
+
+def dhash(source):
+    """64-bit difference hash of a PIL image"""
+    from PIL import Image, ImageOps
+
+    grey = ImageOps.exif_transpose(source).convert('L').resize((9, 8), Image.Resampling.LANCZOS)
+    pixels = list(grey.getdata())
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            value = (value << 1) | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    return value
+
+
+def to_signed(value):
+    return value - (1 << HASH_BITS) if value >= 1 << (HASH_BITS - 1) else value
+
+
+def to_unsigned(value):
+    return value & ((1 << HASH_BITS) - 1)
+
+
+def chunks(value):
+    """The CHUNKS 16-bit chunks of an unsigned hash, lowest first"""
+    return [(value >> (CHUNK_BITS * index)) & _CHUNK_MASK for index in range(CHUNKS)]
+
+
+def distance(first, second):
+    return bin(to_unsigned(first) ^ to_unsigned(second)).count('1')
+
+
+def store(image_id, value):
+    """Save an image's unsigned hash"""
+    from .models import ImageHash
+
+    parts = chunks(value)
+    ImageHash.objects.update_or_create(
+        image_id=image_id,
+        defaults=dict(value=to_signed(value), **{f'chunk_{index}': part for index, part in enumerate(parts)}),
+    )
+
+
+def hash_image(image_id):
+    """
+    Compute and store the hash of one IncidentImage from its smallest available file.
+
+    Returns True on success, False on failure and None if the image is gone.
+    """
+    from PIL import Image
+
+    from .models import IncidentImage
+
+    image = IncidentImage.objects.filter(pk=image_id).first()
+    if image is None or not image.image:
+        return None
+    # The small thumbnail is a fraction of the download and hashes the same
+    source_file = image.thumbnail_small or image.image
+    try:
+        with source_file.open('rb') as data:
+            with Image.open(data) as source:
+                value = dhash(source)
+    except Exception:
+        logger.exception('Could not hash image %s', image_id)
+        return False
+    store(image_id, value)
+    return True
+
+
+def similar(values, max_distance=SIMILAR_DISTANCE):
+    """
+    Return [(image id, distance), ...] of stored hashes within max_distance of any of the unsigned hashes, closest first.
+
+    max_distance may be at most SIMILAR_DISTANCE.
+    """
+    from .models import ImageHash
+
+    if max_distance > SIMILAR_DISTANCE:
+        raise ValueError(f'max_distance must be at most {SIMILAR_DISTANCE}')
+    values = [value for value in values if value]
+    if not values:
+        return []
+    lookup = Q()
+    for index in range(CHUNKS):
+        parts = {chunks(value)[index] for value in values}
+        lookup |= Q(**{f'chunk_{index}__in': sorted({part ^ flip for part in parts for flip in _FLIPS})})
+    # Flat images (blank or a single colour) all hash to 0 and match nothing
+    candidates = ImageHash.objects.filter(lookup).exclude(value=0).values_list('image_id', 'value')
+    found = []
+    for image_id, other in candidates.iterator(chunk_size=2000):
+        gap = min(distance(value, other) for value in values)
+        if gap <= max_distance:
+            found.append((image_id, gap))
+    found.sort(key=lambda match: (match[1], match[0]))
+    return found
+
+
+def _images(matches, images, exclude_report, limit):
+    # Matches are few, so the visibility filter is applied to them rather than to the lookup
+    found = images.exclude(report_id=exclude_report).select_related('report').in_bulk([image_id for image_id, _ in matches])
+    result = []
+    for image_id, gap in matches:
+        if image_id in found:
+            found[image_id].distance = gap
+            result.append(found[image_id])
+    return result[:limit]
+
+
+def similar_images(image, images=None, limit=SIMILAR_LIMIT):
+    """
+    IncidentImages of other reports that look like `image`, closest first.
+
+    `images` restricts the result (e.g. to public images). Each image carries
+    a `distance` attribute. Returns [] until the image is hashed, and for
+    flat images.
+    """
+    from .models import ImageHash, IncidentImage
+
+    values = [to_unsigned(value) for value in ImageHash.objects.filter(image_id=image.pk).values_list('value', flat=True)]
+    images = IncidentImage.objects.all() if images is None else images
+    return _images(similar(values), images, image.report_id, limit)
+
+
+def similar_to_report(report, images=None, limit=SIMILAR_LIMIT):
+    """IncidentImages of other reports that look like any image of a report, closest first (see similar_images)"""
+    from .models import ImageHash, IncidentImage
+
+    values = [
+        to_unsigned(value)
+        for value in ImageHash.objects.filter(image__report_id=report.pk).values_list('value', flat=True)
+    ]
+    images = IncidentImage.objects.all() if images is None else images
+    return _images(similar(values), images, report.pk, limit)
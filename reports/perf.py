@@ -0,0 +1,185 @@
+"""
+Opt-in per-request performance instrumentation.
+
+PerfMiddleware records, for every request, the number of SQL queries and
+the time spent in the database, the time spent rendering templates, and
+the hits and misses of the reports cache layer. The numbers are sent back
+in a Server-Timing header, which browser dev tools show next to the
+request, and added to a rolling in-process window of samples per URL name,
+summarised at /admin/perf/ for staff.
+
+Enable it with SAFEROUTE_PERF=1 in the environment. The window lives in
+process memory, so with several workers each one keeps its own.
+
+Template time includes any queries run while rendering (lazy querysets
+evaluated by the template), so db and tpl can overlap.
+"""
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+# Samples kept per URL name
+DEFAULT_WINDOW = 500
+
+# Upper bounds (ms) of the latency histogram buckets; the last one is open
+HISTOGRAM_BUCKETS = (10, 25, 50, 100, 250, 500, 1000, 2500)
+
+_local = threading.local()
+_samples = defaultdict(lambda: deque(maxlen=getattr(settings, 'SAFEROUTE_PERF_WINDOW', DEFAULT_WINDOW)))
+_samples_lock = threading.Lock()
+
+
+class RequestMetrics:
+    """Counters for the request being handled on this thread"""
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.template_time = 0.0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.rendering = False
+
+    def server_timing(self, total):
+        """Server-Timing header value (durations in ms)"""
+        return ', '.join([
+            f'db;dur={self.db_time * 1000:.1f};desc="{self.queries} queries"',
+            f'tpl;dur={self.template_time * 1000:.1f}',
+            f'cache;desc="{self.cache_hits} hits, {self.cache_misses} misses"',
+            f'total;dur={total * 1000:.1f}',
+        ])
+
+
+def current():
+    """Return the metrics of the request being handled, or None outside PerfMiddleware"""
+    return getattr(_local, 'metrics', None)
+
+
+def record_cache(hit):
+    """Count a reports cache lookup for the current request"""
+    metrics = current()
+    if metrics is not None:
+        if hit:
+            metrics.cache_hits += 1
+        else:
+            metrics.cache_misses += 1
+
+
+def _time_query(execute, sql, params, many, context):
+    metrics = current()
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        if metrics is not None:
+            metrics.queries += 1
+            metrics.db_time += time.perf_counter() - start
+
+
+def _instrument_templates():
+    """Wrap the Django template backend's render() to time top-level renders"""
+    from django.template.backends.django import Template
+
+    if getattr(Template.render, 'perf_timed', False):
+        return
+    original = Template.render
+
+    def render(self, context=None, request=None):
+        metrics = current()
+        if metrics is None or metrics.rendering:
+            return original(self, context, request)
+        metrics.rendering = True
+        start = time.perf_counter()
+        try:
+            return original(self, context, request)
+        finally:
+            metrics.template_time += time.perf_counter() - start
+            metrics.rendering = False
+
+    render.perf_timed = True
+    Template.render = render
+
+
+def record_sample(name, total, metrics):
+    with _samples_lock:
+        _samples[name].append((
+            total * 1000, metrics.queries, metrics.db_time * 1000, metrics.template_time * 1000,
+            metrics.cache_hits, metrics.cache_misses,
+        ))
+
+
+def reset():
+    """Forget every recorded sample"""
+    with _samples_lock:
+        _samples.clear()
+
+
+def _percentile(ordered, pct):
+    return ordered[max(0, -(-pct * len(ordered) // 100) - 1)]
+
+
+def summary():
+    """Per-URL-name statistics over the current window, slowest p95 first"""
+    with _samples_lock:
+        snapshot = {name: list(samples) for name, samples in _samples.items()}
+    rows = []
+    for name, samples in snapshot.items():
+        totals = sorted(sample[0] for sample in samples)
+        count = len(samples)
+        hits = sum(sample[4] for sample in samples)
+        lookups = hits + sum(sample[5] for sample in samples)
+        histogram = [0] * (len(HISTOGRAM_BUCKETS) + 1)
+        for total in totals:
+            histogram[next((i for i, bound in enumerate(HISTOGRAM_BUCKETS) if total <= bound), -1)] += 1
+        rows.append({
+            'name': name,
+            'count': count,
+            'p50': _percentile(totals, 50),
+            'p95': _percentile(totals, 95),
+            'p99': _percentile(totals, 99),
+            'queries_avg': sum(sample[1] for sample in samples) / count,
+            'queries_max': max(sample[1] for sample in samples),
+            'db_avg': sum(sample[2] for sample in samples) / count,
+            'template_avg': sum(sample[3] for sample in samples) / count,
+            'cache_hit_ratio': hits / lookups if lookups else None,
+            'histogram': histogram,
+        })
+    rows.sort(key=lambda row: row['p95'], reverse=True)
+    return rows
+
+
+def histogram_labels():
+    """Column labels matching summary()['histogram']"""
+    return [f'≤{bound}' for bound in HISTOGRAM_BUCKETS] + [f'>{HISTOGRAM_BUCKETS[-1]}']
+
+
+class PerfMiddleware:
+    """Measure queries, DB time, template time and cache hits per request"""
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'SAFEROUTE_PERF', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        _instrument_templates()
+
+    def __call__(self, request):
+        metrics = _local.metrics = RequestMetrics()
+        start = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(_time_query))
+                response = self.get_response(request)
+        finally:
+            _local.metrics = None
+        total = time.perf_counter() - start
+
+        response['Server-Timing'] = metrics.server_timing(total)
+        match = request.resolver_match
+        record_sample(match.view_name if match else '<unresolved>', total, metrics)
+        return response
@@ -0,0 +1,441 @@
+"""
+Risk raster used for route safety scoring.
+
+Verified reports are rasterized into a float32 grid of CELL_METERS cells
+per category. Each report adds its severity weight, spread over a 3x3 cell
+kernel, scaled by an exponential time decay with a half-life of
+HALF_LIFE_DAYS from its incident date.
+
+The grid is global but sparse: it is split into BLOCK_SIZE x BLOCK_SIZE
+cell blocks and only blocks near reports are stored, so cells stay small
+however far apart the reported areas are.
+
+Decay is applied without rewriting the grid: a report is stored with
+weight * 2^((incident_date - reference) / half-life), where reference is
+the grid's build time, and readers multiply by
+2^(-(now - reference) / half-life). Adding or removing a report is then a
+plain in-place add, which the verified-set change signal does after
+commit. A rebuild (rebuild_risk_grid, or a job enqueued when a report lands
+in a block the grid does not have) starts again from a fresh reference.
+
+The grid is stored in one binary file (SAFEROUTE_RISK_GRID_PATH): a short
+JSON header listing the blocks, followed by the raw block array. Every
+worker memory-maps it, so scoring a route only reads the pages it touches
+and incremental writes by any process are seen by all of them. A rebuild
+writes a new file and atomically replaces the old one; readers notice and
+re-map. Changes committed before the rebuild read the reports are already
+in the new file, so their pending in-place updates are skipped.
+"""
+import itertools
+import json
+import math
+import os
+import struct
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: only threads in one process are serialised
+    fcntl = None
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from . import jobs, tiles
+from .models import IncidentReport
+
+MAGIC = b'SRRISK1\n'
+
+# Cell edge (north-south; cells are square in degrees)
+CELL_METERS = 200
+METERS_PER_DEGREE = 111320.0
+CELL_DEGREES = CELL_METERS / METERS_PER_DEGREE
+
+# Cells per block side (3.2km); a block of 7 categories is 7KB
+BLOCK_SIZE = 16
+
+HALF_LIFE_DAYS = 90
+
+# Spread of a report over the neighbouring cells
+KERNEL = ((0.25, 0.5, 0.25), (0.5, 1.0, 0.5), (0.25, 0.5, 0.25))
+
+# Route samples are taken every this fraction of a cell, up to MAX_SAMPLES per route
+SAMPLE_SPACING = 0.5
+MAX_SAMPLES = 200_000
+
+# Mean decayed risk per sampled cell above which a segment is moderate / high
+RISK_LEVELS = (0.5, 2.0)
+
+CATEGORIES = [category for category, _ in IncidentReport.CATEGORY_CHOICES]
+
+# Global cell columns, used to give every block a single integer key
+_COLUMNS = int(math.ceil(360.0 / CELL_DEGREES))
+_BLOCK_COLUMNS = _COLUMNS // BLOCK_SIZE + 1
+
+_lock = threading.Lock()
+_mapped = {'key': None, 'grid': None}
+
+
+class GridUnavailable(Exception):
+    """The risk grid has not been built (or numpy is not installed)"""
+
+
+def grid_path():
+    return getattr(settings, 'SAFEROUTE_RISK_GRID_PATH', os.path.join(settings.BASE_DIR, '.cache', 'risk_grid.bin'))
+
+
+@contextmanager
+def _file_lock():
+    """Serialise grid writers across threads and processes"""
+    with _lock:
+        if fcntl is None:
+            yield
+            return
+        os.makedirs(os.path.dirname(grid_path()) or '.', exist_ok=True)
+        with open(grid_path() + '.lock', 'w') as handle:
+            fcntl.flock(handle, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(handle, fcntl.LOCK_UN)
+
+
+def cells(latitudes, longitudes):
+    """Global (row, col) cell indices of coordinate arrays"""
+    rows = np.floor((np.asarray(latitudes, dtype=np.float64) + 90.0) / CELL_DEGREES).astype(np.int64)
+    cols = np.floor((np.asarray(longitudes, dtype=np.float64) + 180.0) / CELL_DEGREES).astype(np.int64) % _COLUMNS
+    return rows, cols
+
+
+def block_keys(rows, cols):
+    return (rows // BLOCK_SIZE) * _BLOCK_COLUMNS + cols // BLOCK_SIZE
+
+
+class RiskGrid:
+    """A memory-mapped risk raster"""
+
+    def __init__(self, header, data):
+        self.header = header
+        self.data = data  # float32 [block, category, row, col]
+        self.reference = header['reference']
+        self.categories = header['categories']
+        self.keys = np.asarray(header['blocks'], dtype=np.int64)  # sorted block keys
+
+    def decay_factor(self, now=None):
+        now = time.time() if now is None else now
+        return 2.0 ** (-(now - self.reference) / (HALF_LIFE_DAYS * 86400))
+
+    def slots(self, rows, cols):
+        """Block index of each cell, or -1 where the grid has no block"""
+        keys = block_keys(rows, cols)
+        found = np.searchsorted(self.keys, keys)
+        found[found >= len(self.keys)] = 0
+        return np.where((self.keys[found] == keys) if len(self.keys) else False, found, -1)
+
+    def values(self, rows, cols):
+        """[category, cell] stored values of cells (0 where there is no block)"""
+        slots = self.slots(rows, cols)
+        present = slots >= 0
+        values = np.zeros((len(self.categories), len(rows)), dtype=np.float64)
+        if present.any():
+            # Fancy indexing on the memmap only reads the touched pages
+            values[:, present] = self.data[
+                slots[present], :, rows[present] % BLOCK_SIZE, cols[present] % BLOCK_SIZE
+            ].T
+        return values
+
+
+def _report_arrays(rows, reference):
+    """Coordinates, category indexes and decayed weights of report rows"""
+    rows = [row for row in rows if row['category'] in CATEGORIES]
+    latitudes = np.array([float(row['latitude']) for row in rows], dtype=np.float64)
+    longitudes = np.array([float(row['longitude']) for row in rows], dtype=np.float64)
+    categories = np.array([CATEGORIES.index(row['category']) for row in rows], dtype=np.int64)
+    ages = np.array([row['incident_date'].timestamp() - reference for row in rows], dtype=np.float64)
+    severities = np.array([
+        tiles.SEVERITY_WEIGHTS.get(row['severity'], tiles.SEVERITY_WEIGHTS['low']) for row in rows
+    ], dtype=np.float64)
+    return latitudes, longitudes, categories, severities * 2.0 ** (ages / (HALF_LIFE_DAYS * 86400))
+
+
+def _footprint(latitudes, longitudes):
+    """Cells (rows, cols) and kernel weights covered by each report, as [report, 9] arrays"""
+    rows, cols = cells(latitudes, longitudes)
+    offsets = [(dr, dc, KERNEL[dr + 1][dc + 1]) for dr in (-1, 0, 1) for dc in (-1, 0, 1)]
+    all_rows = np.stack([rows + dr for dr, _, _ in offsets], axis=1)
+    all_cols = np.stack([(cols + dc) % _COLUMNS for _, dc, _ in offsets], axis=1)
+    kernel = np.array([weight for _, _, weight in offsets])
+    return all_rows, all_cols, kernel
+
+
+def _splat(grid, rows, sign=1):
+    """Add (or subtract) report rows into the grid; returns False if a report needs a missing block"""
+    latitudes, longitudes, categories, weights = _report_arrays(rows, grid.reference)
+    if not len(latitudes):
+        return True
+    cell_rows, cell_cols, kernel = _footprint(latitudes, longitudes)
+    slots = grid.slots(cell_rows.ravel(), cell_cols.ravel())
+    if (slots < 0).any():
+        return False
+    np.add.at(
+        grid.data,
+        (slots, np.repeat(categories, 9), cell_rows.ravel() % BLOCK_SIZE, cell_cols.ravel() % BLOCK_SIZE),
+        (sign * weights[:, None] * kernel[None, :]).ravel().astype(np.float32),
+    )
+    return True
+
+
+def _write(path, header, data):
+    """Write a grid file next to path and atomically move it into place"""
+    encoded = json.dumps(header).encode('utf-8')
+    # Pad so the array starts on a 64-byte boundary
+    offset = len(MAGIC) + 4 + len(encoded)
+    padding = (-offset) % 64
+    directory = os.path.dirname(path) or '.'
+    os.makedirs(directory, exist_ok=True)
+    handle, temp_path = tempfile.mkstemp(dir=directory, prefix='.risk_grid.')
+    try:
+        with os.fdopen(handle, 'wb') as out:
+            out.write(MAGIC)
+            out.write(struct.pack('<I', len(encoded) + padding))
+            out.write(encoded + b' ' * padding)
+            np.ascontiguousarray(data, dtype='<f4').tofile(out)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def _open(path, mode='r'):
+    """Memory-map a grid file"""
+    with open(path, 'rb') as handle:
+        if handle.read(len(MAGIC)) != MAGIC:
+            raise GridUnavailable(f'{path} is not a risk grid file')
+        (length,) = struct.unpack('<I', handle.read(4))
+        header = json.loads(handle.read(length))
+    shape = (len(header['blocks']), len(header['categories']), BLOCK_SIZE, BLOCK_SIZE)
+    if not header['blocks']:
+        return RiskGrid(header, np.zeros(shape, dtype=np.float32))
+    data = np.memmap(path, dtype='<f4', mode=mode, offset=len(MAGIC) + 4 + length, shape=shape)
+    return RiskGrid(header, data)
+
+
+def load():
+    """Return the current grid, re-mapping it if the file was rebuilt"""
+    if np is None:
+        raise GridUnavailable('numpy is not installed')
+    path = grid_path()
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        raise GridUnavailable('The risk grid has not been built yet')
+    # In-place updates are shared through the mapping; only a rebuild makes a new file
+    key = (stat.st_dev, stat.st_ino)
+    if _mapped['key'] != key:
+        _mapped['grid'] = _open(path)
+        _mapped['key'] = key
+    return _mapped['grid']
+
+
+def _rasterize(rows, reference, chunk_size=2000):
+    """Splat report rows chunk by chunk into {block key: [category, row, col] array}"""
+    blocks = {}
+    rows = iter(rows)
+    while True:
+        chunk = list(itertools.islice(rows, chunk_size))
+        if not chunk:
+            return blocks
+        latitudes, longitudes, _, _ = _report_arrays(chunk, reference)
+        cell_rows, cell_cols, _ = _footprint(latitudes, longitudes)
+        # A scratch grid of the blocks under this chunk's kernels, added into the running blocks
+        keys = np.unique(block_keys(cell_rows.ravel(), cell_cols.ravel()))
+        scratch = RiskGrid(
+            {'reference': reference, 'categories': CATEGORIES, 'blocks': keys.tolist()},
+            np.zeros((len(keys), len(CATEGORIES), BLOCK_SIZE, BLOCK_SIZE), dtype=np.float32),
+        )
+        _splat(scratch, chunk)
+        for key, block in zip(keys.tolist(), scratch.data):
+            if key in blocks:
+                blocks[key] += block
+            else:
+                blocks[key] = block
+
+
+def rebuild():
+    """
+    Rasterize every verified report into a new grid file; returns the grid.
+    
+    Reports are streamed from one query, so memory grows with the number of
+    blocks rather than reports. The build runs under the writer lock and the
+    header records when its query started (snapshot_at): changes committed
+    before then are in the new grid already, and _apply() skips them if
+    their callback only gets the lock after the swap.
+    """
+    if np is None:
+        raise GridUnavailable('numpy is not installed')
+    with _file_lock():
+        reference = time.time()
+        rows = (
+            IncidentReport.objects.counted().order_by()
+            .values('latitude', 'longitude', 'category', 'severity', 'incident_date')
+        )
+        snapshot_at = time.time()
+        blocks = _rasterize(rows.iterator(chunk_size=2000), reference)
+        keys = sorted(blocks)
+        header = {
+            'reference': reference,
+            'snapshot_at': snapshot_at,
+            'built_at': timezone.now().isoformat(),
+            'cell_meters': CELL_METERS,
+            'block_size': BLOCK_SIZE,
+            'categories': CATEGORIES,
+            'blocks': keys,
+        }
+        data = np.zeros((len(keys), len(CATEGORIES), BLOCK_SIZE, BLOCK_SIZE), dtype=np.float32)
+        for index, key in enumerate(keys):
+            data[index] = blocks.pop(key)
+        _write(grid_path(), header, data)
+    return load()
+
+
+def apply_changes(added, removed):
+    """Add/subtract verified report rows to the grid once the transaction commits"""
+    if np is None or not (added or removed):
+        return
+    # The callback runs just after the commit; its time orders the change against rebuild snapshots
+    transaction.on_commit(lambda: _apply(added, removed, time.time()))
+
+
+def _apply(added, removed, committed_at):
+    with _file_lock():
+        try:
+            grid = _open(grid_path(), mode='r+')
+        except FileNotFoundError:
+            return  # Nothing to update; the first rebuild will include these reports
+        if committed_at < grid.header.get('snapshot_at', 0):
+            return  # Committed before the grid's rebuild read the reports
+        complete = _splat(grid, removed, sign=-1) and _splat(grid, added)
+        if isinstance(grid.data, np.memmap):
+            grid.data.flush()
+    if not complete:
+        # A report landed where the grid has no block yet
+        jobs.enqueue('rebuild_risk_grid')
+
+
+@jobs.handler('rebuild_risk_grid')
+def rebuild_risk_grid():
+    rebuild()
+
+
+def ensure_built():
+    """Enqueue a rebuild if there is no grid file yet"""
+    if np is not None and not os.path.exists(grid_path()):
+        jobs.enqueue('rebuild_risk_grid')
+
+
+def _samples(points):
+    """Sample points along each segment; returns (lats, lons, segment index per sample)"""
+    lats, lons, owners = [], [], []
+    lengths = [segment_length(lat1, lon1, lat2, lon2) for (lat1, lon1), (lat2, lon2) in zip(points, points[1:])]
+    # Very long routes are sampled more sparsely to bound the work
+    spacing = max(CELL_METERS * SAMPLE_SPACING, sum(lengths) / MAX_SAMPLES)
+    for index, ((lat1, lon1), (lat2, lon2)) in enumerate(zip(points, points[1:])):
+        steps = max(1, int(math.ceil(lengths[index] / spacing)))
+        fractions = np.linspace(0.0, 1.0, steps + 1)
+        lats.append(lat1 + (lat2 - lat1) * fractions)
+        lons.append(lon1 + (lon2 - lon1) * fractions)
+        owners.append(np.full(steps + 1, index))
+    return np.concatenate(lats), np.concatenate(lons), np.concatenate(owners)
+
+
+def segment_length(lat1, lon1, lat2, lon2):
+    """Approximate segment length in meters (equirectangular, fine for route segments)"""
+    x = math.radians(lon2 - lon1) * math.cos(math.radians((lat1 + lat2) / 2))
+    y = math.radians(lat2 - lat1)
+    return math.hypot(x, y) * 6371008.8
+
+
+def level(value):
+    if value >= RISK_LEVELS[1]:
+        return 'high'
+    if value >= RISK_LEVELS[0]:
+        return 'moderate'
+    return 'low'
+
+
+def score_route(points, categories=None):
+    """
+    Score a polyline given as [(lat, lng), ...] against the current grid.
+
+    Returns one dict per segment with its length, mean and peak decayed risk
+    of the cells it crosses, the risk per category and a low/moderate/high
+    level. Cells with no reports nearby count as risk 0.
+    """
+    grid = load()
+    selected = [grid.categories.index(category) for category in (categories or grid.categories)
+                if category in grid.categories]
+    lats, lons, owners = _samples(points)
+    values = grid.values(*cells(lats, lons))[selected]
+    values *= grid.decay_factor()
+
+    counts = np.bincount(owners, minlength=len(points) - 1)
+    totals = values.sum(axis=0)
+    means = np.bincount(owners, weights=totals, minlength=len(points) - 1) / counts
+    peaks = np.zeros(len(points) - 1)
+    np.maximum.at(peaks, owners, totals)
+    by_category = [
+        np.bincount(owners, weights=values[i], minlength=len(points) - 1) / counts for i in range(len(selected))
+    ]
+
+    segments = []
+    for index, ((lat1, lon1), (lat2, lon2)) in enumerate(zip(points, points[1:])):
+        segments.append({
+            'from': [lat1, lon1],
+            'to': [lat2, lon2],
+            'length_m': round(segment_length(lat1, lon1, lat2, lon2), 1),
+            'risk': round(float(means[index]), 4),
+            'peak': round(float(peaks[index]), 4),
+            'level': level(means[index]),
+            'categories': {
+                grid.categories[category]: round(float(by_category[i][index]), 4)
+                for i, category in enumerate(selected)
+            },
+        })
+    return segments
+
+
+def decode_polyline(value, precision=5):
+    """Decode a Google encoded polyline into [(lat, lng), ...]; raises ValueError if malformed"""
+    points = []
+    index = lat = lng = 0
+    factor = 10 ** precision
+    while index < len(value):
+        deltas = []
+        for _ in range(2):
+            shift = result = 0
+            while True:
+                if index >= len(value):
+                    raise ValueError('Truncated polyline')
+                byte = ord(value[index]) - 63
+                index += 1
+                if byte < 0 or byte > 63:
+                    raise ValueError('Invalid polyline character')
+                result |= (byte & 0x1f) << shift
+                shift += 5
+                if byte < 0x20:
+                    break
+            deltas.append(~(result >> 1) if result & 1 else result >> 1)
+        lat += deltas[0]
+        lng += deltas[1]
+        points.append((lat / factor, lng / factor))
+    return points
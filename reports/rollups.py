@@ -0,0 +1,270 @@
+"""
+Time-bucketed incident rollups for trend charts and time-of-day questions.
+
+IncidentRollup holds the number of verified reports per incident hour and
+per local incident day, geohash cell (ROLLUP_PRECISION characters),
+category and severity. Buckets are keyed on incident_date, when the
+incident happened, not when it was reported. Rows are kept up to date
+incrementally from changes.verified_incidents_changed, like the
+IncidentStat counters.
+
+A time range is read as hourly rows for its partial first and last days
+and daily rows for the whole days in between, so a year-long range reads
+a few hundred daily rows per cell rather than every report. Areas are
+resolved to whole geohash cells (about 4.9km x 4.9km), so the edges of a
+bounding box are approximate.
+"""
+from collections import Counter
+from datetime import datetime, time, timedelta
+
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q, Sum
+from django.db.models.functions import ExtractHour, ExtractIsoWeekDay
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from . import geo
+from .models import IncidentReport, IncidentRollup
+
+# Geohash precision of rollup cells (about 4.9km x 4.9km)
+ROLLUP_PRECISION = 5
+
+# Range used when a query gives no start
+DEFAULT_RANGE = timedelta(days=30)
+
+# Longest series a trend query may return, in buckets
+MAX_SERIES_BUCKETS = 1000
+
+SEVERITIES = [severity for severity, _ in IncidentReport.SEVERITY_CHOICES]
+
+WEEKDAYS = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+
+
+def _aware(value):
+    return timezone.make_aware(value) if timezone.is_naive(value) else value
+
+
+def hour_start(value):
+    """Start of the hour containing a datetime"""
+    return _aware(value).replace(minute=0, second=0, microsecond=0)
+
+
+def day_start(day):
+    """Start of a local calendar day"""
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def _local_day(value):
+    return timezone.localdate(_aware(value))
+
+
+def _rollup_keys(row):
+    geohash = row.get('geohash') or geo.encode(row['latitude'], row['longitude'])
+    cell = geohash[:ROLLUP_PRECISION]
+    incident_date = row['incident_date']
+    return [
+        ('hour', hour_start(incident_date), cell, row['category'], row['severity']),
+        ('day', day_start(_local_day(incident_date)), cell, row['category'], row['severity']),
+    ]
+
+
+def rollup_totals(rows, sign=1):
+    """Count report rows into {(period, bucket, cell, category, severity): count}"""
+    totals = Counter()
+    for row in rows:
+        for key in _rollup_keys(row):
+            totals[key] += sign
+    return totals
+
+
+def apply_changes(added, removed):
+    """Add/subtract verified report rows to the rollups"""
+    deltas = rollup_totals(added)
+    deltas.update(rollup_totals(removed, sign=-1))
+
+    with transaction.atomic():
+        for (period, bucket, cell, category, severity), delta in sorted(deltas.items()):
+            if not delta:
+                continue
+            rollups = IncidentRollup.objects.filter(
+                period=period, bucket=bucket, cell=cell, category=category, severity=severity,
+            )
+            if rollups.update(count=F('count') + delta):
+                if delta < 0:
+                    rollups.filter(count__lte=0).delete()
+                continue
+            if delta < 0:
+                continue
+            try:
+                with transaction.atomic():
+                    IncidentRollup.objects.create(
+                        period=period, bucket=bucket, cell=cell, category=category, severity=severity, count=delta,
+                    )
+            except IntegrityError:
+                # Another worker created the row first
+                rollups.update(count=F('count') + delta)
+
+
+def rebuild():
+    """Recompute every rollup from the report table; returns the number of rows"""
+    rows = (
+        IncidentReport.objects.counted().order_by()
+        .values('latitude', 'longitude', 'geohash', 'category', 'severity', 'incident_date')
+    )
+    totals = rollup_totals(rows.iterator(chunk_size=2000))
+    with transaction.atomic():
+        IncidentRollup.objects.all().delete()
+        IncidentRollup.objects.bulk_create(
+            [IncidentRollup(period=period, bucket=bucket, cell=cell, category=category, severity=severity, count=count)
+             for (period, bucket, cell, category, severity), count in totals.items()],
+            batch_size=1000,
+        )
+    return len(totals)
+
+
+def parse_time(value):
+    """Parse an ISO date or datetime; dates mean local midnight. Raises ValueError if malformed"""
+    parsed = parse_datetime(value)
+    if parsed is not None:
+        return _aware(parsed)
+    day = parse_date(value)
+    if day is not None:
+        return day_start(day)
+    raise ValueError(f'{value!r} is not an ISO date or datetime')
+
+
+def time_range(start=None, end=None):
+    """
+    Return an hour-aligned (start, end) range from optional bounds.
+
+    end defaults to now and start to DEFAULT_RANGE before end. The start is
+    rounded down and the end up to whole hours.
+    """
+    end = end or timezone.now()
+    start = start or end - DEFAULT_RANGE
+    end_hour = hour_start(end)
+    if end_hour < end:
+        end_hour += timedelta(hours=1)
+    start = hour_start(start)
+    if start >= end_hour:
+        raise ValueError('start must be before end')
+    return start, end_hour
+
+
+def _split(start, end):
+    """Split an hour-aligned range into [(period, start, end), ...] parts of whole hours and whole days"""
+    first_day = _local_day(start)
+    if day_start(first_day) < start:
+        first_day += timedelta(days=1)
+    last_day = _local_day(end)
+    if day_start(first_day) >= day_start(last_day):
+        return [('hour', start, end)]
+    parts = []
+    if start < day_start(first_day):
+        parts.append(('hour', start, day_start(first_day)))
+    parts.append(('day', day_start(first_day), day_start(last_day)))
+    if day_start(last_day) < end:
+        parts.append(('hour', day_start(last_day), end))
+    return parts
+
+
+def _area(bbox):
+    """Q restricting rollup cells to those overlapping a bounding box"""
+    min_lon, min_lat, max_lon, max_lat = bbox
+    if min_lon > max_lon:
+        boxes = [(min_lon, min_lat, 180.0, max_lat), (-180.0, min_lat, max_lon, max_lat)]
+    else:
+        boxes = [(min_lon, min_lat, max_lon, max_lat)]
+    area = Q()
+    for box in boxes:
+        for range_start, range_end in geo.prefix_ranges(geo.cover_bbox(*box, max_precision=ROLLUP_PRECISION)):
+            cell = Q(cell__gte=range_start)
+            if range_end is not None:
+                cell &= Q(cell__lt=range_end)
+            area |= cell
+    return area
+
+
+def _rollups(period, start, end, bbox=None, category='', severity=''):
+    rollups = IncidentRollup.objects.filter(period=period, bucket__gte=start, bucket__lt=end)
+    if bbox is not None:
+        rollups = rollups.filter(_area(bbox))
+    if category:
+        rollups = rollups.filter(category=category)
+    if severity:
+        rollups = rollups.filter(severity=severity)
+    return rollups.order_by()
+
+
+def _empty():
+    return dict({'count': 0}, **{severity: 0 for severity in SEVERITIES})
+
+
+def _add(totals, key, severity, count):
+    totals[key]['count'] += count
+    if severity in SEVERITIES:
+        totals[key][severity] += count
+
+
+def series(start, end, interval='day', bbox=None, category='', severity=''):
+    """
+    Incident counts per hour or local day of an hour-aligned range.
+
+    Returns [{'start': datetime, 'count': n, 'low': n, 'moderate': n, 'high': n}, ...]
+    with every bucket of the range, including empty ones.
+    """
+    if interval == 'hour':
+        buckets = []
+        bucket = start
+        while bucket < end:
+            buckets.append(bucket)
+            bucket += timedelta(hours=1)
+        parts = [('hour', start, end)]
+    else:
+        day, last_day = _local_day(start), _local_day(end - timedelta(microseconds=1))
+        buckets = []
+        while day <= last_day:
+            buckets.append(day_start(day))
+            day += timedelta(days=1)
+        parts = _split(start, end)
+
+    totals = {bucket: _empty() for bucket in buckets}
+    for period, part_start, part_end in parts:
+        rows = (
+            _rollups(period, part_start, part_end, bbox, category, severity)
+            .values('bucket', 'severity').annotate(total=Sum('count'))
+        )
+        for row in rows:
+            bucket = row['bucket']
+            if interval != 'hour' and period == 'hour':
+                # Partial days are read hourly; fold the hours into their day
+                bucket = day_start(_local_day(bucket))
+            _add(totals, bucket, row['severity'], row['total'])
+    return [dict(totals[bucket], start=bucket) for bucket in buckets]
+
+
+def histogram(start, end, by='hour', bbox=None, category='', severity=''):
+    """
+    Incident counts by local hour of day (0-23) or ISO weekday (1 = Monday) over an hour-aligned range.
+
+    Returns [{'bin': n, 'count': n, 'low': n, 'moderate': n, 'high': n}, ...] for every bin.
+    """
+    if by == 'hour':
+        bins = range(24)
+        extract = ExtractHour('bucket')
+        # Daily rows cannot be split into hours
+        parts = [('hour', start, end)]
+    else:
+        bins = range(1, 8)
+        extract = ExtractIsoWeekDay('bucket')
+        parts = _split(start, end)
+
+    totals = {value: _empty() for value in bins}
+    for period, part_start, part_end in parts:
+        rows = (
+            _rollups(period, part_start, part_end, bbox, category, severity)
+            .annotate(bin=extract).values('bin', 'severity').annotate(total=Sum('count'))
+        )
+        for row in rows:
+            _add(totals, row['bin'], row['severity'], row['total'])
+    return [dict(totals[value], bin=value) for value in bins]
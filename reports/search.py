@@ -0,0 +1,434 @@
+"""
+Full-text search over incident reports and community discussions.
+
+Every report, discussion and reply has a SearchDocument row holding its
+searchable text (title, and body: description plus location name for
+reports, content for discussions and replies). The documents are kept in
+step with their sources from post_save/post_delete, and from
+changes.verified_incidents_changed for bulk verification.
+
+The text index depends on the database:
+
+- PostgreSQL: a generated tsvector column (title weighted above body)
+  with a GIN index, ranked with ts_rank_cd and highlighted with
+  ts_headline.
+- SQLite: an external-content FTS5 table kept in sync by triggers,
+  ranked with bm25 and highlighted with highlight()/snippet().
+- Anything else: icontains over the documents, unranked.
+
+Queries are reduced to their words, all of which must match; the last
+word also matches as a prefix, so results appear while a word is being
+typed.
+"""
+import html
+import re
+from datetime import timezone as dt_timezone
+
+from django.db import connection, transaction
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+from django.db.utils import DatabaseError
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import CommunityDiscussion, DiscussionReply, IncidentReport, SearchDocument
+
+FTS_TABLE = 'reports_search_fts'
+
+KINDS = ('report', 'discussion', 'reply')
+
+# Relative weight of a match in the title over one in the body
+TITLE_WEIGHT = 10.0
+
+# Words of body text around the matches in a snippet
+SNIPPET_WORDS = 24
+
+# Words of a query that are used
+MAX_TERMS = 10
+
+BATCH_SIZE = 500
+
+# Highlight markers; the text is HTML-escaped before they become <mark> tags
+_MARK_START = '\x02'
+_MARK_END = '\x03'
+
+_SQLITE_INSTALL = [
+    f"""CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5(
+        title, body, content='reports_searchdocument', content_rowid='id',
+        tokenize='porter unicode61 remove_diacritics 2'
+    )""",
+    f"""CREATE TRIGGER {FTS_TABLE}_insert AFTER INSERT ON reports_searchdocument BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, title, body) VALUES (new.id, new.title, new.body);
+    END""",
+    f"""CREATE TRIGGER {FTS_TABLE}_delete AFTER DELETE ON reports_searchdocument BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, body) VALUES ('delete', old.id, old.title, old.body);
+    END""",
+    f"""CREATE TRIGGER {FTS_TABLE}_update AFTER UPDATE OF title, body ON reports_searchdocument BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, body) VALUES ('delete', old.id, old.title, old.body);
+        INSERT INTO {FTS_TABLE}(rowid, title, body) VALUES (new.id, new.title, new.body);
+    END""",
+]
+
+_SQLITE_UNINSTALL = [
+    f'DROP TRIGGER IF EXISTS {FTS_TABLE}_insert',
+    f'DROP TRIGGER IF EXISTS {FTS_TABLE}_delete',
+    f'DROP TRIGGER IF EXISTS {FTS_TABLE}_update',
+    f'DROP TABLE IF EXISTS {FTS_TABLE}',
+]
+
+_POSTGRES_INSTALL = [
+    """ALTER TABLE reports_searchdocument ADD COLUMN search_vector tsvector GENERATED ALWAYS AS (
+        setweight(to_tsvector('english', coalesce(title, '')), 'A')
+        || setweight(to_tsvector('english', coalesce(body, '')), 'B')
+    ) STORED""",
+    'CREATE INDEX reports_search_vector_idx ON reports_searchdocument USING GIN (search_vector)',
+]
+
+_POSTGRES_UNINSTALL = [
+    'DROP INDEX IF EXISTS reports_search_vector_idx',
+    'ALTER TABLE reports_searchdocument DROP COLUMN IF EXISTS search_vector',
+]
+
+
+def install_index(schema_editor):
+    """Create the database's text index over reports_searchdocument (used by the migration)"""
+    vendor = schema_editor.connection.vendor
+    statements = {'postgresql': _POSTGRES_INSTALL, 'sqlite': _SQLITE_INSTALL}.get(vendor, [])
+    try:
+        with transaction.atomic(using=schema_editor.connection.alias):
+            for statement in statements:
+                schema_editor.execute(statement)
+    except DatabaseError:
+        # SQLite builds without FTS5 fall back to the unranked search
+        if vendor != 'sqlite':
+            raise
+
+
+def uninstall_index(schema_editor):
+    vendor = schema_editor.connection.vendor
+    for statement in {'postgresql': _POSTGRES_UNINSTALL, 'sqlite': _SQLITE_UNINSTALL}.get(vendor, []):
+        schema_editor.execute(statement)
+
+
+def backend():
+    """'postgres', 'fts5' or 'basic', depending on the database and its index"""
+    if connection.vendor == 'postgresql':
+        return 'postgres'
+    if connection.vendor == 'sqlite' and FTS_TABLE in connection.introspection.table_names():
+        return 'fts5'
+    return 'basic'
+
+
+def _clean(text):
+    return (text or '').replace(_MARK_START, '').replace(_MARK_END, '')
+
+
+def report_document(report):
+    return {
+        'kind': 'report',
+        'object_id': report.pk,
+        'parent_id': None,
+        'title': _clean(report.title),
+        'body': _clean('\n'.join(part for part in (report.description, report.location_name) if part)),
+        'category': report.category,
+        'is_public': report.is_verified,
+        'created_at': report.created_at,
+    }
+
+
+def discussion_document(discussion):
+    return {
+        'kind': 'discussion',
+        'object_id': discussion.pk,
+        'parent_id': None,
+        'title': _clean(discussion.title),
+        'body': _clean(discussion.content),
+        'category': discussion.category,
+        'is_public': True,
+        'created_at': discussion.created_at,
+    }
+
+
+def reply_document(reply):
+    return {
+        'kind': 'reply',
+        'object_id': reply.pk,
+        'parent_id': reply.discussion_id,
+        'title': '',
+        'body': _clean(reply.content),
+        'category': '',
+        'is_public': True,
+        'created_at': reply.created_at,
+    }
+
+
+# Document builder per source model
+DOCUMENTS = {
+    IncidentReport: report_document,
+    CommunityDiscussion: discussion_document,
+    DiscussionReply: reply_document,
+}
+
+MODEL_KINDS = {
+    IncidentReport: 'report',
+    CommunityDiscussion: 'discussion',
+    DiscussionReply: 'reply',
+}
+
+
+def index(instance):
+    """Create or refresh the document of a report, discussion or reply"""
+    document = DOCUMENTS[type(instance)](instance)
+    SearchDocument.objects.update_or_create(
+        kind=document.pop('kind'), object_id=document.pop('object_id'), defaults=document,
+    )
+
+
+def unindex(instance):
+    """Remove the document of a deleted report, discussion or reply"""
+    SearchDocument.objects.filter(kind=MODEL_KINDS[type(instance)], object_id=instance.pk).delete()
+
+
+def refresh_reports(report_ids):
+    """
+    Re-sync report visibility after writes that bypass save(), e.g. bulk verification.
+    
+    Reports without a document yet (bulk-created) are indexed.
+    """
+    report_ids = list(set(report_ids))
+    for start in range(0, len(report_ids), BATCH_SIZE):
+        batch = report_ids[start:start + BATCH_SIZE]
+        public = list(IncidentReport.objects.filter(pk__in=batch, is_verified=True).values_list('pk', flat=True))
+        documents = SearchDocument.objects.filter(kind='report', object_id__in=batch)
+        documents.filter(object_id__in=public).exclude(is_public=True).update(is_public=True)
+        documents.exclude(object_id__in=public).exclude(is_public=False).update(is_public=False)
+        missing = set(batch) - set(documents.values_list('object_id', flat=True))
+        if missing:
+            SearchDocument.objects.bulk_create(
+                [SearchDocument(**report_document(report)) for report in IncidentReport.objects.filter(pk__in=missing)],
+                ignore_conflicts=True,
+            )
+
+
+def _source_documents():
+    for model, build in DOCUMENTS.items():
+        for instance in model.objects.order_by().iterator(chunk_size=BATCH_SIZE):
+            yield SearchDocument(**build(instance))
+
+
+def rebuild():
+    """Recreate every document from the reports and discussions; returns the number of documents"""
+    count = 0
+    with transaction.atomic():
+        SearchDocument.objects.all().delete()
+        batch = []
+        for document in _source_documents():
+            batch.append(document)
+            if len(batch) >= BATCH_SIZE:
+                SearchDocument.objects.bulk_create(batch)
+                count += len(batch)
+                batch = []
+        SearchDocument.objects.bulk_create(batch)
+        count += len(batch)
+    return count
+
+
+def terms(query):
+    """The lower-cased words of a query that are searched for"""
+    return re.findall(r'\w+', (query or '').lower())[:MAX_TERMS]
+
+
+def _filters(kinds, category, public_only, since, until):
+    """SQL conditions on the document table (aliased d) and their parameters"""
+    conditions = []
+    params = []
+    if kinds:
+        conditions.append('d.kind IN (%s)' % ', '.join(['%s'] * len(kinds)))
+        params.extend(kinds)
+    if category:
+        conditions.append('d.category = %s')
+        params.append(category)
+    if public_only:
+        conditions.append('d.is_public = %s')
+        params.append(True)
+    if since:
+        conditions.append('d.created_at >= %s')
+        params.append(connection.ops.adapt_datetimefield_value(since))
+    if until:
+        conditions.append('d.created_at < %s')
+        params.append(connection.ops.adapt_datetimefield_value(until))
+    return ''.join(f' AND {condition}' for condition in conditions), params
+
+
+def _fts5_match(words):
+    # Quoted words can't be read as FTS5 operators; the last one is a prefix
+    return ' '.join(f'"{word}"' for word in words) + '*'
+
+
+def _tsquery(words):
+    return ' & '.join(words[:-1] + [f'{words[-1]}:*'])
+
+
+def _fts5_rows(words, where, params, limit, offset):
+    match = _fts5_match(words)
+    # CROSS JOIN keeps the index lookup first; otherwise SQLite may run the MATCH per document
+    sql = f"""
+        SELECT d.kind, d.object_id, d.parent_id, d.category, d.created_at,
+               -bm25({FTS_TABLE}, %s, 1.0) AS score,
+               highlight({FTS_TABLE}, 0, %s, %s),
+               snippet({FTS_TABLE}, 1, %s, %s, '...', %s)
+        FROM {FTS_TABLE} CROSS JOIN reports_searchdocument d ON d.id = {FTS_TABLE}.rowid
+        WHERE {FTS_TABLE} MATCH %s{where}
+        ORDER BY score DESC, d.id
+        LIMIT %s OFFSET %s
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [
+            TITLE_WEIGHT, _MARK_START, _MARK_END, _MARK_START, _MARK_END, SNIPPET_WORDS, match,
+            *params, limit, offset,
+        ])
+        return cursor.fetchall()
+
+
+def _postgres_rows(words, where, params, limit, offset):
+    query = _tsquery(words)
+    options = f'StartSel={_MARK_START}, StopSel={_MARK_END}'
+    # Rank in the inner query so only the page's rows are highlighted
+    sql = f"""
+        SELECT kind, object_id, parent_id, category, created_at, score,
+               ts_headline('english', title, query, %s),
+               ts_headline('english', body, query, %s)
+        FROM (
+            SELECT d.*, q.query, ts_rank_cd('{{0.1, 0.2, 0.4, 1.0}}', d.search_vector, q.query) AS score
+            FROM reports_searchdocument d, to_tsquery('english', %s) AS q(query)
+            WHERE d.search_vector @@ q.query{where}
+            ORDER BY score DESC, d.id
+            LIMIT %s OFFSET %s
+        ) ranked
+        ORDER BY score DESC, id
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [
+            f'{options}, HighlightAll=true', f'{options}, MaxWords={SNIPPET_WORDS}, MinWords={SNIPPET_WORDS // 2}',
+            query, *params, limit, offset,
+        ])
+        return cursor.fetchall()
+
+
+def _mark(text, words):
+    pattern = re.compile(r'\b(%s)' % '|'.join(re.escape(word) for word in words), re.IGNORECASE)
+    return pattern.sub(lambda match: f'{_MARK_START}{match.group(0)}{_MARK_END}', text)
+
+
+def _basic_documents(words):
+    documents = SearchDocument.objects.all()
+    for word in words:
+        documents = documents.filter(Q(title__icontains=word) | Q(body__icontains=word))
+    return documents
+
+
+def _basic_rows(words, kinds, category, public_only, since, until, limit, offset):
+    documents = _basic_documents(words)
+    if kinds:
+        documents = documents.filter(kind__in=kinds)
+    if category:
+        documents = documents.filter(category=category)
+    if public_only:
+        documents = documents.filter(is_public=True)
+    if since:
+        documents = documents.filter(created_at__gte=since)
+    if until:
+        documents = documents.filter(created_at__lt=until)
+    rows = []
+    for document in documents.order_by('-created_at', '-id')[offset:offset + limit]:
+        body = ' '.join(document.body.split()[:SNIPPET_WORDS])
+        rows.append((
+            document.kind, document.object_id, document.parent_id, document.category, document.created_at, 0.0,
+            _mark(document.title, words), _mark(body, words),
+        ))
+    return rows
+
+
+def _render(text):
+    """HTML-escape highlighted text and turn the markers into <mark> tags"""
+    return html.escape(text or '').replace(_MARK_START, '<mark>').replace(_MARK_END, '</mark>')
+
+
+def _url(kind, object_id, parent_id):
+    if kind == 'report':
+        return reverse('reports:report_detail', args=[object_id])
+    if kind == 'discussion':
+        return reverse('reports:discussion_detail', args=[object_id])
+    return reverse('reports:discussion_detail', args=[parent_id]) + f'#reply-{object_id}'
+
+
+def search(query, kinds=None, category='', public_only=True, since=None, until=None, limit=20, offset=0):
+    """
+    Ranked documents matching every word of a query.
+    
+    Returns [{'type', 'id', 'title', 'snippet', 'category', 'created_at',
+    'url', 'score'}, ...], best first. Titles and snippets are HTML with the
+    matched words in <mark> tags; replies carry their discussion's title.
+    """
+    words = terms(query)
+    if not words:
+        return []
+    kinds = [kind for kind in kinds or () if kind in KINDS]
+    engine = backend()
+    if engine == 'basic':
+        rows = _basic_rows(words, kinds, category, public_only, since, until, limit, offset)
+    else:
+        where, params = _filters(kinds, category, public_only, since, until)
+        fetch = _postgres_rows if engine == 'postgres' else _fts5_rows
+        rows = fetch(words, where, params, limit, offset)
+    
+    discussion_titles = dict(
+        CommunityDiscussion.objects.filter(pk__in={row[2] for row in rows if row[0] == 'reply'})
+        .values_list('pk', 'title')
+    )
+    results = []
+    for kind, object_id, parent_id, category, created_at, score, title, snippet in rows:
+        if isinstance(created_at, str):
+            created_at = parse_datetime(created_at)
+        if timezone.is_naive(created_at):
+            # Raw cursors return UTC datetimes without their zone where the database has none
+            created_at = timezone.make_aware(created_at, dt_timezone.utc)
+        if kind == 'reply':
+            title = html.escape(f"Reply in {discussion_titles.get(parent_id, 'a discussion')}")
+        else:
+            title = _render(title)
+        results.append({
+            'type': kind,
+            'id': object_id,
+            'title': title,
+            'snippet': _render(snippet),
+            'category': category,
+            'created_at': created_at,
+            'url': _url(kind, object_id, parent_id),
+            'score': round(float(score), 4),
+        })
+    return results
+
+
+def matching_ids(kind, query):
+    """
+    Subquery of the ids of every source of one kind matching a query, for pk__in.
+    
+    Unranked and including unverified reports (for the admin changelists).
+    """
+    words = terms(query)
+    engine = backend()
+    if engine == 'fts5':
+        return RawSQL(
+            f"""SELECT d.object_id FROM {FTS_TABLE} CROSS JOIN reports_searchdocument d ON d.id = {FTS_TABLE}.rowid
+            WHERE {FTS_TABLE} MATCH %s AND d.kind = %s""",
+            [_fts5_match(words), kind],
+        )
+    if engine == 'postgres':
+        return RawSQL(
+            "SELECT d.object_id FROM reports_searchdocument d "
+            "WHERE d.search_vector @@ to_tsquery('english', %s) AND d.kind = %s",
+            [_tsquery(words), kind],
+        )
+    return _basic_documents(words).filter(kind=kind).values('object_id')
@@ -0,0 +1,155 @@
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from . import cache as reports_cache
+from . import changes, clusters, dedup, feed, imaging, moderation, risk, rollups, search, stats, zones
+from .models import CommunityDiscussion, DiscussionReply, IncidentImage, IncidentReport, SavedZone, ZoneAlert
+from .snapshot import bump_dataset_version
+
+
+@receiver(pre_save, sender=IncidentReport)
+@receiver(pre_delete, sender=IncidentReport)
+def incident_capture_state(sender, instance, **kwargs):
+    """Load the stored state of a report that was fetched with deferred fields"""
+    if instance.pk and not instance._state.adding and not hasattr(instance, '_tracked_state'):
+        instance._tracked_state = changes.fetch_states(sender, [instance.pk]).get(instance.pk)
+
+
+@receiver(post_save, sender=IncidentReport)
+def incident_saved(sender, instance, **kwargs):
+    """Invalidate incident snapshots and update derived data when a report is created or edited"""
+    old_state = getattr(instance, '_tracked_state', None)
+    new_state = changes.incident_state(instance)
+    if (old_state and old_state['is_verified']) or new_state['is_verified']:
+        # Unverified reports appear in no public payload, so submitting or
+        # editing one leaves the snapshots and their ETags valid
+        bump_dataset_version()
+    instance._tracked_state = new_state
+    old_states = {instance.pk: old_state} if old_state else {}
+    changes.send_changes(sender, *changes.diff_states(old_states, {instance.pk: new_state}))
+    changes.send_verification_changes(sender, old_states, {instance.pk: new_state})
+
+
+@receiver(post_save, sender=IncidentReport)
+def incident_submitted(sender, instance, created, **kwargs):
+    """Place a new report in the moderation queue"""
+    if created and not instance.is_verified:
+        moderation.refresh(IncidentReport.objects.filter(pk=instance.pk))
+
+
+@receiver(pre_save, sender=IncidentReport)
+def incident_dedup_capture(sender, instance, update_fields=None, **kwargs):
+    """Note whether the save edits the fields duplicate matching reads"""
+    instance._needs_rematch = dedup.needs_rematch(instance, update_fields)
+
+
+@receiver(post_save, sender=IncidentReport)
+def incident_dedup(sender, instance, created, **kwargs):
+    """Match new and edited reports against reports of the same incident"""
+    if created or getattr(instance, '_needs_rematch', True):
+        dedup.schedule(instance.pk)
+
+
+@receiver(pre_delete, sender=IncidentReport)
+def incident_dedup_deleting(sender, instance, **kwargs):
+    """A deleted primary hands its duplicates to another report of the incident"""
+    dedup.report_deleting(instance)
+
+
+@receiver(post_delete, sender=IncidentReport)
+def incident_deleted(sender, instance, **kwargs):
+    """Invalidate incident snapshots and update derived data when a report is removed"""
+    old_state = getattr(instance, '_tracked_state', None)
+    if old_state is None or old_state['is_verified']:
+        bump_dataset_version()
+    if old_state:
+        changes.send_changes(sender, *changes.diff_states({instance.pk: old_state}, {}))
+
+
+@receiver(post_save, sender=IncidentImage)
+@receiver(post_delete, sender=IncidentImage)
+def incident_image_changed(sender, instance, **kwargs):
+    """Pages that show report images are cached; drop them when an image changes"""
+    reports_cache.invalidate('home', 'gallery')
+
+
+@receiver(post_save, sender=IncidentImage)
+def incident_image_uploaded(sender, instance, created, **kwargs):
+    """Generate thumbnails and the blurred variant of new uploads in the background"""
+    if created and instance.image:
+        imaging.schedule(instance.pk)
+
+
+@receiver(changes.verified_incidents_changed)
+def update_incident_stats(sender, added, removed, **kwargs):
+    """Keep the verified counters in step with the verified set"""
+    stats.apply_changes(added, removed)
+
+
+@receiver(changes.verified_incidents_changed)
+def update_incident_rollups(sender, added, removed, **kwargs):
+    """Keep the hourly/daily incident rollups in step with the verified set"""
+    rollups.apply_changes(added, removed)
+
+
+@receiver(changes.verified_incidents_changed)
+def update_cluster_pyramid(sender, added, removed, **kwargs):
+    """Keep the map clustering pyramid in step with the verified set"""
+    clusters.apply_changes(added, removed)
+
+
+@receiver(changes.verified_incidents_changed)
+def update_risk_grid(sender, added, removed, **kwargs):
+    """Keep the route risk raster in step with the verified set"""
+    risk.apply_changes(added, removed)
+
+
+@receiver(changes.verified_incidents_changed)
+def update_zone_alerts(sender, added, removed, **kwargs):
+    """Match newly verified reports against saved zones"""
+    zones.apply_changes(added, removed)
+
+
+@receiver(changes.verification_changed)
+def update_duplicate_primaries(sender, ids, **kwargs):
+    """The primary of a duplicate group is its earliest verified report"""
+    dedup.regroup(ids)
+
+
+@receiver(changes.verified_incidents_changed)
+def update_search_visibility(sender, added, removed, **kwargs):
+    """Bulk (un)verification bypasses save(); only verified reports are publicly searchable"""
+    search.refresh_reports([row['id'] for row in added] + [row['id'] for row in removed])
+
+
+@receiver(post_save, sender=IncidentReport)
+@receiver(post_save, sender=CommunityDiscussion)
+@receiver(post_save, sender=DiscussionReply)
+def search_document_saved(sender, instance, **kwargs):
+    """Keep the search index in step with reports and discussions"""
+    search.index(instance)
+
+
+@receiver(post_delete, sender=IncidentReport)
+@receiver(post_delete, sender=CommunityDiscussion)
+@receiver(post_delete, sender=DiscussionReply)
+def search_document_deleted(sender, instance, **kwargs):
+    search.unindex(instance)
+
+
+@receiver(pre_delete, sender=IncidentReport)
+def incident_deleting(sender, instance, **kwargs):
+    """The report's alerts are cascade-deleted with it; drop the feeds that show them"""
+    feed.invalidate(ZoneAlert.objects.filter(report=instance).values_list('user_id', flat=True))
+
+
+@receiver(post_save, sender=SavedZone)
+def saved_zone_saved(sender, instance, created, **kwargs):
+    """Keep the zone index current and match the zone against recent reports"""
+    zones.zone_changed(instance, created)
+
+
+@receiver(post_delete, sender=SavedZone)
+def saved_zone_deleted(sender, instance, **kwargs):
+    """Let the user's other zones pick up reports this zone was alerting for"""
+    zones.zone_deleted(instance)
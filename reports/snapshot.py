@@ -0,0 +1,41 @@
+"""
+Versioned snapshots of the public incident dataset.
+
+The verified incident set only changes when a report is saved, deleted or
+bulk-updated (e.g. the admin verify actions). Every such write bumps the
+dataset version, which is the version of the 'incidents' cache namespace.
+Serialized responses are cached under that version, and the version doubles
+as the ETag so conditional GETs can be answered with a 304 before any
+database work happens.
+"""
+import hashlib
+
+from . import cache as reports_cache
+
+# IncidentReport fields that appear in public incident payloads
+SNAPSHOT_FIELDS = {
+    'is_verified', 'title', 'category', 'severity', 'latitude', 'longitude',
+    'location_name', 'incident_date', 'created_at', 'duplicate_of_id',
+}
+
+
+def get_dataset_version():
+    """Return the current dataset version"""
+    return reports_cache.namespace_version('incidents')
+
+
+def bump_dataset_version():
+    """Invalidate every incident snapshot, ETag and incident-derived page cache"""
+    reports_cache.invalidate(*reports_cache.INCIDENT_NAMESPACES)
+
+
+def snapshot_etag(namespace, request, *extra):
+    """Strong ETag for a snapshot namespace, the request's query string and extra parts"""
+    params = '&'.join(f'{key}={value}' for key, value in sorted(request.GET.items()))
+    raw = ':'.join([namespace, get_dataset_version(), params] + [str(part) for part in extra])
+    return '"%s"' % hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+def get_or_build(namespace, etag, builder):
+    """Return the cached snapshot for an ETag, building and storing it on a miss"""
+    return reports_cache.get_or_set(namespace, [etag], builder)
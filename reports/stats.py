@@ -0,0 +1,98 @@
+"""
+Verified incident counters.
+
+IncidentStat holds the number of verified reports per incident day,
+category and severity. It is kept up to date incrementally from
+changes.verified_incidents_changed, so pages that show counts read a few
+summary rows instead of running COUNT(*) over the report table.
+"""
+from collections import Counter
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from . import cache as reports_cache
+from .models import IncidentReport, IncidentStat
+
+
+def _stat_key(row):
+    incident_date = row['incident_date']
+    day = incident_date.date() if timezone.is_naive(incident_date) else timezone.localdate(incident_date)
+    return (day, row['category'], row['severity'])
+
+
+def apply_changes(added, removed):
+    """Add/subtract verified report rows to the counters"""
+    deltas = Counter()
+    for row in added:
+        deltas[_stat_key(row)] += 1
+    for row in removed:
+        deltas[_stat_key(row)] -= 1
+    
+    with transaction.atomic():
+        for (day, category, severity), delta in sorted(deltas.items()):
+            if not delta:
+                continue
+            stats = IncidentStat.objects.filter(day=day, category=category, severity=severity)
+            if stats.update(count=F('count') + delta) or delta < 0:
+                continue
+            try:
+                with transaction.atomic():
+                    IncidentStat.objects.create(day=day, category=category, severity=severity, count=delta)
+            except IntegrityError:
+                # Another worker created the row first
+                stats.update(count=F('count') + delta)
+    reports_cache.invalidate('stats')
+
+
+def rebuild():
+    """Recompute every counter from the report table"""
+    rows = (
+        IncidentReport.objects.counted()
+        .order_by()
+        .annotate(day=TruncDate('incident_date'))
+        .values('day', 'category', 'severity')
+        .annotate(count=Count('id'))
+    )
+    with transaction.atomic():
+        IncidentStat.objects.all().delete()
+        IncidentStat.objects.bulk_create([IncidentStat(**row) for row in rows], batch_size=1000)
+    reports_cache.invalidate('stats')
+
+
+def _totals(field):
+    def build():
+        rows = IncidentStat.objects.order_by().values(field).annotate(total=Sum('count'))
+        return {row[field]: row['total'] for row in rows}
+    return reports_cache.get_or_set('stats', [field], build)
+
+
+def severity_totals():
+    """Verified report count per severity"""
+    return _totals('severity')
+
+
+def category_totals():
+    """Verified report count per category"""
+    return _totals('category')
+
+
+def total_verified():
+    """Total number of verified reports"""
+    return sum(severity_totals().values())
+
+
+def summary():
+    """Counters for templates: totals plus per-severity and per-category dicts"""
+    severities = severity_totals()
+    return {
+        'total': sum(severities.values()),
+        'high': severities.get('high', 0),
+        'moderate': severities.get('moderate', 0),
+        'low': severities.get('low', 0),
+        'by_category': [
+            (label, category_totals().get(value, 0)) for value, label in IncidentReport.CATEGORY_CHOICES
+        ],
+    }
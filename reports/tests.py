@@ -0,0 +1,664 @@
+"""
+Tests for the reports app.
+
+The admin changelists load their related objects and counts in the page
+query, so their query count must not grow with the number of rows on the
+page. The derived-data modules (clusters, rollups, dedup, geo, packing)
+are checked against results computed directly from the report table.
+"""
+import json
+import os
+import tempfile
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from unittest import mock, skipIf
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache, caches
+from django.db import connection
+from django.test import Client, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from . import cache as reports_cache
+from . import clusters, dedup, geo, moderation, packing, risk, rollups
+from .admin import (
+    CommunityDiscussionAdmin, DiscussionReplyAdmin, HelpfulReportAdmin, IncidentAudioAdmin,
+    IncidentImageAdmin, IncidentReportAdmin, IncidentStatAdmin, IncidentVideoAdmin, JobAdmin, SavedZoneAdmin,
+)
+from .models import (
+    CommunityDiscussion, DiscussionReply, HelpfulReport, IncidentAudio, IncidentImage,
+    IncidentReport, IncidentStat, IncidentVideo, Job, SavedZone,
+)
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+User = get_user_model()
+
+# Rows shown per page; the largest is also the number of rows created per model
+ROW_COUNTS = (5, 25, 100)
+
+
+class ChangelistQueryCountTests(TestCase):
+    """Every changelist runs the same number of queries at each page size"""
+    
+    @classmethod
+    def setUpTestData(cls):
+        rows = max(ROW_COUNTS)
+        now = timezone.now()
+        cls.superuser = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        users = User.objects.bulk_create([User(username=f'user{i}') for i in range(rows)])
+        # bulk_create sends no signals, so no background jobs are queued for the fixtures
+        reports = IncidentReport.objects.bulk_create([
+            IncidentReport(
+                user=user, title=f'Report {i}', category='theft', description='Phone snatched',
+                severity='moderate', latitude='-1.286389', longitude='36.817223', incident_date=now,
+                is_verified=bool(i % 2),
+            )
+            for i, user in enumerate(users)
+        ])
+        IncidentImage.objects.bulk_create([
+            IncidentImage(report=report, image=f'incident_images/{report.pk}.jpg', image_type='location', is_blurred=False)
+            for report in reports
+        ])
+        IncidentVideo.objects.bulk_create([
+            IncidentVideo(report=report, video=f'incident_videos/{report.pk}.mp4') for report in reports
+        ])
+        IncidentAudio.objects.bulk_create([
+            IncidentAudio(report=report, audio=f'incident_audio/{report.pk}.mp3') for report in reports
+        ])
+        SavedZone.objects.bulk_create([
+            SavedZone(user=user, name='Home', latitude='-1.286389', longitude='36.817223') for user in users
+        ])
+        HelpfulReport.objects.bulk_create([
+            HelpfulReport(user=user, report=report) for user, report in zip(users, reports)
+        ])
+        discussions = CommunityDiscussion.objects.bulk_create([
+            CommunityDiscussion(user=user, title=f'Discussion {i}', content='Avoid this street at night')
+            for i, user in enumerate(users)
+        ])
+        DiscussionReply.objects.bulk_create([
+            DiscussionReply(discussion=discussion, user=user, content='Noted')
+            for discussion, user in zip(discussions, users)
+        ])
+        IncidentStat.objects.bulk_create([
+            IncidentStat(day=date(2024, 1, 1) + timedelta(days=i), category='theft', severity='moderate', count=i)
+            for i in range(rows)
+        ])
+        Job.objects.bulk_create([Job(name='process_image', payload={'image_id': i}, run_at=now) for i in range(rows)])
+    
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.superuser)
+    
+    def assertConstantQueries(self, model_admin, url_name):
+        """Load the changelist at each of ROW_COUNTS rows per page and compare the query counts"""
+        # The first load fills cached template context (the incident stats), which is not per row
+        self.client.get(reverse(url_name))
+        counts = {}
+        for per_page in ROW_COUNTS:
+            with mock.patch.object(model_admin, 'list_per_page', per_page):
+                with CaptureQueriesContext(connection) as queries:
+                    response = self.client.get(reverse(url_name))
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.context['cl'].result_list), per_page)
+            counts[per_page] = len(queries)
+        self.assertEqual(len(set(counts.values())), 1, f'Queries per page size: {counts}')
+    
+    def test_incident_report_changelist(self):
+        self.assertConstantQueries(IncidentReportAdmin, 'admin:reports_incidentreport_changelist')
+    
+    def test_incident_image_changelist(self):
+        self.assertConstantQueries(IncidentImageAdmin, 'admin:reports_incidentimage_changelist')
+    
+    def test_incident_video_changelist(self):
+        self.assertConstantQueries(IncidentVideoAdmin, 'admin:reports_incidentvideo_changelist')
+    
+    def test_incident_audio_changelist(self):
+        self.assertConstantQueries(IncidentAudioAdmin, 'admin:reports_incidentaudio_changelist')
+    
+    def test_saved_zone_changelist(self):
+        self.assertConstantQueries(SavedZoneAdmin, 'admin:reports_savedzone_changelist')
+    
+    def test_helpful_report_changelist(self):
+        self.assertConstantQueries(HelpfulReportAdmin, 'admin:reports_helpfulreport_changelist')
+    
+    def test_community_discussion_changelist(self):
+        self.assertConstantQueries(CommunityDiscussionAdmin, 'admin:reports_communitydiscussion_changelist')
+    
+    def test_discussion_reply_changelist(self):
+        self.assertConstantQueries(DiscussionReplyAdmin, 'admin:reports_discussionreply_changelist')
+    
+    def test_incident_stat_changelist(self):
+        self.assertConstantQueries(IncidentStatAdmin, 'admin:reports_incidentstat_changelist')
+    
+    def test_job_changelist(self):
+        self.assertConstantQueries(JobAdmin, 'admin:reports_job_changelist')
+
+
+def make_reports(user, specs, is_verified=True):
+    """Bulk-create reports from (latitude, longitude, severity) tuples, bypassing the change signals"""
+    return IncidentReport.objects.untracked().bulk_create([
+        IncidentReport(
+            user=user, title=f'Report {i}', category='theft', description='Phone snatched', severity=severity,
+            latitude=latitude, longitude=longitude, incident_date=timezone.now(), is_verified=is_verified,
+        )
+        for i, (latitude, longitude, severity) in enumerate(specs)
+    ])
+
+
+class ClusterTests(TestCase):
+    """Pyramid clusters filtered by severity are centred on that severity's reports"""
+    
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('reporter', 'reporter@example.com', 'password')
+        make_reports(cls.user, [('-1.280000', '36.800000', 'moderate')] * 9 + [('-1.290000', '36.810000', 'high')])
+        clusters.rebuild()
+    
+    def setUp(self):
+        cache.clear()
+    
+    def test_unfiltered_centroid_is_the_mean_of_all_reports(self):
+        [cluster] = clusters.from_pyramid(5, clusters.world_bbox())
+        self.assertEqual(cluster['count'], 10)
+        self.assertAlmostEqual(cluster['lat'], -1.281, places=6)
+        self.assertAlmostEqual(cluster['lng'], 36.801, places=6)
+    
+    def test_severity_filtered_centroid(self):
+        [cluster] = clusters.from_pyramid(5, clusters.world_bbox(), severity='high')
+        self.assertEqual(cluster['count'], 1)
+        self.assertEqual(cluster['severity'], {'low': 0, 'moderate': 0, 'high': 1})
+        self.assertAlmostEqual(cluster['lat'], -1.29, places=6)
+        self.assertAlmostEqual(cluster['lng'], 36.81, places=6)
+    
+    def test_severity_filtered_centroid_after_incremental_changes(self):
+        [report] = make_reports(self.user, [('-1.310000', '36.830000', 'high')])
+        clusters.apply_changes([{'latitude': report.latitude, 'longitude': report.longitude,
+                                 'category': 'theft', 'severity': 'high'}], [])
+        [cluster] = clusters.from_pyramid(5, clusters.world_bbox(), severity='high')
+        self.assertEqual(cluster['count'], 2)
+        self.assertAlmostEqual(cluster['lat'], -1.30, places=6)
+        self.assertAlmostEqual(cluster['lng'], 36.82, places=6)
+    
+    def test_severity_filtered_endpoint(self):
+        response = self.client.get(reverse('reports:incident_clusters'), {'zoom': 5, 'severity': 'high'})
+        self.assertEqual(response.status_code, 200)
+        [cluster] = response.json()['clusters']
+        self.assertAlmostEqual(cluster['lat'], -1.29, places=6)
+        self.assertAlmostEqual(cluster['lng'], 36.81, places=6)
+
+
+@skipIf(risk.np is None, 'numpy is not installed')
+class RouteScoreTests(TestCase):
+    """The route score endpoint is a read-only API: no CSRF token, and malformed input is a 400"""
+    
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create_user('reporter', 'reporter@example.com', 'password')
+        make_reports(user, [('-1.286389', '36.817223', 'high')])
+    
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings_override = override_settings(SAFEROUTE_RISK_GRID_PATH=os.path.join(directory.name, 'risk_grid.bin'))
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        risk.rebuild()
+        self.client = Client(enforce_csrf_checks=True)
+    
+    def post_route(self, **data):
+        data['points'] = [[-1.2860, 36.8170], [-1.2870, 36.8180]]
+        return self.client.post(reverse('reports:route_score'), json.dumps(data), content_type='application/json')
+    
+    def test_json_post_needs_no_csrf_token(self):
+        response = self.post_route()
+        self.assertEqual(response.status_code, 200)
+        self.assertGreater(response.json()['peak'], 0)
+    
+    def test_categories_list(self):
+        self.assertEqual(self.post_route(categories=['theft', 'assault']).status_code, 200)
+    
+    def test_malformed_categories_are_rejected(self):
+        for categories in (5, {'theft': True}, ['theft', 5]):
+            with self.subTest(categories=categories):
+                self.assertEqual(self.post_route(categories=categories).status_code, 400)
+
+
+class ModerationTests(TestCase):
+    """Reports sent back to the queue get a current priority"""
+    
+    @classmethod
+    def setUpTestData(cls):
+        cls.superuser = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        cls.reports = make_reports(cls.superuser, [('-1.286389', '36.817223', 'high')] * 3)
+    
+    def test_unverify_refreshes_priorities(self):
+        self.assertEqual(moderation.unverify([report.pk for report in self.reports[:2]]), 2)
+        priorities = dict(IncidentReport.objects.values_list('pk', 'moderation_priority'))
+        expected = moderation.priorities(
+            IncidentReport.objects.filter(pk=self.reports[0].pk).values(*moderation.PRIORITY_FIELDS)
+        )[self.reports[0].pk]
+        self.assertGreater(expected, 0)
+        self.assertEqual(priorities[self.reports[0].pk], expected)
+        self.assertEqual(priorities[self.reports[1].pk], expected)
+        # Still verified, so still out of the queue and not rescored
+        self.assertEqual(priorities[self.reports[2].pk], 0)
+    
+    def test_admin_unverify_action(self):
+        self.client.force_login(self.superuser)
+        report = self.reports[0]
+        response = self.client.post(reverse('admin:reports_incidentreport_changelist'), {
+            'action': 'mark_as_unverified', '_selected_action': [report.pk],
+        })
+        self.assertEqual(response.status_code, 302)
+        report.refresh_from_db()
+        self.assertFalse(report.is_verified)
+        self.assertGreater(report.moderation_priority, 0)
+        self.assertIn(report, moderation.page()[0])
+
+
+@skipIf(fakeredis is None, 'fakeredis is not installed')
+@override_settings(CACHES={'default': {
+    # What CACHE_URL=fakeredis:// configures: Django's Redis backend on an in-process server
+    'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+    'LOCATION': 'redis://localhost:6379/0',
+    'OPTIONS': {'connection_class': fakeredis.FakeConnection if fakeredis else None},
+    'KEY_PREFIX': 'saferoute',
+}})
+class RedisCacheTests(TestCase):
+    """Namespaced caching on a Redis URL, shared between web and worker processes"""
+    
+    def setUp(self):
+        cache.clear()
+    
+    def test_get_or_set_until_invalidated(self):
+        builds = []
+        
+        def build():
+            builds.append(1)
+            return {'reports': len(builds)}
+        
+        self.assertEqual(reports_cache.get_or_set('home', ['counts'], build), {'reports': 1})
+        self.assertEqual(reports_cache.get_or_set('home', ['counts'], build), {'reports': 1})
+        reports_cache.invalidate('home')
+        self.assertEqual(reports_cache.get_or_set('home', ['counts'], build), {'reports': 2})
+    
+    def test_invalidation_by_another_process(self):
+        reports_cache.get_or_set('clusters', ['world'], lambda: 'stale')
+        # A worker process has its own connection to the same server
+        worker_cache = caches.create_connection('default')
+        self.assertIsNot(worker_cache, caches['default'])
+        with mock.patch.object(reports_cache, 'cache', worker_cache):
+            reports_cache.invalidate(*reports_cache.INCIDENT_NAMESPACES)
+        self.assertEqual(reports_cache.get_or_set('clusters', ['world'], lambda: 'fresh'), 'fresh')
+
+
+# Boxes as (min_lon, min_lat, max_lon, max_lat); min_lon > max_lon crosses the antimeridian
+EDGE_BOXES = {
+    'antimeridian': (170.0, -50.0, -170.0, 50.0),
+    'north pole': (-180.0, 89.0, 180.0, 90.0),
+    'south pole': (-180.0, -90.0, 180.0, -89.0),
+    'world': (-180.0, -90.0, 180.0, 90.0),
+    'edges on points': (-90.0, -45.0, 90.0, 45.0),
+    'one point': (0.0, 0.0, 0.0, 0.0),
+}
+
+EDGE_LATITUDES = (-90.0, -89.99, -45.0, 0.0, 45.0, 89.99, 90.0)
+EDGE_LONGITUDES = (-180.0, -179.99, -90.0, 0.0, 90.0, 179.99, 180.0)
+
+
+def box_contains(box, latitude, longitude):
+    min_lon, min_lat, max_lon, max_lat = box
+    if not min_lat <= latitude <= max_lat:
+        return False
+    if min_lon > max_lon:
+        return longitude >= min_lon or longitude <= max_lon
+    return min_lon <= longitude <= max_lon
+
+
+class GeohashTests(SimpleTestCase):
+    """Geohash encoding, bounding box covers and prefix ranges"""
+    
+    def test_encode(self):
+        self.assertEqual(geo.encode(57.64911, 10.40744), 'u4pruydqq')
+        self.assertEqual(geo.encode(-90, -180), '000000000')
+        self.assertEqual(geo.encode(90, 180), 'zzzzzzzzz')
+    
+    def test_cover_contains_every_point_in_the_box(self):
+        for name, box in EDGE_BOXES.items():
+            min_lon, min_lat, max_lon, max_lat = box
+            # The antimeridian is covered one half at a time, as in_bbox does
+            halves = [(min_lon, min_lat, 180.0, max_lat), (-180.0, min_lat, max_lon, max_lat)] if min_lon > max_lon else [box]
+            prefixes = [prefix for half in halves for prefix in geo.cover_bbox(*half)]
+            for latitude in EDGE_LATITUDES:
+                for longitude in EDGE_LONGITUDES:
+                    if box_contains(box, latitude, longitude):
+                        with self.subTest(box=name, latitude=latitude, longitude=longitude):
+                            geohash = geo.encode(latitude, longitude)
+                            self.assertTrue(any(geohash.startswith(prefix) for prefix in prefixes))
+    
+    def test_cover_respects_max_cells(self):
+        for name, box in EDGE_BOXES.items():
+            if box[0] <= box[2]:
+                with self.subTest(box=name):
+                    self.assertLessEqual(len(geo.cover_bbox(*box)), geo.MAX_COVER_CELLS)
+        self.assertEqual(len(geo.cover_bbox(0.0, 0.0, 0.0, 0.0)[0]), geo.GEOHASH_PRECISION)
+    
+    def test_prefix_ranges(self):
+        self.assertEqual(geo.prefix_ranges(['c', 'b']), [('b', 'd')])
+        self.assertEqual(geo.prefix_ranges(['b', 'd']), [('b', 'c'), ('d', 'e')])
+        self.assertEqual(geo.prefix_ranges(['zz']), [('zz', None)])
+        # 'c0' starts right where 'bz' ends
+        self.assertEqual(geo.prefix_ranges(['bz', 'c0']), [('bz', 'c1')])
+        self.assertIsNone(geo.prefix_successor('zzz'))
+        self.assertEqual(geo.prefix_successor('bz'), 'c')
+    
+    def test_circle_bbox(self):
+        min_lon, _, max_lon, _ = geo.circle_bbox(0, 179.99, 10)
+        self.assertGreater(min_lon, max_lon)
+        min_lon, _, max_lon, max_lat = geo.circle_bbox(89.99, 0, 10)
+        self.assertEqual((min_lon, max_lon, max_lat), (-180.0, 180.0, 90.0))
+
+
+class InBboxTests(TestCase):
+    """in_bbox matches exactly the reports inside the box, at the antimeridian and the poles too"""
+    
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create_user('reporter', 'reporter@example.com', 'password')
+        make_reports(user, [
+            (f'{latitude:.6f}', f'{longitude:.6f}', 'low')
+            for latitude in EDGE_LATITUDES for longitude in EDGE_LONGITUDES
+        ])
+    
+    def test_in_bbox_matches_a_scan(self):
+        reports = IncidentReport.objects.values_list('id', 'latitude', 'longitude')
+        for name, box in EDGE_BOXES.items():
+            with self.subTest(box=name):
+                expected = {pk for pk, latitude, longitude in reports if box_contains(box, float(latitude), float(longitude))}
+                self.assertTrue(expected)
+                self.assertEqual(set(IncidentReport.objects.in_bbox(*box).values_list('id', flat=True)), expected)
+
+
+class PackingTests(SimpleTestCase):
+    """The binary points format decodes back to the rows it was encoded from"""
+    
+    def test_round_trip(self):
+        rows = [
+            (7, Decimal('-1.286389'), Decimal('36.817223'), 'high', 'theft'),
+            # Ids and coordinates going down give negative deltas
+            (3, Decimal('-1.286390'), Decimal('36.817200'), 'low', 'assault'),
+            # Opposite corners of the world give the largest deltas
+            (2 ** 31 - 1, Decimal('90.000000'), Decimal('180.000000'), 'moderate', 'other'),
+            (1, Decimal('-90.000000'), Decimal('-180.000000'), 'low', 'road_danger'),
+        ]
+        decoded = packing.decode(packing.encode(rows))
+        self.assertEqual(len(decoded), len(rows))
+        for (report_id, latitude, longitude, severity, category), point in zip(rows, decoded):
+            self.assertEqual(point[0], report_id)
+            self.assertAlmostEqual(point[1], float(latitude), places=5)
+            self.assertAlmostEqual(point[2], float(longitude), places=5)
+            self.assertEqual(point[3:], (severity, category))
+    
+    def test_empty(self):
+        payload = packing.encode([])
+        self.assertEqual(packing.decode(payload), [])
+        self.assertEqual(len(payload) % 4, 0)
+    
+    def test_columns_are_aligned(self):
+        payload = packing.encode([(1, 0, 0, 'low', 'theft')])
+        legend_length = int.from_bytes(payload[12:16], 'little')
+        self.assertEqual(legend_length % 4, 0)
+        self.assertEqual(len(payload), 16 + legend_length + 3 * 4 + 1)
+    
+    def test_unknown_category(self):
+        [point] = packing.decode(packing.encode([(1, 0, 0, 'high', 'unlisted')]))
+        self.assertEqual(point[3:], ('high', None))
+    
+    def test_rejects_other_payloads(self):
+        with self.assertRaises(ValueError):
+            packing.decode(b'{"points": []}')
+
+
+class IncidentPointsTests(TestCase):
+    """The points endpoint sends every counted report, decodable by packing.decode"""
+    
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create_user('reporter', 'reporter@example.com', 'password')
+        cls.reports = make_reports(user, [('-1.286389', '36.817223', 'high'), ('-4.043477', '39.668206', 'low')])
+        make_reports(user, [('0.514277', '35.269779', 'moderate')], is_verified=False)
+    
+    def setUp(self):
+        cache.clear()
+    
+    def test_points_round_trip(self):
+        response = self.client.get(reverse('reports:incident_points'))
+        self.assertEqual(response.status_code, 200)
+        points = packing.decode(response.content)
+        self.assertEqual(
+            sorted((point[0], point[3]) for point in points),
+            sorted((report.pk, report.severity) for report in self.reports),
+        )
+
+
+NAIROBI = ('-1.286389', '36.817223')
+MOMBASA = ('-4.043477', '39.668206')
+NAIROBI_BBOX = (36.5, -1.6, 37.1, -1.0)
+
+
+# Local days start three hours before UTC ones, so day and hour buckets disagree with UTC dates
+@override_settings(TIME_ZONE='Africa/Nairobi')
+class RollupTests(TestCase):
+    """Trend series and histograms read from rollups match an aggregate over the report table"""
+    
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create_user('reporter', 'reporter@example.com', 'password')
+        cls.base = timezone.make_aware(datetime(2024, 3, 1))
+        reports = []
+        for i in range(60):
+            latitude, longitude = MOMBASA if i % 5 == 0 else NAIROBI
+            reports.append(IncidentReport(
+                user=user, title=f'Report {i}', category=('theft', 'assault')[i % 2], description='Phone snatched',
+                severity=rollups.SEVERITIES[i % 3], latitude=latitude, longitude=longitude,
+                incident_date=cls.base + timedelta(hours=7 * i, minutes=13),
+                # Every seventh report is unverified and must not be counted
+                is_verified=i % 7 != 6,
+            ))
+        IncidentReport.objects.untracked().bulk_create(reports)
+        rollups.rebuild()
+    
+    def expected_series(self, start, end, interval, category='', bbox=None):
+        reports = IncidentReport.objects.counted()
+        if category:
+            reports = reports.filter(category=category)
+        if bbox is not None:
+            min_lon, min_lat, max_lon, max_lat = bbox
+            reports = reports.filter(
+                latitude__gte=min_lat, latitude__lte=max_lat, longitude__gte=min_lon, longitude__lte=max_lon,
+            )
+        expected = []
+        bucket = start if interval == 'hour' else rollups.day_start(timezone.localdate(start))
+        while bucket < end:
+            step_end = bucket + timedelta(hours=1) if interval == 'hour' else rollups.day_start(
+                timezone.localdate(bucket) + timedelta(days=1)
+            )
+            counts = {severity: reports.filter(
+                severity=severity, incident_date__gte=max(bucket, start), incident_date__lt=min(step_end, end),
+            ).count() for severity in rollups.SEVERITIES}
+            expected.append(dict(counts, start=bucket, count=sum(counts.values())))
+            bucket = step_end
+        return expected
+    
+    def test_split_covers_the_range_in_whole_hours_and_days(self):
+        for start_hours, end_hours in ((5, 230), (0, 240), (50, 68), (3, 4), (24, 49)):
+            start, end = self.base + timedelta(hours=start_hours), self.base + timedelta(hours=end_hours)
+            with self.subTest(start=start, end=end):
+                parts = rollups._split(start, end)
+                self.assertEqual(parts[0][1], start)
+                self.assertEqual(parts[-1][2], end)
+                for (_, _, part_end), (_, next_start, _) in zip(parts, parts[1:]):
+                    self.assertEqual(part_end, next_start)
+                for period, part_start, part_end in parts:
+                    if period == 'day':
+                        self.assertEqual(timezone.localtime(part_start).hour, 0)
+                        self.assertEqual(timezone.localtime(part_end).hour, 0)
+    
+    def test_series_matches_the_report_table(self):
+        ranges = {
+            'partial first and last days': (5, 230),
+            'whole days': (0, 240),
+            'within one day': (50, 68),
+            'past the reports': (400, 460),
+        }
+        for name, (start_hours, end_hours) in ranges.items():
+            start, end = rollups.time_range(
+                self.base + timedelta(hours=start_hours), self.base + timedelta(hours=end_hours),
+            )
+            for interval in ('day', 'hour'):
+                with self.subTest(range=name, interval=interval):
+                    self.assertEqual(rollups.series(start, end, interval), self.expected_series(start, end, interval))
+    
+    def test_filtered_series_matches_the_report_table(self):
+        start, end = rollups.time_range(self.base + timedelta(hours=5), self.base + timedelta(hours=230))
+        self.assertEqual(
+            rollups.series(start, end, category='theft', bbox=NAIROBI_BBOX),
+            self.expected_series(start, end, 'day', category='theft', bbox=NAIROBI_BBOX),
+        )
+    
+    def test_histograms_match_the_report_table(self):
+        start, end = rollups.time_range(self.base + timedelta(hours=5), self.base + timedelta(hours=230))
+        dates = [
+            timezone.localtime(incident_date) for incident_date in IncidentReport.objects.counted()
+            .filter(incident_date__gte=start, incident_date__lt=end).values_list('incident_date', flat=True)
+        ]
+        by_hour = {row['bin']: row['count'] for row in rollups.histogram(start, end, 'hour')}
+        self.assertEqual(by_hour, {hour: sum(1 for value in dates if value.hour == hour) for hour in range(24)})
+        by_weekday = {row['bin']: row['count'] for row in rollups.histogram(start, end, 'weekday')}
+        self.assertEqual(
+            by_weekday, {weekday: sum(1 for value in dates if value.isoweekday() == weekday) for weekday in range(1, 8)},
+        )
+    
+    def test_incremental_changes_match_the_report_table(self):
+        user = User.objects.get(username='reporter')
+        [added] = IncidentReport.objects.untracked().bulk_create([IncidentReport(
+            user=user, title='Late report', category='theft', description='Phone snatched', severity='high',
+            latitude=NAIROBI[0], longitude=NAIROBI[1], incident_date=self.base + timedelta(days=3, hours=23, minutes=59),
+            is_verified=True,
+        )])
+        removed = IncidentReport.objects.counted().exclude(pk=added.pk).first()
+        IncidentReport.objects.untracked().filter(pk=removed.pk).update(is_verified=False)
+        fields = ('latitude', 'longitude', 'geohash', 'category', 'severity', 'incident_date')
+        rollups.apply_changes(
+            [{field: getattr(added, field) for field in fields}], [{field: getattr(removed, field) for field in fields}],
+        )
+        start, end = rollups.time_range(self.base, self.base + timedelta(days=10))
+        self.assertEqual(rollups.series(start, end), self.expected_series(start, end, 'day'))
+
+
+SNATCHING = (
+    'Phone snatched at the Kenyatta Avenue matatu stage',
+    'Two men on a motorbike grabbed my phone near the matatu stage on Kenyatta Avenue and rode off towards Moi Avenue.',
+)
+SNATCHING_RETOLD = (
+    'Phone snatched at Kenyatta Avenue matatu stage!',
+    'Two men on a motorbike grabbed my phone near the matatu stage on Kenyatta Avenue and rode towards Moi Avenue',
+)
+CAR_BREAK_IN = (
+    'Car broken into at the Sarit Centre parking',
+    'Someone smashed the rear window of a parked car and took a laptop bag from the back seat during the afternoon.',
+)
+
+
+class DedupTests(TestCase):
+    """Near-identical reports of one incident are linked; different incidents are not"""
+    
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('reporter', 'reporter@example.com', 'password')
+        cls.start = timezone.make_aware(datetime(2024, 3, 1, 18, 0))
+    
+    def report(self, text, minutes=0, north_m=0, category='theft', is_verified=True):
+        """An unsaved report near the matatu stage, `minutes` after the first and `north_m` metres north of it"""
+        title, description = text
+        return IncidentReport(
+            user=self.user, title=title, description=description, category=category, severity='moderate',
+            latitude=Decimal('-1.284000') + Decimal(north_m / 111320).quantize(Decimal('0.000001')),
+            longitude=Decimal('36.823000'), incident_date=self.start + timedelta(minutes=minutes),
+            is_verified=is_verified,
+        )
+    
+    def create(self, *reports):
+        return IncidentReport.objects.untracked().bulk_create(reports)
+    
+    def duplicate_of(self, reports):
+        return dict(IncidentReport.objects.filter(pk__in=[report.pk for report in reports]).values_list('pk', 'duplicate_of'))
+    
+    def test_signature_similarity(self):
+        first, retold, other = (dedup.signature(' '.join(text)) for text in (SNATCHING, SNATCHING_RETOLD, CAR_BREAK_IN))
+        self.assertEqual(len(first), dedup.NUM_PERM)
+        self.assertGreaterEqual(dedup.similarity(first, retold), dedup.SIMILARITY_THRESHOLD)
+        self.assertLess(dedup.similarity(first, other), dedup.SIMILARITY_THRESHOLD)
+        self.assertEqual(dedup.similarity(first, first), 1.0)
+        self.assertIsNone(dedup.signature(' !? '))
+    
+    @skipIf(dedup.np is None, 'numpy is not installed')
+    def test_signature_is_the_same_without_numpy(self):
+        text = ' '.join(SNATCHING)
+        with_numpy = dedup.signature(text)
+        with mock.patch.object(dedup, 'np', None):
+            self.assertEqual(dedup.signature(text), with_numpy)
+    
+    def test_rebuild_links_near_duplicates_only(self):
+        # The unverified first report loses the primary role to the earliest verified one
+        first, retold, repeated = self.create(
+            self.report(SNATCHING, is_verified=False),
+            self.report(SNATCHING_RETOLD, minutes=20, north_m=150),
+            self.report(SNATCHING, minutes=45, north_m=-100),
+        )
+        others = self.create(
+            # Same place and time, different incident
+            self.report(CAR_BREAK_IN, minutes=10),
+            # Same text, but too far away (still in a neighbouring bucket cell), too late or another category
+            self.report(SNATCHING, north_m=-550),
+            self.report(SNATCHING, minutes=60 * 24),
+            self.report(SNATCHING, category='assault'),
+        )
+        fingerprinted, groups = dedup.rebuild()
+        self.assertEqual((fingerprinted, groups), (7, 1))
+        self.assertEqual(
+            self.duplicate_of([first, retold, repeated] + others),
+            {first.pk: retold.pk, retold.pk: None, repeated.pk: retold.pk, **{other.pk: None for other in others}},
+        )
+        self.assertEqual(IncidentReport.objects.counted().filter(pk__in=[first.pk, retold.pk, repeated.pk]).count(), 1)
+    
+    def test_rebuild_replaces_stale_links(self):
+        snatching, break_in = self.create(self.report(SNATCHING), self.report(CAR_BREAK_IN, minutes=5))
+        IncidentReport.objects.untracked().filter(pk=break_in.pk).update(duplicate_of=snatching)
+        dedup.rebuild()
+        self.assertEqual(self.duplicate_of([snatching, break_in]), {snatching.pk: None, break_in.pk: None})
+    
+    def test_new_report_is_matched_against_stored_fingerprints(self):
+        first, other = self.create(self.report(SNATCHING), self.report(CAR_BREAK_IN))
+        dedup.rebuild()
+        retold, unrelated = self.create(
+            self.report(SNATCHING_RETOLD, minutes=30, north_m=200), self.report(CAR_BREAK_IN, minutes=60 * 24),
+        )
+        dedup.dedup_report(retold.pk)
+        dedup.dedup_report(unrelated.pk)
+        self.assertEqual(
+            self.duplicate_of([first, other, retold, unrelated]),
+            {first.pk: None, other.pk: None, retold.pk: first.pk, unrelated.pk: None},
+        )
+    
+    def test_detach(self):
+        first, retold = self.create(self.report(SNATCHING), self.report(SNATCHING_RETOLD, minutes=5))
+        dedup.rebuild()
+        self.assertEqual(dedup.detach([retold.pk]), 1)
+        self.assertEqual(self.duplicate_of([first, retold]), {first.pk: None, retold.pk: None})
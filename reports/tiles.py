@@ -0,0 +1,89 @@
+"""
+Web Mercator tile helpers used by the heatmap tile endpoint.
+
+Tiles follow the usual slippy-map z/x/y scheme so the browser can request
+exactly the tiles Leaflet is showing. Each tile is split into a square grid
+of cells and incidents are binned into those cells server-side, so a tile
+response never grows beyond TILE_GRID_SIZE * TILE_GRID_SIZE cells no matter
+how many reports fall inside it.
+"""
+import math
+
+# Number of cells along each side of a tile
+TILE_GRID_SIZE = 32
+
+# Highest zoom level we serve tiles for (matches the map's maxZoom)
+MAX_TILE_ZOOM = 19
+
+# Web Mercator is undefined at the poles
+MAX_LATITUDE = 85.05112878
+
+# Heat contribution of a single incident per severity
+SEVERITY_WEIGHTS = {
+    'low': 0.3,
+    'moderate': 0.6,
+    'high': 1.0,
+}
+
+
+def is_valid_tile(z, x, y):
+    """Check that z/x/y address an existing tile"""
+    if z < 0 or z > MAX_TILE_ZOOM:
+        return False
+    n = 2 ** z
+    return 0 <= x < n and 0 <= y < n
+
+
+def tile_to_lon(x, z):
+    """Longitude of the west edge of tile column x (fractional x allowed)"""
+    return x / (2 ** z) * 360.0 - 180.0
+
+
+def tile_to_lat(y, z):
+    """Latitude of the north edge of tile row y (fractional y allowed)"""
+    n = math.pi * (1 - 2 * y / (2 ** z))
+    return math.degrees(math.atan(math.sinh(n)))
+
+
+def tile_bounds(z, x, y):
+    """Return (min_lon, min_lat, max_lon, max_lat) for a tile"""
+    return (
+        tile_to_lon(x, z),
+        tile_to_lat(y + 1, z),
+        tile_to_lon(x + 1, z),
+        tile_to_lat(y, z),
+    )
+
+
+def lonlat_to_tile_fraction(lon, lat, z):
+    """Project a coordinate to fractional tile coordinates at zoom z"""
+    lat = max(-MAX_LATITUDE, min(MAX_LATITUDE, lat))
+    n = 2 ** z
+    tx = (lon + 180.0) / 360.0 * n
+    ty = (1 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2 * n
+    return tx, ty
+
+
+def bin_tile(points, z, x, y, size=TILE_GRID_SIZE):
+    """
+    Bin (latitude, longitude, severity) rows into a size x size grid for tile z/x/y.
+
+    Returns a dict keyed by (row, col) with [weight, count] values.
+    """
+    cells = {}
+    for latitude, longitude, severity in points:
+        tx, ty = lonlat_to_tile_fraction(float(longitude), float(latitude), z)
+        col = min(size - 1, max(0, int((tx - x) * size)))
+        row = min(size - 1, max(0, int((ty - y) * size)))
+        cell = cells.setdefault((row, col), [0.0, 0])
+        cell[0] += SEVERITY_WEIGHTS.get(severity, SEVERITY_WEIGHTS['low'])
+        cell[1] += 1
+    return cells
+
+
+def cell_center(z, x, y, row, col, size=TILE_GRID_SIZE):
+    """Return (latitude, longitude) of the center of a tile cell"""
+    return (
+        tile_to_lat(y + (row + 0.5) / size, z),
+        tile_to_lon(x + (col + 0.5) / size, z),
+    )
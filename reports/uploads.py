@@ -0,0 +1,238 @@
+"""
+Resumable, chunked uploads for incident videos and audio.
+
+A client creates an UploadSession (filename, kind, total size), then sends
+the file as fixed-size parts of session.chunk_size bytes (the last one may
+be shorter), each at the offset the server reports. A part is streamed
+from the request to the chunk store in small blocks, so neither the part
+nor the file is ever held in memory. After a dropped connection the client
+asks for the session's offset and carries on from there.
+
+Once every byte has arrived the session is attached to a report and an
+'assemble_upload' job (see reports.jobs) streams the file from the chunk
+store into media storage as an IncidentVideo or IncidentAudio.
+
+The chunk store is pluggable through SAFEROUTE_CHUNK_STORE (a dotted path
+to a class). LocalChunkStore keeps parts in a file on local disk, which
+must be shared with the job workers.
+"""
+import hashlib
+import os
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files import File
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from . import jobs
+from .models import IncidentAudio, IncidentVideo, UploadSession
+
+# Size of the blocks a part is streamed in
+STREAM_BLOCK_SIZE = 64 * 1024
+
+# Unfinished sessions are deleted after this long without activity
+SESSION_EXPIRY = timedelta(hours=24)
+
+# Model and file field each upload kind turns into
+MEDIA_MODELS = {
+    'video': (IncidentVideo, 'video'),
+    'audio': (IncidentAudio, 'audio'),
+}
+
+
+class UploadError(Exception):
+    """A part or session request that cannot be accepted; carries an HTTP status"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+class LocalChunkStore:
+    """Keeps each session's received bytes in one file under a local directory"""
+
+    def __init__(self, location=None):
+        self.location = location or os.path.join(settings.SAFEROUTE_UPLOAD_STAGING_DIR, 'chunks')
+
+    def path(self, session_id):
+        return os.path.join(self.location, f'{session_id}.part')
+
+    def size(self, session_id):
+        try:
+            return os.path.getsize(self.path(session_id))
+        except FileNotFoundError:
+            return 0
+
+    def write(self, session_id, offset, blocks):
+        """Write an iterable of byte blocks at offset; returns the number of bytes written"""
+        os.makedirs(self.location, exist_ok=True)
+        path = self.path(session_id)
+        with open(path, 'r+b' if os.path.exists(path) else 'wb') as part:
+            # Drop anything past the offset, e.g. the remains of a failed part
+            part.truncate(offset)
+            part.seek(offset)
+            written = 0
+            for block in blocks:
+                part.write(block)
+                written += len(block)
+        return written
+
+    def truncate(self, session_id, size):
+        if os.path.exists(self.path(session_id)):
+            with open(self.path(session_id), 'r+b') as part:
+                part.truncate(size)
+
+    def open(self, session_id):
+        return open(self.path(session_id), 'rb')
+
+    def delete(self, session_id):
+        try:
+            os.remove(self.path(session_id))
+        except FileNotFoundError:
+            pass
+
+
+def get_chunk_store():
+    return import_string(getattr(settings, 'SAFEROUTE_CHUNK_STORE', 'reports.uploads.LocalChunkStore'))()
+
+
+def parse_ids(values):
+    """Keep the valid session ids from a list of strings"""
+    ids = []
+    for value in values:
+        try:
+            ids.append(uuid.UUID(value))
+        except (TypeError, ValueError):
+            pass
+    return ids
+
+
+def create_session(user, kind, filename, total_size, content_type='', checksum=''):
+    """Validate and create an upload session"""
+    if kind not in MEDIA_MODELS:
+        raise UploadError(f'kind must be one of: {", ".join(MEDIA_MODELS)}')
+    if not filename:
+        raise UploadError('filename is required')
+    try:
+        total_size = int(total_size)
+    except (TypeError, ValueError):
+        raise UploadError('size must be an integer')
+    if total_size <= 0:
+        raise UploadError('size must be positive')
+    if total_size > settings.SAFEROUTE_UPLOAD_MAX_SIZE:
+        raise UploadError(f'Files may be at most {settings.SAFEROUTE_UPLOAD_MAX_SIZE} bytes', status=413)
+    expected_prefix = {'video': 'video/', 'audio': 'audio/'}[kind]
+    if content_type and not content_type.startswith(expected_prefix):
+        raise UploadError(f'content_type must be {expected_prefix}*')
+    return UploadSession.objects.create(
+        user=user,
+        kind=kind,
+        filename=os.path.basename(filename)[:255],
+        content_type=content_type[:100],
+        total_size=total_size,
+        chunk_size=settings.SAFEROUTE_UPLOAD_CHUNK_SIZE,
+        checksum=(checksum or '').lower()[:64],
+    )
+
+
+def _read_blocks(stream, length):
+    """Yield exactly `length` bytes from a stream in blocks, stopping early if it ends"""
+    remaining = length
+    while remaining > 0:
+        block = stream.read(min(STREAM_BLOCK_SIZE, remaining))
+        if not block:
+            return
+        remaining -= len(block)
+        yield block
+
+
+def write_part(session, offset, stream, length):
+    """
+    Append one part to a session and return the new offset.
+
+    The part must start at the session's current offset and be exactly
+    chunk_size bytes long, except for the final part.
+    """
+    if session.status != 'uploading':
+        raise UploadError('Upload is no longer accepting data', status=409)
+    if offset != session.received_bytes:
+        raise UploadError(f'Expected offset {session.received_bytes}', status=409)
+    expected = min(session.chunk_size, session.total_size - offset)
+    if length != expected:
+        raise UploadError(f'Part must be {expected} bytes')
+
+    store = get_chunk_store()
+    written = store.write(session.pk, offset, _read_blocks(stream, length))
+    if written != length:
+        # The connection dropped mid-part; forget it so the client resends it whole
+        store.truncate(session.pk, offset)
+        raise UploadError('Incomplete part received')
+
+    # Conditional update: a concurrent request for the same part can only count once
+    UploadSession.objects.filter(pk=session.pk, received_bytes=offset).update(
+        received_bytes=offset + length, updated_at=timezone.now()
+    )
+    session.refresh_from_db(fields=['received_bytes'])
+    return session.received_bytes
+
+
+def finish(session, report, description=''):
+    """Attach a fully received session to a report and enqueue its assembly"""
+    if session.status != 'uploading':
+        raise UploadError('Upload was already completed', status=409)
+    if not session.is_received:
+        raise UploadError(f'Only {session.received_bytes} of {session.total_size} bytes received', status=409)
+    UploadSession.objects.filter(pk=session.pk).update(
+        report=report, description=description, status='assembling', updated_at=timezone.now()
+    )
+    session.report, session.description, session.status = report, description, 'assembling'
+    return jobs.enqueue('assemble_upload', {'upload_id': str(session.pk)}, key=f'assemble_upload:{session.pk}')
+
+
+def _sha256(store, session_id):
+    digest = hashlib.sha256()
+    with store.open(session_id) as part:
+        for block in iter(lambda: part.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+@jobs.handler('assemble_upload')
+def assemble_upload(upload_id):
+    """Stream a received upload into media storage as an IncidentVideo/IncidentAudio"""
+    session = UploadSession.objects.filter(pk=upload_id, status='assembling').first()
+    if session is None:
+        return  # Already assembled, or the session is gone
+    store = get_chunk_store()
+    if store.size(session.pk) != session.total_size or (
+        session.checksum and _sha256(store, session.pk) != session.checksum
+    ):
+        UploadSession.objects.filter(pk=session.pk).update(status='failed')
+        store.delete(session.pk)
+        return
+
+    model, field = MEDIA_MODELS[session.kind]
+    with store.open(session.pk) as part:
+        model.objects.create(
+            report=session.report,
+            description=session.description,
+            **{field: File(part, name=session.filename)},
+        )
+    UploadSession.objects.filter(pk=session.pk).update(status='complete')
+    store.delete(session.pk)
+
+
+def purge_expired(expiry=SESSION_EXPIRY):
+    """Delete unfinished sessions (and their data) with no activity for `expiry`; returns how many"""
+    store = get_chunk_store()
+    expired = UploadSession.objects.filter(
+        status__in=['uploading', 'failed'], updated_at__lt=timezone.now() - expiry
+    )
+    count = 0
+    for session_id in expired.values_list('pk', flat=True):
+        store.delete(session_id)
+        count += 1
+    expired.delete()
+    return count
@@ -11,14 +11,27 @@ urlpatterns = [
     path('reports/<int:report_id>/', views.report_detail_view, name='report_detail'),
     path('reports/<int:report_id>/helpful/', views.mark_helpful_view, name='mark_helpful'),
     path('gallery/', views.gallery_view, name='gallery'),
+    path('gallery/items/', views.gallery_items_view, name='gallery_items'),
     path('safety-tips/', views.safety_tips_view, name='safety_tips'),
     path('save-zone/', views.save_zone_view, name='save_zone'),
     path('community/', views.community_discussion_view, name='community'),
+    path('community/items/', views.community_items_view, name='community_items'),
     path('community/new/', views.create_discussion_view, name='create_discussion'),
     path('community/<int:discussion_id>/', views.discussion_detail_view, name='discussion_detail'),
     path('privacy-policy/', views.privacy_policy_view, name='privacy_policy'),
     path('terms/', views.terms_view, name='terms'),
     path('about/', views.about_view, name='about'),
     path('api/incidents/', views.get_incidents_json, name='incidents_json'),
+    path('api/incidents/points/', views.incident_points_view, name='incident_points'),
+    path('api/incidents/<int:report_id>/', views.incident_detail_json_view, name='incident_detail_json'),
+    path('api/incidents/clusters/', views.incident_clusters_view, name='incident_clusters'),
+    path('api/incidents/trend/', views.incident_trend_view, name='incident_trend'),
+    path('api/incidents/histogram/', views.incident_histogram_view, name='incident_histogram'),
+    path('api/search/', views.search_view, name='search'),
+    path('api/route/score/', views.route_score_view, name='route_score'),
+    path('api/heatmap/tiles/<int:z>/<int:x>/<int:y>/', views.heatmap_tile_view, name='heatmap_tile'),
+    path('api/uploads/', views.upload_create_view, name='upload_create'),
+    path('api/uploads/<uuid:upload_id>/', views.upload_part_view, name='upload_part'),
+    path('api/uploads/<uuid:upload_id>/complete/', views.upload_complete_view, name='upload_complete'),
 ]
 
@@ -1,25 +1,105 @@
+from django.conf import settings
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
-from django.contrib import messages
-from django.core.paginator import Paginator
-from django.http import JsonResponse
+from django.contrib import admin, messages
+from django.contrib.admin.views.decorators import staff_member_required
+from django.db import transaction
+from django.template.loader import render_to_string
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse, Http404
 from django.utils import timezone
-from .models import IncidentReport, IncidentImage, SavedZone, HelpfulReport, CommunityDiscussion, DiscussionReply
+from django.urls import reverse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.gzip import gzip_page
+from django.views.decorators.http import condition, require_http_methods
+from .models import IncidentReport, IncidentImage, SavedZone, HelpfulReport, CommunityDiscussion, DiscussionReply, UploadSession
 from .forms import IncidentReportForm, IncidentImageForm, SavedZoneForm
+from . import cache as reports_cache
+from . import clusters, feed, geo, imaging, moderation, packing, paging, perceptual, perf, risk, rollups, search, snapshot, stats, tiles, uploads, votes
 from datetime import timedelta
 import json
+import time
+
+# Relative time filters ('24h', 'week', 'month') drift as time passes, so
+# their snapshots are also keyed on a coarse clock bucket (seconds)
+TIME_FILTER_BUCKET = 300
+
+INCIDENT_EXPORT_FIELDS = (
+    'id', 'title', 'category', 'severity', 'latitude', 'longitude', 'location_name', 'incident_date',
+)
+INCIDENT_PAGE_SIZE = 500
+INCIDENT_PAGE_SIZE_MAX = 5000
+INCIDENT_STREAM_CHUNK_SIZE = 2000
+
+# Longest route /api/route/score/ accepts
+ROUTE_MAX_POINTS = 2000
+
+SEARCH_PAGE_SIZE = 20
+SEARCH_PAGE_SIZE_MAX = 50
+
+GALLERY_PAGE_SIZE = 12
+COMMUNITY_PAGE_SIZE = 10
+
+
+def filter_incidents(reports, params):
+    """Apply the heatmap category/severity/time filters from a GET dict (time windows are on incident_date)"""
+    category = params.get('category', '')
+    severity = params.get('severity', '')
+    time_filter = params.get('time', 'all')
+    
+    if category:
+        reports = reports.filter(category=category)
+    if severity:
+        reports = reports.filter(severity=severity)
+    if time_filter == '24h':
+        reports = reports.filter(incident_date__gte=timezone.now() - timedelta(days=1))
+    elif time_filter == 'week':
+        reports = reports.filter(incident_date__gte=timezone.now() - timedelta(days=7))
+    elif time_filter == 'month':
+        reports = reports.filter(incident_date__gte=timezone.now() - timedelta(days=30))
+    return reports
+
+
+def incidents_etag(request, *args, **kwargs):
+    """ETag for incident API responses, computed from the cache without touching the DB"""
+    time_bucket = ''
+    if request.GET.get('time', 'all') != 'all':
+        time_bucket = int(time.time() // TIME_FILTER_BUCKET)
+    return snapshot.snapshot_etag(request.resolver_match.url_name, request, *args, time_bucket)
+
+
+def rollup_etag(request, *args, **kwargs):
+    """ETag for rollup API responses; open-ended ranges end at the current hour"""
+    hour_bucket = '' if request.GET.get('end') else int(time.time() // 3600)
+    return snapshot.snapshot_etag(request.resolver_match.url_name, request, *args, hour_bucket)
+
+
+def heatmap_etag(request, *args, **kwargs):
+    """
+    ETag for the heatmap page.
+    
+    Only anonymous visitors get one: signed-in pages carry per-user chrome,
+    and pending flash messages must always be rendered.
+    """
+    if request.user.is_authenticated or 'messages' in request.COOKIES:
+        return None
+    return incidents_etag(request, *args, **kwargs)
 
 
 def home_view(request):
     """Landing page"""
     try:
-        # Get recent incidents for display with images
-        recent_incidents = IncidentReport.objects.filter(is_verified=True).select_related('user').prefetch_related('images').order_by('-created_at')[:6]
+        def build_recent():
+            # Get recent incidents for display with images
+            recent = IncidentReport.objects.filter(is_verified=True).select_related('user').prefetch_related('images').order_by('-created_at')[:6]
+            return list(recent)
         
-        # Calculate risk zones for mini-heatmap
-        high_risk_count = IncidentReport.objects.filter(severity='high', is_verified=True).count()
-        moderate_risk_count = IncidentReport.objects.filter(severity='moderate', is_verified=True).count()
-        safe_zones_count = IncidentReport.objects.filter(severity='low', is_verified=True).count()
+        recent_incidents = reports_cache.get_or_set('home', ['recent'], build_recent)
+        
+        # Risk zone counts for mini-heatmap come from the verified counters
+        severity_counts = stats.severity_totals()
+        high_risk_count = severity_counts.get('high', 0)
+        moderate_risk_count = severity_counts.get('moderate', 0)
+        safe_zones_count = severity_counts.get('low', 0)
     except Exception as e:
         # If database tables don't exist yet, use empty defaults
         recent_incidents = []
@@ -44,23 +124,30 @@ def dashboard_view(request):
         user_reports = IncidentReport.objects.filter(user=user).order_by('-created_at')[:5]
         saved_zones = SavedZone.objects.filter(user=user)
         
-        # Activity feed - recent incidents with images
-        area_incidents = IncidentReport.objects.filter(is_verified=True).select_related('user').prefetch_related('images').order_by('-created_at')[:10]
+        # Activity feed - verified incidents matched to the user's zones,
+        # paged by ?cursor= (the first page is cached per user)
+        cursor = request.GET.get('cursor')
+        try:
+            area_incidents, next_cursor = feed.page(user, cursor) if cursor else feed.first_page(user)
+        except ValueError:
+            area_incidents, next_cursor = feed.first_page(user)
         
-        # Calculate helpful counts and comment counts for each incident
-        for incident in area_incidents:
-            incident.comment_count = 0  # Placeholder for future comment feature
+        verified_stats = stats.summary()
     except Exception as e:
         # If database tables don't exist yet, use empty defaults
         user_reports = []
         saved_zones = []
         area_incidents = []
+        next_cursor = None
+        verified_stats = None
     
     context = {
         'user': request.user,
         'user_reports': user_reports,
         'saved_zones': saved_zones,
         'area_incidents': area_incidents,
+        'next_cursor': next_cursor,
+        'verified_stats': verified_stats,
     }
     return render(request, 'reports/dashboard.html', context)
 
@@ -71,20 +158,23 @@ def submit_report_view(request):
     if request.method == 'POST':
         report_form = IncidentReportForm(request.POST)
         if report_form.is_valid():
-            report = report_form.save(commit=False)
-            report.user = request.user
-            report.save()
-            
-            # Handle image uploads
-            images = request.FILES.getlist('images')
-            for img in images:
+            with transaction.atomic():
+                report = report_form.save(commit=False)
+                report.user = request.user
+                report.save()
+                
+                # Images are stored and processed by background jobs
                 image_type = request.POST.get('image_type', 'evidence')
-                IncidentImage.objects.create(
-                    report=report,
-                    image=img,
-                    image_type=image_type,
-                    is_blurred=True
+                for img in request.FILES.getlist('images'):
+                    imaging.enqueue_upload(report.pk, img, image_type)
+                
+                # Videos and audio were already sent through the resumable upload API
+                sessions = UploadSession.objects.filter(
+                    pk__in=uploads.parse_ids(request.POST.getlist('upload_ids')), user=request.user, status='uploading'
                 )
+                for session in sessions:
+                    if session.is_received:
+                        uploads.finish(session, report)
             
             messages.success(request, 'Incident report submitted successfully! It will be reviewed before being made public.')
             return redirect('reports:report_detail', report_id=report.id)
@@ -94,6 +184,7 @@ def submit_report_view(request):
     return render(request, 'reports/submit_report.html', {'form': report_form})
 
 
+@condition(etag_func=heatmap_etag)
 def heatmap_view(request):
     """Public safety heatmap page"""
     try:
@@ -102,21 +193,6 @@ def heatmap_view(request):
         severity = request.GET.get('severity', '')
         time_filter = request.GET.get('time', 'all')
         
-        # Base queryset
-        reports = IncidentReport.objects.filter(is_verified=True)
-        
-        # Apply filters
-        if category:
-            reports = reports.filter(category=category)
-        if severity:
-            reports = reports.filter(severity=severity)
-        if time_filter == '24h':
-            reports = reports.filter(created_at__gte=timezone.now() - timedelta(days=1))
-        elif time_filter == 'week':
-            reports = reports.filter(created_at__gte=timezone.now() - timedelta(days=7))
-        elif time_filter == 'month':
-            reports = reports.filter(created_at__gte=timezone.now() - timedelta(days=30))
-        
         # Get user's saved zones (if authenticated) - for display in template
         user_saved_zones = []
         if request.user.is_authenticated:
@@ -139,24 +215,8 @@ def heatmap_view(request):
                     })
             except:
                 pass
-        
-        # Serialize for map
-        incidents_data = []
-        for report in reports:
-            incidents_data.append({
-                'id': report.id,
-                'title': report.title,
-                'category': report.get_category_display(),
-                'severity': report.severity,
-                'latitude': float(report.latitude),
-                'longitude': float(report.longitude),
-                'location_name': report.location_name or '',
-                'incident_date': report.incident_date.isoformat(),
-                'url': f'/reports/{report.id}/',
-            })
     except Exception as e:
         # If database tables don't exist yet, use empty defaults
-        incidents_data = []
         saved_zones_json = []
         user_saved_zones = []
         category = request.GET.get('category', '')
@@ -164,7 +224,6 @@ def heatmap_view(request):
         time_filter = request.GET.get('time', 'all')
     
     context = {
-        'incidents': json.dumps(incidents_data),
         'saved_zones': json.dumps(saved_zones_json),
         'user_saved_zones': user_saved_zones,
         'selected_category': category,
@@ -174,19 +233,272 @@ def heatmap_view(request):
     return render(request, 'reports/heatmap.html', context)
 
 
+@condition(etag_func=incidents_etag)
+def heatmap_tile_view(request, z, x, y):
+    """API endpoint returning a pre-binned, severity-weighted heat grid for one map tile"""
+    if not tiles.is_valid_tile(z, x, y):
+        raise Http404('Tile out of range')
+    
+    def build_tile():
+        min_lon, min_lat, max_lon, max_lat = tiles.tile_bounds(z, x, y)
+        reports = filter_incidents(IncidentReport.objects.counted(), request.GET).in_bbox(
+            min_lon, min_lat, max_lon, max_lat
+        ).order_by()
+        points = reports.values_list('latitude', 'longitude', 'severity').iterator(chunk_size=2000)
+        
+        cells = []
+        max_weight = 0.0
+        for (row, col), (weight, count) in tiles.bin_tile(points, z, x, y).items():
+            lat, lng = tiles.cell_center(z, x, y, row, col)
+            cells.append([round(lat, 6), round(lng, 6), round(weight, 3), count])
+            max_weight = max(max_weight, weight)
+        
+        return json.dumps({
+            'z': z,
+            'x': x,
+            'y': y,
+            'size': tiles.TILE_GRID_SIZE,
+            'max': round(max_weight, 3),
+            'cells': cells,
+        })
+    
+    content = snapshot.get_or_build('heatmap_tile', incidents_etag(request, z, x, y), build_tile)
+    response = HttpResponse(content, content_type='application/json')
+    response['Cache-Control'] = 'public, max-age=60'
+    return response
+
+
+@condition(etag_func=incidents_etag)
+def incident_clusters_view(request):
+    """
+    API endpoint returning marker clusters for a map viewport.
+    
+    ?zoom= picks the pyramid level and ?bbox=minLon,minLat,maxLon,maxLat the
+    area (default: the whole map). The heatmap category/severity/time
+    filters apply. Zooms past the deepest level get its clusters; maps show
+    individual points there from the incident points endpoint instead.
+    """
+    try:
+        zoom = max(0, min(int(request.GET.get('zoom', 0)), tiles.MAX_TILE_ZOOM))
+    except ValueError:
+        return JsonResponse({'error': 'zoom must be an integer'}, status=400)
+    bbox = request.GET.get('bbox')
+    try:
+        bbox = geo.parse_bbox(bbox) if bbox else clusters.world_bbox()
+    except ValueError as e:
+        return JsonResponse({'error': f'Invalid bbox: {e}'}, status=400)
+    
+    def build_clusters():
+        level = min(zoom, clusters.MAX_CLUSTER_ZOOM)
+        reports = filter_incidents(IncidentReport.objects.counted(), request.GET)
+        if request.GET.get('time', 'all') != 'all':
+            # The pyramid has no time dimension; bin the filtered reports directly
+            found = clusters.from_reports(level, reports.in_bbox(*bbox))
+        else:
+            found = clusters.from_pyramid(
+                level, bbox, request.GET.get('category', ''), request.GET.get('severity', '')
+            )
+        return json.dumps({'zoom': level, 'clusters': found})
+    
+    content = snapshot.get_or_build('clusters', incidents_etag(request), build_clusters)
+    response = HttpResponse(content, content_type='application/json')
+    response['Cache-Control'] = 'public, max-age=60'
+    return response
+
+
+def rollup_query(params):
+    """
+    Parse the rollup range/area/filter parameters from a GET dict.
+    
+    Returns (start, end, bbox, category, severity); raises ValueError for
+    malformed values.
+    """
+    start, end = (rollups.parse_time(params[key]) if params.get(key) else None for key in ('start', 'end'))
+    start, end = rollups.time_range(start, end)
+    bbox = geo.parse_bbox(params['bbox']) if params.get('bbox') else None
+    return start, end, bbox, params.get('category', ''), params.get('severity', '')
+
+
+@condition(etag_func=rollup_etag)
+def incident_trend_view(request):
+    """
+    API endpoint returning verified incident counts per hour or day.
+    
+    ?start= and ?end= (ISO dates or datetimes, default: the last 30 days)
+    bound the incident dates, ?interval= is 'hour' or 'day' (default), and
+    ?bbox=, ?category= and ?severity= narrow the incidents counted.
+    """
+    interval = request.GET.get('interval', 'day')
+    if interval not in ('hour', 'day'):
+        return JsonResponse({'error': "interval must be 'hour' or 'day'"}, status=400)
+    try:
+        start, end, bbox, category, severity = rollup_query(request.GET)
+    except ValueError as e:
+        return JsonResponse({'error': f'Invalid query: {e}'}, status=400)
+    step = timedelta(hours=1) if interval == 'hour' else timedelta(days=1)
+    if (end - start) / step > rollups.MAX_SERIES_BUCKETS:
+        return JsonResponse(
+            {'error': f'Ranges are limited to {rollups.MAX_SERIES_BUCKETS} {interval}s; use a coarser interval'},
+            status=400,
+        )
+    
+    def build_trend():
+        points = rollups.series(start, end, interval, bbox, category, severity)
+        for point in points:
+            point['start'] = point['start'].isoformat()
+        return json.dumps({
+            'start': start.isoformat(),
+            'end': end.isoformat(),
+            'interval': interval,
+            'total': sum(point['count'] for point in points),
+            'series': points,
+        })
+    
+    content = snapshot.get_or_build('rollups', rollup_etag(request), build_trend)
+    response = HttpResponse(content, content_type='application/json')
+    response['Cache-Control'] = 'public, max-age=60'
+    return response
+
+
+@condition(etag_func=rollup_etag)
+def incident_histogram_view(request):
+    """
+    API endpoint returning verified incident counts by hour of day or day of week.
+    
+    ?by= is 'hour' (0-23, local time, default) or 'weekday' (1 = Monday);
+    the range, area and filter parameters are those of the trend endpoint.
+    """
+    by = request.GET.get('by', 'hour')
+    if by not in ('hour', 'weekday'):
+        return JsonResponse({'error': "by must be 'hour' or 'weekday'"}, status=400)
+    try:
+        start, end, bbox, category, severity = rollup_query(request.GET)
+    except ValueError as e:
+        return JsonResponse({'error': f'Invalid query: {e}'}, status=400)
+    
+    def build_histogram():
+        bins = rollups.histogram(start, end, by, bbox, category, severity)
+        if by == 'weekday':
+            for item in bins:
+                item['label'] = rollups.WEEKDAYS[item['bin'] - 1]
+        return json.dumps({
+            'start': start.isoformat(),
+            'end': end.isoformat(),
+            'by': by,
+            'timezone': timezone.get_current_timezone_name(),
+            'total': sum(item['count'] for item in bins),
+            'bins': bins,
+        })
+    
+    content = snapshot.get_or_build('rollups', rollup_etag(request), build_histogram)
+    response = HttpResponse(content, content_type='application/json')
+    response['Cache-Control'] = 'public, max-age=60'
+    return response
+
+
+def search_view(request):
+    """
+    API endpoint for ranked full-text search over verified reports and discussions.
+    
+    ?q= is the query. ?type= narrows to a comma-separated subset of
+    report/discussion/reply, ?category= to a report or discussion category
+    and ?since=/?until= (ISO dates or datetimes) to a creation window.
+    Page with ?limit= and ?offset= (the response carries next_offset).
+    """
+    query = request.GET.get('q', '').strip()
+    if not search.terms(query):
+        return JsonResponse({'error': 'q must contain at least one word'}, status=400)
+    kinds = [kind for kind in request.GET.get('type', '').split(',') if kind]
+    if any(kind not in search.KINDS for kind in kinds):
+        return JsonResponse({'error': f"type must be one of {', '.join(search.KINDS)}"}, status=400)
+    try:
+        since, until = (rollups.parse_time(request.GET[key]) if request.GET.get(key) else None for key in ('since', 'until'))
+        limit = max(1, min(int(request.GET.get('limit', SEARCH_PAGE_SIZE)), SEARCH_PAGE_SIZE_MAX))
+        offset = max(0, int(request.GET.get('offset', 0)))
+    except ValueError as e:
+        return JsonResponse({'error': f'Invalid query: {e}'}, status=400)
+    
+    # One extra result tells whether there is a next page
+    results = search.search(
+        query, kinds, request.GET.get('category', ''), since=since, until=until, limit=limit + 1, offset=offset,
+    )
+    for result in results:
+        result['created_at'] = result['created_at'].isoformat()
+    return JsonResponse({
+        'query': query,
+        'results': results[:limit],
+        'next_offset': offset + limit if len(results) > limit else None,
+    })
+
+
+@csrf_exempt
+@require_http_methods(['GET', 'POST'])
+def route_score_view(request):
+    """
+    API endpoint scoring a route against the risk grid.
+    
+    Takes ?polyline= (Google encoded) or a POSTed JSON body with "polyline"
+    or "points": [[lat, lng], ...], plus optional categories (comma-separated,
+    or a list in JSON), and returns the risk profile of every segment.
+    POST only carries routes too long for a URL and changes nothing, so it
+    needs no CSRF token.
+    """
+    data = request.GET if request.method == 'GET' else request_data(request)
+    if data is None:
+        return JsonResponse({'error': 'Invalid JSON body'}, status=400)
+    try:
+        if data.get('polyline'):
+            points = risk.decode_polyline(data['polyline'])
+        else:
+            points = [(float(lat), float(lng)) for lat, lng in data.get('points') or []]
+    except (TypeError, ValueError) as e:
+        return JsonResponse({'error': f'Invalid route: {e}'}, status=400)
+    if not 2 <= len(points) <= ROUTE_MAX_POINTS:
+        return JsonResponse({'error': f'A route needs 2 to {ROUTE_MAX_POINTS} points'}, status=400)
+    if not all(-90 <= lat <= 90 and -180 <= lng <= 180 for lat, lng in points):
+        return JsonResponse({'error': 'Route coordinates are out of range'}, status=400)
+    
+    categories = data.get('categories') or None
+    if isinstance(categories, str):
+        categories = [category for category in categories.split(',') if category]
+    elif categories is not None and not (
+        isinstance(categories, list) and all(isinstance(category, str) for category in categories)
+    ):
+        return JsonResponse({'error': 'categories must be a list of strings'}, status=400)
+    try:
+        segments = risk.score_route(points, categories)
+    except risk.GridUnavailable as e:
+        return JsonResponse({'error': str(e)}, status=503)
+    
+    length = sum(segment['length_m'] for segment in segments)
+    mean = sum(segment['risk'] * segment['length_m'] for segment in segments) / length if length else 0.0
+    return JsonResponse({
+        'segments': segments,
+        'length_m': round(length, 1),
+        'risk': round(mean, 4),
+        'peak': max(segment['peak'] for segment in segments),
+        'level': risk.level(mean),
+    })
+
+
 def report_detail_view(request, report_id):
     """Incident details page"""
     report = get_object_or_404(IncidentReport, id=report_id)
+    report.helpful_count += votes.pending(report.pk)
     images = report.images.all()
     is_helpful = False
     
     if request.user.is_authenticated:
         is_helpful = HelpfulReport.objects.filter(user=request.user, report=report).exists()
     
+    # Only images of verified reports are public
+    similar_images = perceptual.similar_to_report(report, images=IncidentImage.objects.filter(report__is_verified=True))
+    
     context = {
         'report': report,
         'images': images,
         'is_helpful': is_helpful,
+        'similar_images': similar_images,
     }
     return render(request, 'reports/report_detail.html', context)
 
@@ -194,12 +506,12 @@ def report_detail_view(request, report_id):
 @login_required
 def mark_helpful_view(request, report_id):
     """Mark a report as helpful"""
-    report = get_object_or_404(IncidentReport, id=report_id)
+    report = get_object_or_404(IncidentReport.objects.only('pk'), id=report_id)
+    # The unique (user, report) constraint decides whether this is a new vote
     helpful, created = HelpfulReport.objects.get_or_create(user=request.user, report=report)
     
     if created:
-        report.helpful_count += 1
-        report.save()
+        votes.record_vote(report.pk)
         messages.success(request, 'Thank you for marking this report as helpful!')
     else:
         messages.info(request, 'You have already marked this report as helpful.')
@@ -207,41 +519,95 @@ def mark_helpful_view(request, report_id):
     return redirect('reports:report_detail', report_id=report_id)
 
 
+def gallery_listing(params):
+    """Gallery images (of verified reports) for the type/category filters in a GET dict"""
+    image_type = params.get('type', 'all')
+    category = params.get('category', '')
+    
+    images = IncidentImage.objects.filter(report__is_verified=True)
+    
+    if image_type == 'suspect':
+        images = images.filter(image_type='suspect')
+    elif image_type == 'location':
+        images = images.filter(image_type='location')
+    
+    if category:
+        images = images.filter(report__category=category)
+    
+    return images.select_related('report'), image_type, category
+
+
+def gallery_page(images, image_type, category, cursor):
+    """Keyset page of a gallery listing, cached per filter/cursor; raises ValueError if the cursor is malformed"""
+    return reports_cache.get_or_set(
+        'gallery', [image_type, category, cursor], lambda: paging.page(images, cursor, GALLERY_PAGE_SIZE),
+    )
+
+
+def next_page_query(params, page):
+    """Query string of the page after page (keeping the other GET params), or None on the last page"""
+    if not page.has_next:
+        return None
+    params = params.copy()
+    params['cursor'] = page.next_cursor
+    return params.urlencode()
+
+
+def page_items_response(request, page, template_name, context, items_url, page_url):
+    """JSON fragment of a listing page for infinite scroll"""
+    next_query = next_page_query(request.GET, page)
+    return JsonResponse({
+        'html': render_to_string(template_name, context, request=request),
+        'next_cursor': page.next_cursor,
+        'next_url': f'{reverse(items_url)}?{next_query}' if next_query else None,
+        'page_url': f'{reverse(page_url)}?{next_query}' if next_query else None,
+    })
+
+
 def gallery_view(request):
     """Suspects & Risk Locations Gallery"""
     try:
-        image_type = request.GET.get('type', 'all')
-        category = request.GET.get('category', '')
-        
-        images = IncidentImage.objects.filter(report__is_verified=True)
-        
-        if image_type == 'suspect':
-            images = images.filter(image_type='suspect')
-        elif image_type == 'location':
-            images = images.filter(image_type='location')
-        
-        if category:
-            images = images.filter(report__category=category)
-        
-        images = images.order_by('-created_at')
-        
-        # Pagination
-        paginator = Paginator(images, 12)
-        page_number = request.GET.get('page')
-        page_obj = paginator.get_page(page_number)
+        images, image_type, category = gallery_listing(request.GET)
+        page = gallery_page(images, image_type, category, request.GET.get('cursor', ''))
+        total = paging.estimated_total(images, 'gallery', image_type, category)
+    except ValueError:
+        raise Http404('Invalid page')
     except Exception as e:
         # If database tables don't exist yet, use empty defaults
-        from django.core.paginator import EmptyPage, PageNotAnInteger
-        page_obj = None
+        page = None
+        total = 0
     
+    params = request.GET.copy()
+    params.pop('cursor', None)
     context = {
-        'page_obj': page_obj,
+        'page': page,
+        'estimated_total': total,
+        'base_query': params.urlencode(),
+        'next_query': next_page_query(request.GET, page) if page else None,
         'selected_type': image_type if 'image_type' in locals() else 'all',
         'selected_category': category if 'category' in locals() else '',
     }
     return render(request, 'reports/gallery.html', context)
 
 
+def gallery_items_view(request):
+    """
+    JSON fragment of the gallery page at ?cursor= for infinite scroll.
+    
+    Returns {'html', 'next_cursor', 'next_url', 'page_url'}; next_url is the
+    fragment of the following page and page_url its full page (both None on
+    the last page).
+    """
+    images, image_type, category = gallery_listing(request.GET)
+    try:
+        page = gallery_page(images, image_type, category, request.GET.get('cursor', ''))
+    except ValueError:
+        return JsonResponse({'error': 'Invalid cursor'}, status=400)
+    return page_items_response(
+        request, page, 'reports/gallery_items.html', {'page': page}, 'reports:gallery_items', 'reports:gallery',
+    )
+
+
 def safety_tips_view(request):
     """Safety tips page"""
     return render(request, 'reports/safety_tips.html')
@@ -264,53 +630,278 @@ def save_zone_view(request):
     return render(request, 'reports/save_zone.html', {'form': form})
 
 
+def serialize_incident_row(row):
+    """Turn an INCIDENT_EXPORT_FIELDS values_list row into the API dict"""
+    report_id, title, category, severity, latitude, longitude, location_name, incident_date = row
+    return {
+        'id': report_id,
+        'title': title,
+        'category': category,
+        'severity': severity,
+        'latitude': float(latitude),
+        'longitude': float(longitude),
+        'location_name': location_name or '',
+        'incident_date': incident_date.isoformat(),
+    }
+
+
+def stream_incidents(rows):
+    """Yield a {"incidents": [...]} JSON document one row at a time"""
+    yield '{"incidents": ['
+    first = True
+    for row in rows:
+        if not first:
+            yield ', '
+        yield json.dumps(serialize_incident_row(row))
+        first = False
+    yield ']}'
+
+
+@condition(etag_func=incidents_etag)
 def get_incidents_json(request):
-    """API endpoint for getting incidents as JSON (for map)"""
-    reports = IncidentReport.objects.filter(is_verified=True)
-    
-    incidents = []
-    for report in reports:
-        incidents.append({
-            'id': report.id,
-            'title': report.title,
-            'category': report.category,
-            'severity': report.severity,
-            'latitude': float(report.latitude),
-            'longitude': float(report.longitude),
-            'location_name': report.location_name or '',
-            'incident_date': report.incident_date.isoformat(),
-        })
+    """
+    API endpoint for getting incidents as JSON (for map).
+    
+    Supports keyset paging with ?after_id=&limit= and a constant-memory
+    streamed export with ?stream=1 (both ordered by id).
+    """
+    reports = IncidentReport.objects.counted()
+    
+    # Optional ?bbox=minLon,minLat,maxLon,maxLat answered from the geohash index
+    bbox = request.GET.get('bbox')
+    if bbox:
+        try:
+            # Unordered, so the planner can drive the query from the geohash index
+            reports = reports.in_bbox(*geo.parse_bbox(bbox)).order_by()
+        except ValueError as e:
+            return JsonResponse({'error': f'Invalid bbox: {e}'}, status=400)
+    
+    try:
+        after_id = int(request.GET.get('after_id', 0) or 0)
+        limit = request.GET.get('limit')
+        limit = int(limit) if limit else None
+    except ValueError:
+        return JsonResponse({'error': 'after_id and limit must be integers'}, status=400)
+    if limit is not None and limit < 1:
+        return JsonResponse({'error': 'limit must be positive'}, status=400)
+    
+    stream = request.GET.get('stream', '').lower() in ['1', 'true', 'yes']
+    paged = 'after_id' in request.GET or limit is not None
+    
+    if stream or paged:
+        reports = reports.filter(id__gt=after_id).order_by('id')
+    rows = reports.values_list(*INCIDENT_EXPORT_FIELDS)
+    
+    if stream:
+        if limit is not None:
+            rows = rows[:limit]
+        return StreamingHttpResponse(
+            stream_incidents(rows.iterator(chunk_size=INCIDENT_STREAM_CHUNK_SIZE)),
+            content_type='application/json',
+        )
+    
+    def build_page():
+        page_size = min(limit or INCIDENT_PAGE_SIZE, INCIDENT_PAGE_SIZE_MAX)
+        incidents = [serialize_incident_row(row) for row in rows[:page_size]]
+        next_after_id = incidents[-1]['id'] if len(incidents) == page_size else None
+        return json.dumps({'incidents': incidents, 'next_after_id': next_after_id})
+    
+    def build_all():
+        incidents = [serialize_incident_row(row) for row in rows.iterator(chunk_size=INCIDENT_STREAM_CHUNK_SIZE)]
+        return json.dumps({'incidents': incidents})
+    
+    content = snapshot.get_or_build('incidents', incidents_etag(request), build_page if paged else build_all)
+    return HttpResponse(content, content_type='application/json')
+
+
+@gzip_page
+@condition(etag_func=incidents_etag)
+def incident_points_view(request):
+    """
+    API endpoint returning verified incident points in the compact binary format.
+    
+    Accepts the heatmap filters and ?bbox=; see reports.packing for the layout.
+    """
+    reports = filter_incidents(IncidentReport.objects.counted(), request.GET)
+    bbox = request.GET.get('bbox')
+    if bbox:
+        try:
+            reports = reports.in_bbox(*geo.parse_bbox(bbox))
+        except ValueError as e:
+            return JsonResponse({'error': f'Invalid bbox: {e}'}, status=400)
+    
+    def build_points():
+        rows = reports.order_by('geohash', 'id').values_list(*packing.POINT_FIELDS)
+        return packing.encode(rows.iterator(chunk_size=INCIDENT_STREAM_CHUNK_SIZE))
+    
+    content = snapshot.get_or_build('incidents', incidents_etag(request), build_points)
+    response = HttpResponse(content, content_type='application/octet-stream')
+    response['Cache-Control'] = 'public, max-age=60'
+    return response
+
+
+def incident_detail_json_view(request, report_id):
+    """API endpoint with the popup details of one verified incident, loaded on click"""
+    report = get_object_or_404(
+        IncidentReport.objects.filter(is_verified=True).prefetch_related('images'), id=report_id
+    )
+    first_image = next(iter(report.images.all()), None)
+    response = JsonResponse({
+        'id': report.id,
+        'title': report.title,
+        'category': report.get_category_display(),
+        'severity': report.severity,
+        'location_name': report.location_name or '',
+        'incident_date': report.incident_date.isoformat(),
+        'url': reverse('reports:report_detail', args=[report.id]),
+        # Only the blurred variant is public before a click-through
+        'image': first_image.blurred_url if first_image and first_image.blurred_url else None,
+    })
+    response['Cache-Control'] = 'public, max-age=60'
+    return response
+
+
+def upload_session_json(session):
+    return {
+        'id': str(session.pk),
+        'kind': session.kind,
+        'filename': session.filename,
+        'size': session.total_size,
+        'chunk_size': session.chunk_size,
+        'offset': session.received_bytes,
+        'status': session.status,
+        'url': reverse('reports:upload_part', args=[session.pk]),
+    }
+
+
+def request_data(request):
+    """Parameters of a small JSON or form-encoded API request"""
+    if request.content_type == 'application/json':
+        try:
+            data = json.loads(request.body or b'{}')
+        except ValueError:
+            return None
+        return data if isinstance(data, dict) else None
+    return request.POST
+
+
+@login_required
+@require_http_methods(['POST'])
+def upload_create_view(request):
+    """Start a resumable video/audio upload"""
+    data = request_data(request)
+    if data is None:
+        return JsonResponse({'error': 'Invalid JSON body'}, status=400)
+    try:
+        session = uploads.create_session(
+            request.user,
+            kind=data.get('kind'),
+            filename=data.get('filename', ''),
+            total_size=data.get('size'),
+            content_type=data.get('content_type', ''),
+            checksum=data.get('checksum', ''),
+        )
+    except uploads.UploadError as e:
+        return JsonResponse({'error': str(e)}, status=e.status)
+    return JsonResponse(upload_session_json(session), status=201)
+
+
+@login_required
+@require_http_methods(['GET', 'HEAD', 'PUT'])
+def upload_part_view(request, upload_id):
+    """GET/HEAD: the upload's status and offset; PUT: the next part, at the Upload-Offset header"""
+    session = get_object_or_404(UploadSession, pk=upload_id, user=request.user)
+    if request.method == 'PUT':
+        try:
+            offset = int(request.headers.get('Upload-Offset', ''))
+            length = int(request.headers.get('Content-Length', ''))
+        except ValueError:
+            return JsonResponse({'error': 'Upload-Offset and Content-Length headers are required'}, status=400)
+        try:
+            # The body is streamed from the request, never read into memory at once
+            uploads.write_part(session, offset, request, length)
+        except uploads.UploadError as e:
+            session.refresh_from_db()
+            response = JsonResponse({'error': str(e), **upload_session_json(session)}, status=e.status)
+            response['Upload-Offset'] = session.received_bytes
+            return response
+    response = JsonResponse(upload_session_json(session))
+    response['Upload-Offset'] = session.received_bytes
+    response['Cache-Control'] = 'no-store'
+    return response
+
+
+@login_required
+@require_http_methods(['POST'])
+def upload_complete_view(request, upload_id):
+    """Attach a fully uploaded file to one of the user's reports"""
+    session = get_object_or_404(UploadSession, pk=upload_id, user=request.user)
+    data = request_data(request)
+    if data is None:
+        return JsonResponse({'error': 'Invalid JSON body'}, status=400)
+    try:
+        report = IncidentReport.objects.get(pk=int(data.get('report_id')), user=request.user)
+    except (TypeError, ValueError, IncidentReport.DoesNotExist):
+        return JsonResponse({'error': 'report_id must be one of your reports'}, status=400)
+    try:
+        uploads.finish(session, report, description=data.get('description', ''))
+    except uploads.UploadError as e:
+        return JsonResponse({'error': str(e)}, status=e.status)
+    return JsonResponse(upload_session_json(session), status=202)
+
+
+def community_listing(params):
+    """Discussions for the category filter in a GET dict"""
+    category_filter = params.get('category', 'all')
+    
+    discussions = CommunityDiscussion.objects.all().select_related('user')
     
-    return JsonResponse({'incidents': incidents})
+    if category_filter != 'all':
+        discussions = discussions.filter(category=category_filter)
+    
+    return discussions, category_filter
 
 
 @login_required
 def community_discussion_view(request):
     """Community discussion page"""
     try:
-        category_filter = request.GET.get('category', 'all')
-        
-        discussions = CommunityDiscussion.objects.all().select_related('user').order_by('-created_at')
-        
-        if category_filter != 'all':
-            discussions = discussions.filter(category=category_filter)
-        
-        # Pagination
-        paginator = Paginator(discussions, 10)
-        page_number = request.GET.get('page')
-        page_obj = paginator.get_page(page_number)
+        discussions, category_filter = community_listing(request.GET)
+        page = paging.page(discussions, request.GET.get('cursor', ''), COMMUNITY_PAGE_SIZE)
+        total = paging.estimated_total(discussions, 'community', category_filter)
+    except ValueError:
+        raise Http404('Invalid page')
     except Exception as e:
         # If database tables don't exist yet, use empty defaults
-        page_obj = None
+        page = None
+        total = 0
         category_filter = 'all'
     
+    params = request.GET.copy()
+    params.pop('cursor', None)
     context = {
-        'page_obj': page_obj,
+        'page': page,
+        'estimated_total': total,
+        'base_query': params.urlencode(),
+        'next_query': next_page_query(request.GET, page) if page else None,
         'selected_category': category_filter,
     }
     return render(request, 'reports/community.html', context)
 
 
+@login_required
+def community_items_view(request):
+    """JSON fragment of the community page at ?cursor= for infinite scroll (same shape as gallery_items_view)"""
+    discussions, _ = community_listing(request.GET)
+    try:
+        page = paging.page(discussions, request.GET.get('cursor', ''), COMMUNITY_PAGE_SIZE)
+    except ValueError:
+        return JsonResponse({'error': 'Invalid cursor'}, status=400)
+    return page_items_response(
+        request, page, 'reports/community_items.html', {'page': page}, 'reports:community_items', 'reports:community',
+    )
+
+
 @login_required
 def create_discussion_view(request):
     """Create a new discussion post"""
@@ -374,3 +965,64 @@ def about_view(request):
     """About page"""
     return render(request, 'reports/about.html')
 
+
+@staff_member_required
+def perf_view(request):
+    """Per-URL request timings collected by PerfMiddleware (staff only)"""
+    if request.method == 'POST':
+        perf.reset()
+        messages.success(request, 'Performance samples cleared.')
+        return redirect('admin_perf')
+    
+    context = {
+        **admin.site.each_context(request),
+        'title': 'Request performance',
+        'enabled': settings.SAFEROUTE_PERF,
+        'window': settings.SAFEROUTE_PERF_WINDOW,
+        'rows': perf.summary(),
+        'histogram_labels': perf.histogram_labels(),
+    }
+    return render(request, 'admin/perf.html', context)
+
+
+@staff_member_required
+def moderation_queue_view(request):
+    """Pending reports in priority order, with bulk verify/reject (staff only)"""
+    if request.method == 'POST':
+        if not request.user.has_perm('reports.change_incidentreport'):
+            messages.error(request, 'You do not have permission to moderate reports.')
+        else:
+            report_ids = [int(pk) for pk in request.POST.getlist('report_ids') if pk.isdigit()]
+            action = request.POST.get('action')
+            if action == 'verify':
+                messages.success(request, f'{moderation.verify(report_ids)} report(s) verified.')
+            elif action == 'reject':
+                messages.success(request, f'{moderation.reject(report_ids)} report(s) rejected.')
+        # Decided reports drop out of the queue, so the same page shows the next ones
+        return redirect(request.get_full_path())
+    
+    category = request.GET.get('category', '')
+    severity = request.GET.get('severity', '')
+    try:
+        size = max(1, min(int(request.GET.get('size', moderation.QUEUE_PAGE_SIZE)), moderation.QUEUE_PAGE_SIZE_MAX))
+        reports, next_cursor = moderation.page(request.GET.get('cursor'), size, category, severity)
+    except ValueError:
+        raise Http404('Invalid page')
+    
+    params = request.GET.copy()
+    params.pop('cursor', None)
+    context = {
+        **admin.site.each_context(request),
+        'title': 'Moderation queue',
+        'reports': reports,
+        'pending_count': moderation.pending().count(),
+        'next_cursor': next_cursor,
+        'base_query': params.urlencode(),
+        'categories': IncidentReport.CATEGORY_CHOICES,
+        'severities': IncidentReport.SEVERITY_CHOICES,
+        'selected_category': category,
+        'selected_severity': severity,
+        'size': size,
+        'page_sizes': [50, 100, 200, moderation.QUEUE_PAGE_SIZE_MAX],
+    }
+    return render(request, 'admin/moderation.html', context)
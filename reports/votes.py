@@ -0,0 +1,104 @@
+"""
+Helpful-vote counting.
+
+HelpfulReport rows (unique per user and report) are the source of truth;
+IncidentReport.helpful_count is a denormalised counter kept in step with
+them. The counter is only ever changed with an atomic
+F('helpful_count') + n UPDATE of that one column, so concurrent votes
+cannot overwrite each other and no other column is rewritten.
+
+With SAFEROUTE_HELPFUL_BUFFER enabled, votes are not written one by one.
+They are coalesced per report in process memory and flushed in bulk when
+SAFEROUTE_HELPFUL_FLUSH_SIZE votes are pending, or
+SAFEROUTE_HELPFUL_FLUSH_INTERVAL seconds after the first pending vote, or
+at process exit. A hot report then takes one row lock per flush instead of
+one per click. Votes still pending when a process dies are lost from the
+counter only; reconcile_helpful_counts rebuilds it from HelpfulReport.
+"""
+import atexit
+import threading
+from collections import Counter
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import F
+
+from .models import IncidentReport
+
+_pending = Counter()
+_lock = threading.Lock()
+_timer = None
+
+
+def buffering():
+    return getattr(settings, 'SAFEROUTE_HELPFUL_BUFFER', False)
+
+
+def add_votes(report_id, count=1):
+    """Atomically add votes to a report's counter"""
+    # helpful_count is not tracked and appears in no cached payload
+    IncidentReport.objects.untracked().filter(pk=report_id).update(helpful_count=F('helpful_count') + count)
+
+
+def record_vote(report_id):
+    """Count a new HelpfulReport for a report, once the surrounding transaction commits"""
+    if buffering():
+        transaction.on_commit(lambda: _buffer_vote(report_id))
+    else:
+        add_votes(report_id)
+
+
+def _buffer_vote(report_id):
+    global _timer
+    with _lock:
+        _pending[report_id] += 1
+        size = sum(_pending.values())
+        if _timer is None:
+            _timer = threading.Timer(getattr(settings, 'SAFEROUTE_HELPFUL_FLUSH_INTERVAL', 5), _flush_from_timer)
+            _timer.daemon = True
+            _timer.start()
+    if size >= getattr(settings, 'SAFEROUTE_HELPFUL_FLUSH_SIZE', 100):
+        flush()
+
+
+def _flush_from_timer():
+    try:
+        flush()
+    finally:
+        # The timer thread opened its own connection
+        connections.close_all()
+
+
+def pending(report_id):
+    """Votes for a report that are buffered but not yet written"""
+    with _lock:
+        return _pending.get(report_id, 0)
+
+
+def flush():
+    """Write every buffered vote, with one UPDATE per distinct vote count"""
+    global _timer
+    with _lock:
+        votes = dict(_pending)
+        _pending.clear()
+        if _timer is not None:
+            _timer.cancel()
+            _timer = None
+    by_count = {}
+    for report_id, count in votes.items():
+        by_count.setdefault(count, []).append(report_id)
+    try:
+        with transaction.atomic():
+            for count, report_ids in by_count.items():
+                IncidentReport.objects.untracked().filter(pk__in=report_ids).update(
+                    helpful_count=F('helpful_count') + count
+                )
+    except Exception:
+        # Put the votes back so a later flush can retry them
+        with _lock:
+            _pending.update(votes)
+        raise
+    return sum(votes.values())
+
+
+atexit.register(lambda: _pending and flush())
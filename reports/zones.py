@@ -0,0 +1,184 @@
+"""
+Matching verified reports against users' saved zones.
+
+Each SavedZone is indexed by the geohash cells its circle's bounding box
+overlaps (ZoneCell rows), using at most MAX_ZONE_CELLS cells and cells no
+finer than ZONE_CELL_PRECISION. Large zones therefore use coarser cells,
+so a report's candidate zones are those indexed under any prefix of its
+geohash up to that precision: one indexed IN lookup. Candidates are then
+refined with the haversine distance to the zone's centre.
+
+Matches are written as ZoneAlert rows, one per user and report (for the
+nearest of the user's zones). They are maintained from
+changes.verified_incidents_changed, so a report gains its alerts when it
+is verified and loses them when it is unverified, moved or deleted. When a
+zone is saved its cells are rebuilt at once and a 'backfill_zone_alerts'
+job (see reports.jobs) matches the verified reports of the last
+BACKFILL_WINDOW.
+"""
+from datetime import timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+from . import feed, geo, jobs
+from .models import IncidentReport, SavedZone, ZoneAlert, ZoneCell
+
+# Finest geohash precision used for zone cells (about 4.9km x 4.9km)
+ZONE_CELL_PRECISION = 5
+
+# Upper bound on the cells indexed per zone
+MAX_ZONE_CELLS = 16
+
+# How far back a new or edited zone is matched against existing reports
+BACKFILL_WINDOW = timedelta(days=30)
+
+# Reports matched per candidate lookup
+BATCH_SIZE = 500
+
+
+def zone_cells(latitude, longitude, radius_km):
+    """Return the geohash cells that together cover a zone's circle"""
+    min_lon, min_lat, max_lon, max_lat = geo.circle_bbox(latitude, longitude, radius_km)
+    if min_lon > max_lon:
+        boxes = [(min_lon, min_lat, 180.0, max_lat), (-180.0, min_lat, max_lon, max_lat)]
+    else:
+        boxes = [(min_lon, min_lat, max_lon, max_lat)]
+    cells = set()
+    for box in boxes:
+        cells.update(geo.cover_bbox(*box, max_cells=MAX_ZONE_CELLS, max_precision=ZONE_CELL_PRECISION))
+    return sorted(cells)
+
+
+def lookup_cells(row):
+    """Every cell a zone containing this report could be indexed under"""
+    geohash = row.get('geohash') or geo.encode(row['latitude'], row['longitude'])
+    return [geohash[:length] for length in range(1, ZONE_CELL_PRECISION + 1)]
+
+
+def index_zone(zone):
+    """Replace a zone's cells"""
+    cells = zone_cells(zone.latitude, zone.longitude, zone.radius)
+    with transaction.atomic():
+        ZoneCell.objects.filter(zone=zone).delete()
+        ZoneCell.objects.bulk_create([ZoneCell(zone=zone, cell=cell) for cell in cells])
+
+
+def _distance(zone, row):
+    return geo.haversine_km(zone.latitude, zone.longitude, row['latitude'], row['longitude'])
+
+
+def _nearest_alerts(matches):
+    """Build one ZoneAlert per (user, report) from (zone, row, distance) matches"""
+    nearest = {}
+    for zone, row, distance in matches:
+        key = (zone.user_id, row['id'])
+        if key not in nearest or distance < nearest[key][2]:
+            nearest[key] = (zone, row, distance)
+    return [
+        ZoneAlert(user_id=zone.user_id, zone=zone, report_id=row['id'],
+                  distance_km=distance, reported_at=row['created_at'])
+        for zone, row, distance in nearest.values()
+    ]
+
+
+def match_reports(rows):
+    """Write alerts for verified report rows (dicts with id, coordinates, geohash, created_at)"""
+    created = 0
+    for start in range(0, len(rows), BATCH_SIZE):
+        batch = rows[start:start + BATCH_SIZE]
+        cells_by_row = {row['id']: set(lookup_cells(row)) for row in batch}
+        candidates = {}
+        for zone_cell in (ZoneCell.objects.filter(cell__in=set().union(*cells_by_row.values()))
+                          .select_related('zone')):
+            candidates.setdefault(zone_cell.cell, []).append(zone_cell.zone)
+
+        matches = []
+        for row in batch:
+            seen = set()
+            for cell in cells_by_row[row['id']]:
+                for zone in candidates.get(cell, ()):
+                    if zone.pk in seen:
+                        continue
+                    seen.add(zone.pk)
+                    distance = _distance(zone, row)
+                    if distance <= float(zone.radius):
+                        matches.append((zone, row, distance))
+        alerts = _nearest_alerts(matches)
+        ZoneAlert.objects.bulk_create(alerts, ignore_conflicts=True)
+        feed.invalidate(alert.user_id for alert in alerts)
+        created += len(alerts)
+    return created
+
+
+def apply_changes(added, removed):
+    """Drop the alerts of reports that left (or moved within) the verified set and match the new rows"""
+    if removed:
+        stale = ZoneAlert.objects.filter(report_id__in=[row['id'] for row in removed])
+        feed.invalidate(stale.values_list('user_id', flat=True))
+        stale.delete()
+    if added:
+        match_reports(added)
+
+
+def backfill_zone(zone, since=None):
+    """Match a zone against verified reports created since `since`; returns alerts considered"""
+    since = since or timezone.now() - BACKFILL_WINDOW
+    rows = (
+        IncidentReport.objects.counted().filter(created_at__gte=since)
+        .in_bbox(*geo.circle_bbox(zone.latitude, zone.longitude, zone.radius))
+        .values('id', 'latitude', 'longitude', 'created_at')
+    )
+    matches = []
+    for row in rows.iterator(chunk_size=BATCH_SIZE):
+        distance = _distance(zone, row)
+        if distance <= float(zone.radius):
+            matches.append((zone, row, distance))
+    alerts = _nearest_alerts(matches)
+    # Keep the nearer zone where the user already has an alert for the report
+    existing = dict(
+        ZoneAlert.objects.filter(user_id=zone.user_id, report_id__in=[alert.report_id for alert in alerts])
+        .values_list('report_id', 'distance_km')
+    )
+    closer = [alert for alert in alerts if alert.distance_km < existing.get(alert.report_id, float('inf'))]
+    with transaction.atomic():
+        ZoneAlert.objects.filter(
+            user_id=zone.user_id, report_id__in=[alert.report_id for alert in closer]
+        ).exclude(zone=zone).delete()
+        ZoneAlert.objects.bulk_create(closer, ignore_conflicts=True)
+    feed.invalidate([zone.user_id])
+    return len(alerts)
+
+
+def zone_changed(zone, created):
+    """Re-index a saved zone and schedule matching it against recent reports"""
+    index_zone(zone)
+    if not created:
+        # The zone may have moved or shrunk; its alerts are rebuilt by the backfill
+        ZoneAlert.objects.filter(zone=zone).delete()
+        feed.invalidate([zone.user_id])
+    jobs.enqueue('backfill_zone_alerts', {'zone_id': zone.pk})
+
+
+def zone_deleted(zone):
+    """Reports that were only alerted for this zone may still fall in another of the user's zones"""
+    feed.invalidate([zone.user_id])
+    for other in SavedZone.objects.filter(user_id=zone.user_id).exclude(pk=zone.pk):
+        jobs.enqueue('backfill_zone_alerts', {'zone_id': other.pk})
+
+
+@jobs.handler('backfill_zone_alerts')
+def backfill_zone_alerts(zone_id):
+    zone = SavedZone.objects.filter(pk=zone_id).first()
+    if zone is not None:
+        backfill_zone(zone)
+
+
+def rebuild():
+    """Re-index every zone and rematch the last BACKFILL_WINDOW of reports; returns the number of zones"""
+    count = 0
+    for zone in SavedZone.objects.iterator():
+        index_zone(zone)
+        backfill_zone(zone)
+        count += 1
+    return count
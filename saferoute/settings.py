@@ -77,6 +77,7 @@ INSTALLED_APPS = [
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
+    'reports.perf.PerfMiddleware',  # no-op unless SAFEROUTE_PERF is set
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -164,6 +165,92 @@ else:
         }
 
 
+# Cache
+# The backend is picked from CACHE_URL:
+#   file:///path/to/dir        shared by every worker on a single host (default: .cache/django)
+#   locmem://                  per-process memory; run_workers refuses it, as job invalidations would not reach the web processes
+#   redis://host:6379/0        shared across hosts, needs the redis package (rediss:// for TLS)
+#   fakeredis://               in-process Redis stand-in for tests, needs the fakeredis package
+#   dummy://                   caching disabled
+
+def _cache_from_url(url):
+    from urllib.parse import urlparse
+    parsed = urlparse(url or 'file://')
+    if parsed.scheme == 'locmem':
+        return {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': parsed.netloc or 'saferoute',
+        }
+    if parsed.scheme == 'file':
+        return {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': parsed.path or str(BASE_DIR / '.cache' / 'django'),
+        }
+    if parsed.scheme in ('redis', 'rediss'):
+        return {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': url,
+        }
+    if parsed.scheme == 'fakeredis':
+        import fakeredis
+        return {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': f'redis://{parsed.netloc or "localhost"}{parsed.path}',
+            'OPTIONS': {'connection_class': fakeredis.FakeConnection},
+        }
+    if parsed.scheme == 'dummy':
+        return {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}
+    raise ValueError(f"Unsupported CACHE_URL scheme: {parsed.scheme!r}")
+
+
+CACHES = {
+    'default': {
+        **_cache_from_url(os.environ.get('CACHE_URL')),
+        'KEY_PREFIX': 'saferoute',
+        'TIMEOUT': 300,
+    }
+}
+
+# Per-namespace TTLs (seconds) for reports.cache
+SAFEROUTE_CACHE_TTLS = {
+    'home': 60,
+    'stats': 60 * 60,
+    'gallery': 120,
+    'heatmap_tile': 60 * 60,
+    'clusters': 60 * 60,
+    'rollups': 60 * 60,
+    'incidents': 60 * 60,
+    # Estimated listing totals (reports.paging); never invalidated, so they lag by up to this
+    'page_totals': 10 * 60,
+    # Per-user dashboard feeds ('feed:<user id>' namespaces)
+    'feed': 60,
+}
+
+# Per-request query/timing instrumentation (reports.perf), shown at /admin/perf/
+SAFEROUTE_PERF = os.environ.get('SAFEROUTE_PERF', '0').lower() in ['1', 'true', 'yes']
+SAFEROUTE_PERF_WINDOW = int(os.environ.get('SAFEROUTE_PERF_WINDOW', '500'))
+
+# Buffer helpful votes in memory and write them in bulk (reports.votes)
+SAFEROUTE_HELPFUL_BUFFER = os.environ.get('SAFEROUTE_HELPFUL_BUFFER', '0').lower() in ['1', 'true', 'yes']
+SAFEROUTE_HELPFUL_FLUSH_SIZE = 100
+SAFEROUTE_HELPFUL_FLUSH_INTERVAL = 5  # seconds
+
+# Background jobs (reports.jobs) are run by `manage.py run_workers`; with
+# SAFEROUTE_JOBS_EAGER they run in the web process after each commit instead
+SAFEROUTE_JOBS_EAGER = os.environ.get('SAFEROUTE_JOBS_EAGER', '0').lower() in ['1', 'true', 'yes']
+# Uploads wait here until a worker stores them; must be shared with the workers
+SAFEROUTE_UPLOAD_STAGING_DIR = os.environ.get('SAFEROUTE_UPLOAD_STAGING_DIR', str(BASE_DIR / 'upload_staging'))
+
+# Resumable video/audio uploads (reports.uploads)
+SAFEROUTE_UPLOAD_CHUNK_SIZE = 5 * 1024 * 1024
+SAFEROUTE_UPLOAD_MAX_SIZE = 500 * 1024 * 1024
+SAFEROUTE_CHUNK_STORE = 'reports.uploads.LocalChunkStore'
+
+# Memory-mapped risk raster for route scoring (reports.risk); shared by the web and job workers.
+# It is derived data, rebuilt when missing, so by default it lives in the local .cache directory
+SAFEROUTE_RISK_GRID_PATH = os.environ.get('SAFEROUTE_RISK_GRID_PATH', str(BASE_DIR / '.cache' / 'risk_grid.bin'))
+
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
@@ -327,6 +414,7 @@ JAZZMIN_SETTINGS = {
     "topmenu_links": [
         # Url that gets reversed (Permissions can be added)
         {"name": "Home", "url": "admin:index", "permissions": ["auth.view_user"]},
+        {"name": "Moderation", "url": "admin_moderation", "permissions": ["reports.change_incidentreport"]},
         
         # external url that opens in a new window (Permissions can be added)
         {"name": "Support", "url": "https://github.com/farridav/django-jazzmin/issues", "new_window": True},
@@ -385,6 +473,7 @@ JAZZMIN_SETTINGS = {
         "auth.Group": "fas fa-users",
         "accounts.CustomUser": "fas fa-user-shield",
         "reports.IncidentReport": "fas fa-exclamation-triangle",
+        "reports.IncidentStat": "fas fa-chart-bar",
         "reports.IncidentImage": "fas fa-image",
         "reports.IncidentVideo": "fas fa-video",
         "reports.IncidentAudio": "fas fa-microphone",
@@ -6,7 +6,11 @@ from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
 
+from reports.views import moderation_queue_view, perf_view
+
 urlpatterns = [
+    path('admin/perf/', perf_view, name='admin_perf'),
+    path('admin/moderation/', moderation_queue_view, name='admin_moderation'),
     path('admin/', admin.site.urls),
     path('', include('reports.urls')),
     path('accounts/', include('accounts.urls')),